@@ -0,0 +1,38 @@
+"""Compare the serial and the two-lane parallel AES-KDF.
+
+The transformed keys of both variants must be bit-identical.
+
+Usage:
+    python benchmarks/bench_kdf.py [rounds]
+"""
+import os
+import sys
+from timeit import default_timer as _timer
+
+# run from a checkout without installing readkeepass
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from readkeepass.kdb.libkeepass import crypto
+
+
+def bench(key, seed, rounds, parallel):
+    "Return (seconds, transformed key) for one run of crypto.transform_key"
+    start = _timer()
+    tkey = crypto.transform_key(key, seed, rounds, parallel=parallel)
+    return _timer() - start, tkey
+
+
+def main(rounds=1000000):
+    key, seed = os.urandom(32), os.urandom(32)
+    t_serial, k_serial = bench(key, seed, rounds, parallel=False)
+    t_parallel, k_parallel = bench(key, seed, rounds, parallel=True)
+    print('rounds:   {}'.format(rounds))
+    print('serial:   {:.3f} s'.format(t_serial))
+    print('parallel: {:.3f} s  x{:.2f}'.format(t_parallel, t_serial / t_parallel))
+    print('identical: {}'.format(k_serial == k_parallel))
+    if k_serial != k_parallel:
+        raise SystemExit('Parallel AES-KDF output differs from serial output!')
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,47 @@
+"""Compare the keystream throughput of pureSalsa20 and fastSalsa20.
+
+Usage:
+    python benchmarks/bench_salsa20.py [n_bytes]
+"""
+import os
+import sys
+from timeit import default_timer as _timer
+
+# run from a checkout without installing readkeepass
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from readkeepass.kdb.libkeepass import fastSalsa20, pureSalsa20
+
+
+def bench(module, data, repeat=3):
+    "Return the best time in seconds to encrypt data with module.Salsa20"
+    key, iv = bytes(32), bytes(8)
+    best = float('inf')
+    for _ in range(repeat):
+        s20 = module.Salsa20(key, iv)
+        start = _timer()
+        s20.encryptBytes(data)
+        best = min(best, _timer() - start)
+    return best
+
+
+def main(n_bytes=64 * 1024):
+    data = os.urandom(n_bytes)
+    results = [
+        ('pureSalsa20', bench(pureSalsa20, data)),
+        ('fastSalsa20', bench(fastSalsa20, data)),
+    ]
+    saved, fastSalsa20._np = fastSalsa20._np, None
+    try:
+        results.append(('fastSalsa20 (no numpy)', bench(fastSalsa20, data)))
+    finally:
+        fastSalsa20._np = saved
+    base = results[0][1]
+    for name, seconds in results:
+        mb_per_s = n_bytes / seconds / 1e6
+        print('{:<24} {:9.4f} s  {:9.2f} MB/s  x{:.1f}'.format(
+            name, seconds, mb_per_s, base / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
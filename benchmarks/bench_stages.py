@@ -0,0 +1,220 @@
+"""Time each stage of loading a KeePass database and showing it in rofi.
+
+Synthetic databases (see kdbx_generator.py) are generated once into a data
+directory and every stage is timed on its own, with the output of the
+previous stage prepared outside of the timing:
+
+    kdf        key derivation (TransformRounds of AES)
+    aes        decryption of the payload
+    blocks     verification of the hashed blocks
+    inflate    gzip decompression
+    parse      parsing the XML document into an element tree
+    extract    extracting the entries without an element tree
+    unprotect  decryption of the protected values
+    format     KeePassEntry.as_formatted_dict of all entries
+    rofi       rendering the rofi menu rows
+    load       all of kdb.load, for reference
+
+The best time of --repeat runs is kept. The results are written as JSON and
+can be compared against a saved baseline; the script exits with status 1 if
+a stage got slower than the tolerance allows.
+
+Usage:
+    python benchmarks/bench_stages.py [--configs small,history]
+        [--output results.json] [--baseline baseline.json]
+"""
+import io
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+from timeit import default_timer as _timer
+
+# run from a checkout without installing readkeepass
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree, objectify
+
+from readkeepass import kdb, rofi
+from readkeepass.kdb import libkeepass
+from readkeepass.kdb.libkeepass import crypto, entries, kdb4, pipeline
+
+import kdbx_generator
+
+# name -> arguments of kdbx_generator.generate
+CONFIGS = {
+    'small': dict(n_entries=1000),
+    'medium': dict(n_entries=10000),
+    'large': dict(n_entries=100000),
+    'huge': dict(n_entries=1000000),
+    'protected': dict(n_entries=1000, protected=kdbx_generator.FIELDS),
+    'history': dict(n_entries=1000, history=5),
+    'attachments': dict(n_entries=1000, attachment_size=64 * 1024),
+    'rounds': dict(n_entries=1000, rounds=600000),
+}
+DEFAULT_CONFIGS = ('small', 'medium', 'protected', 'history', 'attachments',
+                   'rounds')
+STAGES = ('kdf', 'aes', 'blocks', 'inflate', 'parse', 'extract',
+          'unprotect', 'format', 'rofi', 'load')
+# differences below this many seconds are noise
+MIN_SECONDS = 0.002
+
+
+def best_of(repeat, func, setup=None):
+    "Return the best time in seconds of func(setup()) in repeat runs"
+    best = float('inf')
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = _timer()
+        func(arg)
+        best = min(best, _timer() - start)
+    return best
+
+
+def run_pipeline(data, stage):
+    "Feed data through stage and return the output of the last stage"
+    sink = pipeline.BufferSink()
+    pipeline.run(pipeline.read_chunks(io.BytesIO(data)), stage(sink))
+    return sink.buffer.getvalue()
+
+
+def database_path(directory, name):
+    "Return the path of the database of config name, generating it if needed"
+    args = CONFIGS[name]
+    key = '-'.join('{}={}'.format(k, len(v) if isinstance(v, tuple) else v)
+                   for k, v in sorted(args.items()))
+    path = os.path.join(directory, '{}-{}.kdbx'.format(name, key))
+    if not os.path.exists(path):
+        print('Generating {}'.format(path), file=sys.stderr)
+        os.makedirs(directory, exist_ok=True)
+        kdbx_generator.generate(path + '.tmp', **args)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def bench_database(path, repeat, password=kdbx_generator.PASSWORD):
+    "Return a dict of the stages and their best times for the database path"
+    times = {}
+    reader = kdb4.KDB4File(password=password)
+    with io.open(path, 'rb') as fh:
+        reader._read_header(fh)
+        fh.seek(reader.header_length)
+        payload = fh.read()
+    header = reader.header
+
+    times['kdf'] = best_of(repeat, lambda _: reader._make_master_key())
+    decryptor = lambda sink: pipeline.Decrypt(
+        crypto.AESCBCDecryptor(reader.master_key, header.EncryptionIV), sink)
+    times['aes'] = best_of(repeat, lambda _: run_pipeline(payload, decryptor))
+    blocks = run_pipeline(payload, decryptor)
+
+    unblock = lambda sink: pipeline.StartBytes(
+        header.StreamStartBytes, pipeline.HashedBlocks(sink))
+    times['blocks'] = best_of(repeat, lambda _: run_pipeline(blocks, unblock))
+    xml = run_pipeline(blocks, unblock)
+    if header.CompressionFlags == 1:
+        times['inflate'] = best_of(
+            repeat, lambda _: run_pipeline(xml, pipeline.Inflate))
+        xml = run_pipeline(xml, pipeline.Inflate)
+
+    # huge_tree like the readers: large documents exceed libxml2's limits
+    times['parse'] = best_of(
+        repeat, lambda _: objectify.fromstring(
+            xml, objectify.makeparser(huge_tree=True)))
+
+    def extract(_):
+        target = entries.EntryTarget()
+        parser = etree.XMLParser(target=target, huge_tree=True)
+        parser.feed(xml)
+        return parser.close()
+    times['extract'] = best_of(repeat, extract)
+
+    def protected_reader():
+        with io.open(path, 'rb') as fh:
+            return entries.KDB4EntryReader(fh, unprotect=False,
+                                           password=password)
+    times['unprotect'] = best_of(repeat, lambda r: r.unprotect(),
+                                 protected_reader)
+
+    dicts = kdb.load_entries(path, password=password)
+    fresh_entries = lambda: [kdb.KeePassEntry(d) for d in dicts]
+    times['format'] = best_of(
+        repeat, lambda es: [e.as_formatted_dict for e in es], fresh_entries)
+    times['rofi'] = best_of(
+        repeat, lambda es: list(rofi.render_rows(es)), fresh_entries)
+    times['load'] = best_of(repeat, lambda _: kdb.load(path, password=password))
+    return times
+
+
+def compare(results, baseline, tolerance):
+    """Print the results next to the baseline
+
+    Return the list of (config, stage) that got slower than 1 + tolerance
+    times the baseline.
+    """
+    old = {(r['config'], r['stage']): r['seconds'] for r in baseline['results']}
+    slower = []
+    print('{:<12} {:<10} {:>10} {:>10} {:>7}'.format(
+        'config', 'stage', 'baseline', 'now', 'ratio'))
+    for r in results['results']:
+        key = r['config'], r['stage']
+        if key not in old:
+            continue
+        ratio = r['seconds'] / old[key] if old[key] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance and r['seconds'] - old[key] > MIN_SECONDS:
+            slower.append(key)
+            flag = '  slower'
+        print('{:<12} {:<10} {:>10.4f} {:>10.4f} {:>7.2f}{}'.format(
+            key[0], key[1], old[key], r['seconds'], ratio, flag))
+    return slower
+
+
+def main(test_args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--configs', default=','.join(DEFAULT_CONFIGS),
+        help='comma separated names of {} (default: %(default)s)'.format(
+            sorted(CONFIGS)))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--data-dir',
+        default=os.path.join(tempfile.gettempdir(), 'keepass-menu-bench'),
+        help='where the generated databases are kept (default: %(default)s)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare with these saved results')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='allowed slowdown against the baseline (default: %(default)s)')
+    args = parser.parse_args(test_args)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': [],
+    }
+    for name in args.configs.split(','):
+        path = database_path(args.data_dir, name)
+        times = bench_database(path, args.repeat)
+        for stage in STAGES:
+            if stage in times:
+                results['results'].append(
+                    {'config': name, 'stage': stage, 'seconds': times[stage]})
+                print('{:<12} {:<10} {:10.4f} s'.format(name, stage,
+                                                         times[stage]))
+    if args.output:
+        with io.open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with io.open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if compare(results, baseline, args.tolerance):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Write synthetic KDBX 3.1 files for the benchmarks.
+
+The files are built from scratch and written with KDB4Reader.write_to. They
+vary in the number of entries, the protected fields, the depth of the
+entries' history, the size of their attachments and the TransformRounds of
+the key derivation. The same arguments always give the same entries.
+
+Usage:
+    python benchmarks/kdbx_generator.py out.kdbx [-n N_ENTRIES]
+        [--rounds ROUNDS] [--protected Password,Notes] [--history DEPTH]
+        [--attachment-size BYTES] [--no-compress] [--seed SEED]
+
+The password of the generated files is PASSWORD.
+"""
+import io
+import os
+import sys
+import argparse
+import base64
+import random
+from xml.sax.saxutils import escape
+
+# run from a checkout without installing readkeepass
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import objectify
+
+from readkeepass.kdb.libkeepass import kdb4
+
+PASSWORD = 'benchmark'
+FIELDS = ('Title', 'UserName', 'Password', 'URL', 'Notes')
+# entries per group
+GROUP_SIZE = 100
+# every this many entries has an attachment (if attachment_size > 0)
+ATTACHMENT_EVERY = 10
+TIME = '2017-01-01T00:00:00Z'
+_WORDS = ('mail', 'bank', 'shop', 'cloud', 'git', 'forum', 'work', 'home',
+          'vpn', 'wiki', 'chat', 'news', 'music', 'video', 'photo', 'admin')
+_TLDS = ('com', 'org', 'net', 'de', 'co.uk', 'io')
+
+
+def _random_bytes(rng, n):
+    return rng.getrandbits(8 * n).to_bytes(n, 'little') if n else b''
+
+
+def _fields(rng, i):
+    "Return a dict of the string fields of the i-th entry"
+    name = '{}{}'.format(rng.choice(_WORDS), i)
+    return {
+        'Title': '{} {}'.format(name.capitalize(), rng.choice(_WORDS)),
+        'UserName': 'user{}@{}.example'.format(i, rng.choice(_WORDS)),
+        'Password': base64.b64encode(_random_bytes(rng, 15)).decode(),
+        'URL': 'https://{}.{}/login'.format(name, rng.choice(_TLDS)),
+        'Notes': ' '.join(rng.choice(_WORDS)
+                          for _ in range(rng.randrange(0, 30))),
+    }
+
+
+def _uuid(rng):
+    return base64.b64encode(_random_bytes(rng, 16)).decode()
+
+
+def _entry_xml(out, rng, fields, protected, binary_ref=None, history=()):
+    "Append the XML of an entry to the list out"
+    out.append('<Entry><UUID>{}</UUID><IconID>0</IconID><Times>'
+               '<LastModificationTime>{t}</LastModificationTime>'
+               '<CreationTime>{t}</CreationTime>'
+               '<LastAccessTime>{t}</LastAccessTime>'
+               '<ExpiryTime>{t}</ExpiryTime><Expires>False</Expires>'
+               '<UsageCount>0</UsageCount></Times>'.format(_uuid(rng), t=TIME))
+    for key in FIELDS:
+        # Protected="False" marks the values protect() encrypts
+        attrib = ' Protected="False"' if key in protected else ''
+        out.append('<String><Key>{}</Key><Value{}>{}</Value></String>'.format(
+            key, attrib, escape(fields[key])))
+    if binary_ref is not None:
+        out.append('<Binary><Key>attachment{0}.bin</Key>'
+                   '<Value Ref="{0}"/></Binary>'.format(binary_ref))
+    if history:
+        out.append('<History>')
+        for old_fields in history:
+            _entry_xml(out, rng, old_fields, protected)
+        out.append('</History>')
+    out.append('</Entry>')
+
+
+def _document(rng, n_entries, protected, history, attachment_size):
+    "Return the XML document of the database as bytes"
+    out = ['<?xml version="1.0" encoding="utf-8" standalone="yes"?>'
+           '<KeePassFile><Meta><Generator>keepass-menu benchmarks</Generator>'
+           '<HeaderHash/><DatabaseName>synthetic</DatabaseName>'
+           '<MemoryProtection><ProtectTitle>False</ProtectTitle>'
+           '<ProtectUserName>False</ProtectUserName>'
+           '<ProtectPassword>True</ProtectPassword>'
+           '<ProtectURL>False</ProtectURL><ProtectNotes>False</ProtectNotes>'
+           '</MemoryProtection><Binaries>']
+    n_binaries = 0
+    if attachment_size:
+        n_binaries = -(-n_entries // ATTACHMENT_EVERY)
+        for i in range(n_binaries):
+            data = base64.b64encode(_random_bytes(rng, attachment_size))
+            out.append('<Binary ID="{}" Compressed="False">{}</Binary>'.format(
+                i, data.decode()))
+    out.append('</Binaries></Meta><Root><Group><UUID>{}</UUID>'
+               '<Name>Root</Name>'.format(_uuid(rng)))
+    for i in range(n_entries):
+        if i % GROUP_SIZE == 0:
+            if i:
+                out.append('</Group>')
+            out.append('<Group><UUID>{}</UUID><Name>Group {}</Name>'.format(
+                _uuid(rng), i // GROUP_SIZE))
+        binary_ref = None
+        if n_binaries and i % ATTACHMENT_EVERY == 0:
+            binary_ref = i // ATTACHMENT_EVERY
+        old = [_fields(rng, i) for _ in range(history)]
+        _entry_xml(out, rng, _fields(rng, i), protected, binary_ref, old)
+    if n_entries:
+        out.append('</Group>')
+    out.append('</Group></Root></KeePassFile>')
+    return ''.join(out).encode('utf-8')
+
+
+def generate(path, n_entries=1000, protected=('Password',), history=0,
+             attachment_size=0, rounds=6000, compress=True, seed=0,
+             password=PASSWORD):
+    """Write a synthetic KDBX 3.1 file with n_entries entries to path
+
+    protected is the names of the protected fields (see FIELDS), history
+    the number of old versions kept per entry and attachment_size the size
+    in bytes of the attachment of every ATTACHMENT_EVERY-th entry.
+    """
+    rng = random.Random(seed)
+    kdb = kdb4.KDB4Reader(password=password)
+    header = kdb.header
+    header.CipherID = kdb4.CIPHER_AES256
+    header.CompressionFlags = 1 if compress else 0
+    header.MasterSeed = _random_bytes(rng, 32)
+    header.TransformSeed = _random_bytes(rng, 32)
+    header.TransformRounds = rounds
+    header.EncryptionIV = _random_bytes(rng, 16)
+    header.ProtectedStreamKey = _random_bytes(rng, 32)
+    header.StreamStartBytes = _random_bytes(rng, 32)
+    header.InnerRandomStreamID = kdb4.STREAM_SALSA20
+    header.EndOfHeader = b'\r\n\r\n'
+
+    xml = _document(rng, n_entries, set(protected), history, attachment_size)
+    kdb.set_document(objectify.fromstring(xml))
+    with io.open(path, 'wb') as fh:
+        kdb.write_to(fh)
+    return path
+
+
+def main(test_args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='the KDBX file to write')
+    parser.add_argument('-n', '--entries', type=int, default=1000,
+                        help='number of entries (default: %(default)s)')
+    parser.add_argument('--rounds', type=int, default=6000,
+                        help='TransformRounds of the key derivation '
+                        '(default: %(default)s)')
+    parser.add_argument(
+        '--protected', default='Password',
+        help='comma separated protected fields of {} (default: %(default)s)'
+        .format(FIELDS))
+    parser.add_argument('--history', type=int, default=0,
+                        help='old versions kept per entry (default: %(default)s)')
+    parser.add_argument(
+        '--attachment-size', type=int, default=0,
+        help='size in bytes of the attachment of every {}th entry '
+        '(default: %(default)s)'.format(ATTACHMENT_EVERY))
+    parser.add_argument('--no-compress', dest='compress', action='store_false',
+                        help='write the payload without gzip')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random fields (default: %(default)s)')
+    args = parser.parse_args(test_args)
+    protected = [x for x in args.protected.split(',') if x]
+    unknown = set(protected) - set(FIELDS)
+    if unknown:
+        parser.error('unknown fields {}'.format(sorted(unknown)))
+    generate(args.path, args.entries, protected=protected,
+             history=args.history, attachment_size=args.attachment_size,
+             rounds=args.rounds, compress=args.compress, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 """Select entries from KeePass databases using rofi.
 """
 import subprocess
-from readkeepass import rkp
-from keepass_menu import parser
+# readkeepass is imported in the functions below, so that the thin client
+# (keepass_menu.client) can be imported without it
 
 DEBUG = False
 
@@ -27,16 +27,148 @@ def notify_selected(entry):
 
 def get_creds(args, *kp_credentials):
     "Return a list of credentials for all of the dbs in kp_credentials."
+    from readkeepass import rkp
     grab = rkp.GrabCredentials(
         pw_query=args.pw_query,
         use_keyring=args.key_ring,
         del_keyring=args.key_ring_delete,
     )
-    return [grab(*db) for db in kp_credentials]
+    return grab.many(*kp_credentials)
+
+def _known_creds(args, db_paths, credentials, query):
+    """Return the credentials of db_paths, taken from the dict credentials
+
+    The missing ones are queried and added to it, or KeyError is raised if
+    query is False.
+    """
+    if credentials is None:
+        return get_creds(args, *db_paths)
+    missing = [x for x in db_paths if x.db not in credentials]
+    if missing and not query:
+        raise KeyError('No credentials for {}'.format(
+            ', '.join(x.db for x in missing)))
+    if missing:
+        for cred in get_creds(args, *missing):
+            credentials[cred.db] = cred
+    return [credentials[x.db] for x in db_paths]
+
+def iter_databases(args, db_paths=None, credentials=None, query=True):
+    """Return an iterator of (index, KeePassDB) for the databases in db_paths.
+
+    db_paths defaults to args.db_paths; index is a position in it. The
+    databases come in the order they are ready: with args.cache the
+    snapshots of unchanged databases first, then the others as they are
+    unlocked (and their snapshots are renewed). The credentials are queried
+    right away, the databases are only unlocked while iterating.
+
+    credentials is a dict of the KPCredentials of databases by path, which
+    are reused and to which queried credentials are added. With query=False
+    nothing is queried and KeyError is raised for unknown credentials.
+    """
+    from readkeepass import rkp
+    if db_paths is None:
+        db_paths = args.db_paths
+    if not args.cache:
+        return rkp.iter_load_dbs(
+            *_known_creds(args, db_paths, credentials, query))
+    cache = rkp.SnapshotCache(key_store=args.cache)
+    if args.key_ring_delete:
+        for db in db_paths:
+            cache.delete(db.db)
+    snapshots = [cache.load(db.db) for db in db_paths]
+    missing = [i for i, kpdb in enumerate(snapshots) if kpdb is None]
+    creds = _known_creds(args, [db_paths[i] for i in missing], credentials,
+                         query)
+    # the snapshots are of the files as they were before unlocking them
+    identities = {cred.db: cache.identity(cred.db) for cred in creds}
+
+    def iterate():
+        for i, kpdb in enumerate(snapshots):
+            if kpdb is not None:
+                yield i, kpdb
+        for j, kpdb in rkp.iter_load_dbs(*creds):
+            cache.store(kpdb, identities)
+            yield missing[j], kpdb
+    return iterate()
+
+
+def load_databases(args, db_paths=None, credentials=None, query=True):
+    """Load the databases in db_paths (default: args.db_paths).
+
+    With args.cache the entries of unchanged databases come from their
+    snapshots; only the other databases are unlocked (and their snapshots
+    are renewed). See iter_databases() for credentials and query.
+    """
+    kpdbs = dict(iter_databases(args, db_paths, credentials, query))
+    return [kpdbs[i] for i in sorted(kpdbs)]
+
+
+def last_entry(args, history):
+    """Return the entry last selected from the databases, or None.
+
+    history is a readkeepass.frecency.SelectionLog.
+    """
+    uuid = history.last()
+    if uuid is None:
+        return None
+    for kpdb in load_databases(args):
+        for entry in kpdb.entries:
+            if entry.uuid == uuid:
+                return entry.as_ntuple
+    return None
+
+
+def run_agent(args, output_methods):
+    "Keep the databases unlocked and serve keepass_menu.client requests"
+    from keepass_menu import agent
+    from readkeepass import rkp
+
+    credentials = {}
+    loaded = False
+
+    def load(db_paths):
+        nonlocal loaded
+        # only the first load, before the agent serves, may query passwords;
+        # a database changed later is reloaded with the credentials it had
+        kpdbs = load_databases(args, db_paths, credentials, query=not loaded)
+        loaded = True
+        # only delete the keyring entries and snapshots once
+        args.key_ring_delete = False
+        return kpdbs
+
+    agent.Agent(
+        args.db_paths, load, output_methods,
+        default_output=args.output,
+        idle_timeout=args.idle_timeout,
+        notify=notify_selected,
+        history=rkp.SelectionLog() if args.history else None,
+    ).serve_forever()
+    return True
+
+
+def run_search(args):
+    "Print the entries best matching args.query as JSON"
+    import json
+    from readkeepass import rkp, kdb
+    kpdb = kdb.KeePassDB()
+    for d in load_databases(args):
+        kpdb.update(d)
+    databases = {id(entry): db for db, entries in kpdb.items()
+                 for entry in entries}
+    results = []
+    for score, entry in rkp.search(kpdb, ' '.join(args.query), args.limit):
+        fields = {k: str(v) for k, v in entry.as_dict.items()
+                  if k != 'password'}
+        fields.update(score=round(score, 4), database=databases[id(entry)])
+        results.append(fields)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    return True
 
 
 def main(test_args=None):
     "Run keepass-menu"
+    from readkeepass import rkp
+    from keepass_menu import parser
     output_methods = rkp.output.node_leaves
     success, args = parser.get_args(
         output=output_methods,
@@ -45,20 +177,46 @@ def main(test_args=None):
     )
     if not success:
         return False
+    if args.profile:
+        from readkeepass import instrument
+        instrument.enable()
+        try:
+            return run(args, output_methods)
+        finally:
+            instrument.dump(args.profile)
+    return run(args, output_methods)
 
-    # TODO fix this for dbs where there is no password
-    credentials = get_creds(args, *args.db_paths)
-    keepass_databases = [rkp.load_db(*cred) for cred in credentials]
 
-    selected_key, selected_entry = rkp.rofi(*keepass_databases)
-    notify_selected(selected_entry)
+def run(args, output_methods):
+    "Run keepass-menu with the parsed args"
+    from readkeepass import rkp
+    if args.command == 'search':
+        return run_search(args)
+    if args.daemon:
+        return run_agent(args, output_methods)
+
+    history = rkp.SelectionLog() if args.history else None
+    rank = history.scores() if history is not None else None
+    # TODO fix this for dbs where there is no password
+    if args.last:
+        selected_entry = last_entry(args, history or rkp.SelectionLog())
+    elif args.stream:
+        keepass_databases = (kpdb for i, kpdb in iter_databases(args))
+        selected_key, selected_entry = rkp.rofi_stream(keepass_databases,
+                                                       rank=rank)
+    else:
+        keepass_databases = load_databases(args)
+        selected_key, selected_entry = rkp.rofi(*keepass_databases, rank=rank)
 
     try:
-        username, password = selected_entry.username, selected_entry.password
+        username, password = selected_entry.username, str(selected_entry.password)
     except AttributeError:
         print('No entry was selected. Quitting')
         return False
+    notify_selected(selected_entry)
     output_methods[args.output](username=username, password=password)
+    if history is not None:
+        history.record(selected_entry.uuid)
     return True
 
 
@@ -0,0 +1,228 @@
+"""The keepass-menu agent.
+
+keepass-menu --daemon unlocks the databases once and keeps them in memory.
+It answers the requests of keepass_menu.client over a Unix domain socket,
+which only the user can connect to:
+
+    ping                    -> {}
+    menu                    -> {'input': rofi stdin, 'lines': lines per
+                                entry, 'sep': entry separator,
+                                'menu_id': id of this menu}
+    select (index, menu_id, -> {} or {'entry': {...}} for the stdout output
+            output)
+    lock                    -> {}, then the agent exits
+
+A database is reloaded when its file changed. After idle_timeout seconds
+without requests the agent locks itself.
+"""
+import os
+import socket
+import threading
+
+from readkeepass import rofi
+from readkeepass import utils as _utils
+from keepass_menu import client
+
+_logger = _utils.get_logger(__name__)
+
+# lock after 15 minutes without requests
+IDLE_TIMEOUT = 15 * 60
+
+
+def _file_state(db):
+    "Return what changes when the file db is modified or replaced"
+    try:
+        st = os.stat(db)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class Agent:
+    def __init__(self, db_paths, load, output_methods, default_output=None,
+                 idle_timeout=IDLE_TIMEOUT, path=None, notify=None,
+                 history=None):
+        """Create an agent for the databases db_paths
+
+        db_paths is a list of KPCredentials. load is called with a list of
+        them and returns the corresponding KeePassDBs; it is used for the
+        first load and to reload changed databases. output_methods maps the
+        names of output methods to functions (username, password).
+        notify is called with the selected entry. history is a
+        readkeepass.frecency.SelectionLog; the menu is ordered by it and the
+        selections are recorded in it.
+        """
+        self.db_paths = list(db_paths)
+        self.load = load
+        self.output_methods = output_methods
+        self.default_output = default_output or next(iter(output_methods))
+        self.idle_timeout = idle_timeout
+        self.path = path or client.socket_path()
+        self.notify = notify
+        self.history = history
+        self.kpdbs = {}
+        self.states = {}
+        self.menu = None
+        # changes whenever the menu is rebuilt, an index is only valid for
+        # the menu it was selected from
+        self.menu_id = 0
+        self.locked = threading.Event()
+        self.handlers = {
+            'ping': self.handle_ping,
+            'menu': self.handle_menu,
+            'select': self.handle_select,
+            'lock': self.handle_lock,
+        }
+
+    def refresh(self):
+        "(Re)load the databases whose files changed"
+        changed = [cred for cred in self.db_paths
+                   if cred.db not in self.kpdbs or
+                   _file_state(cred.db) != self.states.get(cred.db)]
+        if not changed:
+            return
+        _logger.debug('Loading {}'.format([cred.db for cred in changed]))
+        states = {cred.db: _file_state(cred.db) for cred in changed}
+        for cred, kpdb in zip(changed, self.load(changed)):
+            self.kpdbs[cred.db] = kpdb
+        self.states.update(states)
+        self.menu = None
+
+    def get_menu(self):
+        """Return the rofi command, its stdin and the MenuRows of all entries
+
+        See readkeepass.rofi.prepare.
+        """
+        self.refresh()
+        if self.menu is None:
+            kpdbs = [self.kpdbs[cred.db] for cred in self.db_paths]
+            rank = self.history.scores() if self.history is not None else None
+            self.menu = rofi.prepare(rofi.build_menu(*kpdbs, rank=rank))
+            self.menu_id += 1
+        return self.menu
+
+    def handle_ping(self, request):
+        return {}
+
+    def handle_menu(self, request):
+        cmd, entries, menu_rows = self.get_menu()
+        # only the entries and their format: the client builds the command
+        lines = int(cmd[cmd.index('-eh') + 1]) if '-eh' in cmd else 1
+        sep = cmd[cmd.index('-sep') + 1] if '-sep' in cmd else '+'
+        return {'input': entries.decode(), 'lines': lines, 'sep': sep,
+                'menu_id': self.menu_id}
+
+    def handle_select(self, request):
+        # never rebuild the menu here: the index is a row of the menu the
+        # client showed, not of a reloaded or reordered one
+        if self.menu is None or request.get('menu_id') != self.menu_id:
+            raise ValueError('The menu changed, select again')
+        index = request.get('index')
+        entry = self.menu[2].get(index)
+        if entry is None:
+            raise KeyError('No entry {!r}'.format(index))
+        if self.notify is not None:
+            self.notify(entry)
+        username, password = entry.username, str(entry.password)
+        output = request.get('output') or self.default_output
+        if output == 'stdout':
+            # the client prints it, the agent's stdout is somewhere else
+            answer = {'entry': {'username': username, 'password': password}}
+        else:
+            self.output_methods[output](username=username, password=password)
+            answer = {}
+        if self.history is not None:
+            self.history.record(entry.uuid)
+            # the order of the menu changed
+            self.menu = None
+        return answer
+
+    def handle_lock(self, request):
+        self.lock()
+        return {}
+
+    def handle(self, request):
+        "Return the answer to the request dict"
+        try:
+            handler = self.handlers[request['cmd']]
+            answer = handler(request)
+        except Exception as e:
+            _logger.debug('Request failed: {!r}'.format(e))
+            return {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        answer['ok'] = True
+        return answer
+
+    def lock(self):
+        "Forget the unlocked databases and stop serving"
+        self.kpdbs = {}
+        self.states = {}
+        self.menu = None
+        self.locked.set()
+
+    def _bind(self):
+        "Return the listening socket, only accessible by the user"
+        directory = os.path.dirname(self.path)
+        # create the runtime directory too, makedirs() would not make it private
+        for d in (os.path.dirname(directory), directory):
+            try:
+                os.mkdir(d, 0o700)
+            except FileExistsError:
+                pass
+        client.check_private_dir(directory)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(4)
+        return sock
+
+    @staticmethod
+    def _same_user(conn):
+        "Check that the peer of the connection conn runs as this user"
+        uid = client.peer_uid(conn)
+        return uid is None or uid == os.getuid()
+
+    def _serve_one(self, conn):
+        with conn:
+            conn.settimeout(10)
+            if not self._same_user(conn):
+                return
+            try:
+                request = client.recv_message(conn)
+            except (OSError, ValueError, client.AgentError):
+                return
+            client.send_message(conn, self.handle(request))
+
+    def serve_forever(self, ready=None):
+        """Serve requests until the agent is locked or idle for too long
+
+        ready (a threading.Event) is set once the socket accepts connections.
+        """
+        self.refresh()
+        sock = self._bind()
+        sock.settimeout(self.idle_timeout)
+        _logger.debug('Agent listening on {}'.format(self.path))
+        if ready is not None:
+            ready.set()
+        try:
+            while not self.locked.is_set():
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    _logger.debug('Agent idle, locking')
+                    self.lock()
+                    break
+                self._serve_one(conn)
+        finally:
+            sock.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
@@ -0,0 +1,212 @@
+"""Thin client of the keepass-menu agent.
+
+The agent (keepass-menu --daemon) keeps the KeePass databases unlocked and
+prepares the rofi menu. The client only asks it for the menu, runs rofi and
+sends the selection back, so it gets by with the standard library and starts
+in a few milliseconds.
+
+Messages are single lines of JSON sent over a Unix domain socket. A request
+is a dict with a 'cmd' key, the answer a dict with an 'ok' key and either the
+result or an 'error' message.
+"""
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import argparse
+import subprocess
+
+# maximum size of a message in bytes
+MAX_MESSAGE = 64 * 1024 * 1024
+
+
+class AgentError(Exception):
+    "The agent could not be reached or answered with an error"
+
+
+def check_private_dir(directory):
+    """Raise PermissionError unless directory is only accessible by the user
+
+    The directory must be a real directory (not a symlink) owned by the user
+    with mode 0700, otherwise somebody else could replace the socket in it.
+    """
+    st = os.lstat(directory)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+            or stat.S_IMODE(st.st_mode) != 0o700):
+        raise PermissionError(
+            'Refusing to use {}: it must be a directory owned by the user '
+            'with mode 0700'.format(directory))
+
+
+def socket_path():
+    """Return the path of the agent's Unix domain socket
+
+    PermissionError is raised if one of its existing directories is not
+    private (see check_private_dir()).
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = '/tmp/keepass-menu-{}'.format(os.getuid())
+    directory = os.path.join(runtime_dir, 'keepass-menu')
+    for d in (runtime_dir, directory):
+        if os.path.lexists(d):
+            check_private_dir(d)
+    return os.path.join(directory, 'agent.sock')
+
+
+def peer_uid(sock):
+    "Return the uid of the peer of the Unix socket sock or None if unknown"
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+    return uid
+
+
+def send_message(sock, message):
+    "Send the dict message as one line of JSON"
+    sock.sendall(json.dumps(message).encode() + b'\n')
+
+
+def recv_message(sock):
+    "Receive one line of JSON and return it as dict"
+    chunks = []
+    size = 0
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if chunk.endswith(b'\n') or size > MAX_MESSAGE:
+            break
+    data = b''.join(chunks)
+    if not data.endswith(b'\n'):
+        raise AgentError('Incomplete message')
+    return json.loads(data.decode())
+
+
+def request(message, path=None, timeout=None):
+    """Send the request message to the agent and return its answer
+
+    AgentError is raised if there is no agent or it answered with an error.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path or socket_path())
+        uid = peer_uid(sock)
+        if uid is not None and uid != os.getuid():
+            raise PermissionError(
+                'The agent runs as another user (uid {})'.format(uid))
+        send_message(sock, message)
+        answer = recv_message(sock)
+    except (OSError, ValueError) as e:
+        raise AgentError('Agent not available: {}'.format(e))
+    finally:
+        sock.close()
+    if not answer.get('ok'):
+        raise AgentError(answer.get('error', 'Unknown error'))
+    return answer
+
+
+def rofi_cmd(n_lines_per_key=1, entry_sep='+'):
+    """Return the rofi command for entries of n_lines_per_key lines
+
+    The same command as readkeepass.rofi builds. It is put together here
+    instead of being taken from the agent, which must not choose what the
+    client runs.
+    """
+    n_lines_per_key = int(n_lines_per_key)
+    if n_lines_per_key < 1:
+        raise ValueError('Invalid number of lines {}'.format(n_lines_per_key))
+    cmd = ['rofi', '-fullscreen', '-dmenu', '-i', '-format', 'i']
+    if n_lines_per_key > 1:
+        if not isinstance(entry_sep, str) or len(entry_sep) != 1:
+            raise ValueError('Invalid entry separator {!r}'.format(entry_sep))
+        cmd.extend(['-eh', str(n_lines_per_key), '-sep', entry_sep])
+    return cmd
+
+
+def run_menu(menu):
+    """Run rofi with the menu answer of the agent
+
+    Returns the index of the selected row or None.
+    """
+    cmd = rofi_cmd(menu.get('lines', 1), menu.get('sep', '+'))
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate(menu['input'].encode())
+    try:
+        index = int(stdout)
+    except ValueError:
+        return None
+    return index if index >= 0 else None
+
+
+def select(output=None, path=None):
+    """Let the user select an entry with rofi and output it
+
+    The agent runs the output method, except for 'stdout' which is printed
+    here. Returns True if an entry was selected.
+    """
+    menu = request({'cmd': 'menu'}, path=path)
+    index = run_menu(menu)
+    if index is None:
+        print('No entry was selected. Quitting')
+        return False
+    answer = request({'cmd': 'select', 'index': index,
+                      'menu_id': menu.get('menu_id'), 'output': output},
+                     path=path)
+    entry = answer.get('entry')
+    if entry:
+        sys.stdout.write('@username: {}\n'.format(entry['username']))
+        sys.stdout.write('@password: {}\n'.format(entry['password']))
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        allow_abbrev=False,
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default=None,
+        help="Output method for the selected entry (default: the agent's)",
+    )
+    parser.add_argument(
+        '--lock',
+        help='Lock the agent: it forgets the databases and exits.',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--ping',
+        help='Exit with status 0 if the agent is running.',
+        action='store_true',
+    )
+    return parser
+
+
+def main(test_args=None):
+    "Run the keepass-menu client"
+    args = build_parser().parse_args(test_args)
+    try:
+        if args.ping:
+            request({'cmd': 'ping'}, timeout=1)
+            return True
+        if args.lock:
+            request({'cmd': 'lock'})
+            return True
+        return select(args.output)
+    except AgentError as e:
+        print(e, file=sys.stderr)
+        return False
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
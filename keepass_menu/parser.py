@@ -5,17 +5,18 @@ from readkeepass import utils as _utils
 from operator import attrgetter as _attrgetter
 
 
-def build(output, pw_query):
-    "Build parser"
-    output = list(output)
-    pw_query = list(pw_query)
+def _common_parser(pw_query, argument_default=None):
+    """Return the parser of the options for loading the databases
+
+    They are shared by the main parser and the subcommands. A subcommand's
+    copy uses argument_default=SUPPRESS, so it keeps the options given
+    before the subcommand instead of resetting them to their defaults.
+    """
     db_name = 'KEEPASS_DB'
-    parser = _argparse.ArgumentParser(
-        description=__doc__,
-        allow_abbrev=False,
-    )
+    common = _argparse.ArgumentParser(add_help=False,
+                                      argument_default=argument_default)
 
-    filegrp = parser.add_argument_group(
+    filegrp = common.add_argument_group(
         title='database files',
         description="""\
         Specify the Keepass database and optional key-file paths.
@@ -40,27 +41,23 @@ def build(output, pw_query):
         dest = 'filename',
     )
 
-    parser.add_argument(
-        '-o', '--output',
-        type = str,
-        choices = output,
-        default = output[0],
-        help = """Output selected username & password with this backend.
-        The default output method is {}, and all of the choices are {}.
-        """.format(output[0], output),
-    )
-
-    parser.add_argument(
+    common.add_argument(
         '-pw', '--pw-query',
         type = str,
         choices = pw_query,
-        default = pw_query[0],
         help = """Query the password using this backend.
         By default query uses {}, while the total choices are {}.
         """.format(pw_query[0], pw_query),
     )
 
-    keyring_grp = parser.add_argument_group(
+    common.add_argument(
+        '--profile',
+        help="""Write the duration of each stage (key derivation, decryption,
+        parsing, rofi, ...) as JSON to this file.""",
+        metavar='FILE',
+    )
+
+    keyring_grp = common.add_argument_group(
         title='keyring options',
         description="""Optionally use the desktop's keyring to store and retrieve
         passwords for the KeePass databases.
@@ -76,6 +73,115 @@ def build(output, pw_query):
         help="Remove keyring entry for all of the databases given.",
         action="store_true",
     )
+
+    cache_grp = common.add_argument_group(
+        title='cache options',
+        description="""Optionally keep an encrypted snapshot of the entries of
+        each database, so unchanged databases don't have to be unlocked again.
+        The snapshot key is kept in the desktop keyring or the kernel keyring.
+        """,
+    )
+    cache_grp.add_argument(
+        '-c', '--cache',
+        help="Use snapshots, with the key in KEY_STORE (default: keyring).",
+        nargs='?',
+        const='keyring',
+        choices=['keyring', 'kernel'],
+        metavar='KEY_STORE',
+    )
+
+    return common
+
+
+def build(output, pw_query):
+    "Build parser"
+    output = list(output)
+    pw_query = list(pw_query)
+    parser = _argparse.ArgumentParser(
+        description=__doc__,
+        allow_abbrev=False,
+        parents=[_common_parser(pw_query)],
+    )
+    parser.set_defaults(pw_query=pw_query[0])
+
+    parser.add_argument(
+        '-o', '--output',
+        type = str,
+        choices = output,
+        default = output[0],
+        help = """Output selected username & password with this backend.
+        The default output method is {}, and all of the choices are {}.
+        """.format(output[0], output),
+    )
+
+    parser.add_argument(
+        '-s', '--stream',
+        help="""Show rofi at once and add the entries of each database as
+        soon as it is unlocked.""",
+        action="store_true",
+    )
+
+    history_grp = parser.add_argument_group(
+        title='history options',
+        description="""The selected entries are logged (by their UUID only)
+        to show the most frequently and recently used entries first.""",
+    )
+    history_grp.add_argument(
+        '-l', '--last',
+        help="Output the last selected entry without showing rofi.",
+        action="store_true",
+    )
+    history_grp.add_argument(
+        '--no-history',
+        help="Neither order the entries by nor log the selection.",
+        dest='history',
+        action="store_false",
+    )
+
+    agent_grp = parser.add_argument_group(
+        title='agent options',
+        description="""Optionally keep the databases unlocked in an agent
+        process. Use keepass-menu-client to select entries through it.
+        """,
+    )
+    agent_grp.add_argument(
+        '-d', '--daemon',
+        help="Run as agent instead of selecting an entry.",
+        action="store_true",
+    )
+    agent_grp.add_argument(
+        '--idle-timeout',
+        help="Lock the agent after this many idle seconds (default: %(default)s).",
+        type=float,
+        default=15 * 60,
+        metavar='SECONDS',
+    )
+
+    subparsers = parser.add_subparsers(
+        title='commands',
+        dest='command',
+        metavar='COMMAND',
+    )
+    search = subparsers.add_parser(
+        'search',
+        parents=[_common_parser(pw_query, _argparse.SUPPRESS)],
+        help='Print the entries best matching a query as JSON.',
+        description="""Print the entries best matching QUERY as JSON, without
+        their passwords. The database options can also go after 'search'.""",
+        allow_abbrev=False,
+    )
+    search.add_argument(
+        'query',
+        help='Words to look for in the title, username, url, group and notes.',
+        nargs='+',
+        metavar='QUERY',
+    )
+    search.add_argument(
+        '-n', '--limit',
+        help='Print at most this many entries (default: %(default)s).',
+        type=int,
+        default=10,
+    )
     return parser
 
 
@@ -1,24 +1,39 @@
 from readkeepass import utils
+from readkeepass import instrument
 from readkeepass import kdb
 from readkeepass import userinput
 from readkeepass import rofi
 from readkeepass import output
-from readkeepass import keyring
+from readkeepass import cache
+from readkeepass import search
+from readkeepass import hosts
+from readkeepass import frecency
+from readkeepass import plugins
 
 
 rkp = utils.root
+# secretstorage (and dbus) are only imported when the keyring is used
+rkp.register_lazy(
+    'KeyRing', 'readkeepass.keyring:Credentials',
+    doc="Credentials of a database stored in the desktop keyring",
+)
 
 @rkp.register
 class GrabCredentials:
-    _userinput = rkp.userinput.node_leaves
-    _default_inp = next(iter(_userinput))
+    # plugins are only discovered when a password query is looked up
+    _userinput = rkp.userinput
     _keyring = rkp.KeyRing
 
-    def __init__(self, pw_query=_default_inp, use_keyring=True,
+    def __init__(self, pw_query=None, use_keyring=True,
                  del_keyring=False, **kwargs):
         self.use_keyring = use_keyring
         self.del_keyring = del_keyring
+        if pw_query is None:
+            # the first built-in one
+            pw_query = next(iter(self._userinput.node_leaves))
         self.pw_query = pw_query
+        # db -> credentials found in the keyring by many()
+        self._found = None
 
     def __call__(self, db, keyfile='', password=''):
         self.db = db
@@ -29,16 +44,31 @@ class GrabCredentials:
         self.get_cred()
         return self.credentials
 
+    def many(self, *kp_credentials):
+        """Return the credentials for each of the (db, keyfile, password)
+
+        The keyring is looked up once for all of the databases.
+        """
+        if self.use_keyring and not self.del_keyring:
+            with instrument.stage('keyring', dbs=len(kp_credentials)):
+                self._found = self._keyring.get_many(
+                    [x[0] for x in kp_credentials])
+        try:
+            return [self(*x) for x in kp_credentials]
+        finally:
+            self._found = None
+
     @property
     def pw_query(self):
         return self._pw_query
 
     @pw_query.setter
     def pw_query(self, val):
-        if val in self._userinput:
+        backends = self._userinput.node_leaves
+        if val in backends:
             self._pw_query = val
         else:
-            msg = "{} is not in {}".format(val, backends)
+            msg = "{} is not in {}".format(val, list(backends))
             raise ValueError(msg)
 
     @property
@@ -50,15 +80,22 @@ class GrabCredentials:
 
     def get_cred(self):
         if self.use_keyring:
-            cred = self._keyring(self.db).get()
+            if self._found is not None:
+                cred = self._found.get(self.db)
+            else:
+                with instrument.stage('keyring', dbs=1):
+                    cred = self._keyring(self.db).get()
             if cred:
                 self.password = cred.password
                 self.keyfile = cred.keyfile
                 return True
         prompt = self.db.rsplit('/', maxsplit=1)[-1]
-        self.password = self._userinput[self.pw_query](prompt)
+        with instrument.stage('pw_query', db=self.db):
+            self.password = getattr(self._userinput, self.pw_query)(prompt)
         if self.use_keyring:
-            self._keyring(self.db).set(password=self.password, keyfile=self.keyfile)
+            with instrument.stage('keyring_store', db=self.db):
+                self._keyring(self.db).set(password=self.password,
+                                           keyfile=self.keyfile)
         return True
 
 
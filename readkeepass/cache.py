@@ -0,0 +1,334 @@
+"""
+cache keeps encrypted snapshots of the entries of KeePass databases.
+
+Loading a database means running the key derivation function, decrypting,
+decompressing and parsing the whole file. As long as the file does not
+change, a snapshot of its entries gives the same result much faster.
+
+A snapshot is stored in $XDG_CACHE_HOME/keepass-menu and encrypted with
+AES-CBC and authenticated with HMAC-SHA256 under a random session key. The
+key never touches the disk, it lives in the desktop keyring (Secret Service)
+or in the kernel keyring. Each snapshot is bound to the identity of its
+database file: path, inode, modification time, size and a hash of the file
+header. KeePass writes a new master seed into the header on every save, so
+any change to the file invalidates the snapshot.
+"""
+import io as _io
+import os as _os
+import hmac as _hmac
+import struct as _struct
+import hashlib as _hashlib
+import tempfile as _tempfile
+import subprocess as _subprocess
+from hashlib import md5 as _md5
+
+import readkeepass.utils as _utils
+import readkeepass.instrument as _instrument
+from readkeepass import kdb as _kdb
+from readkeepass.kdb import libkeepass as _libkeepass
+from readkeepass.kdb.libkeepass import crypto as _crypto
+
+_logger = _utils.get_logger(__name__)
+
+MAGIC = b'KPMSNAP1'
+# AES key (32 bytes) followed by HMAC key (32 bytes)
+SESSION_KEY_LENGTH = 64
+# the UUID of an entry is stored in its dict under this key
+UUID_KEY = '\x00uuid'
+_u32 = _struct.Struct('<I')
+
+
+def default_directory():
+    "Return the directory the snapshots are stored in"
+    cache_home = _os.environ.get('XDG_CACHE_HOME') or \
+        _os.path.join(_os.path.expanduser('~'), '.cache')
+    return _os.path.join(cache_home, 'keepass-menu')
+
+
+def file_identity(db):
+    """Return the identity of the database file db as bytes
+
+    It changes whenever the file is replaced or modified.
+    """
+    path = _os.path.realpath(db)
+    header = _libkeepass.read_header(path)
+    with _io.open(path, 'rb') as stream:
+        # stat the opened file, so stat and header belong to the same file
+        st = _os.fstat(stream.fileno())
+        header_hash = _hashlib.sha256(stream.read(header.header_length))
+    fields = [path, st.st_ino, st.st_mtime_ns, st.st_size,
+              header_hash.hexdigest()]
+    return '\0'.join(map(str, fields)).encode()
+
+
+def dumps(entries):
+    "Serialize a list of entry dicts (str -> str) to bytes"
+    out = [_u32.pack(len(entries))]
+    for entry in entries:
+        out.append(_u32.pack(len(entry)))
+        for item in entry.items():
+            for text in item:
+                data = str(text).encode()
+                out.append(_u32.pack(len(data)))
+                out.append(data)
+    return b''.join(out)
+
+
+def loads(data):
+    "Deserialize the entry dicts serialized with dumps"
+    view = memoryview(data)
+    pos = 0
+
+    def read_u32():
+        nonlocal pos
+        value, = _u32.unpack_from(view, pos)
+        pos += _u32.size
+        return value
+
+    def read_str():
+        nonlocal pos
+        length = read_u32()
+        text = str(view[pos:pos + length], 'utf-8')
+        pos += length
+        return text
+
+    entries = []
+    for _ in range(read_u32()):
+        entries.append({read_str(): read_str() for _ in range(read_u32())})
+    return entries
+
+
+def _with_uuid(entry):
+    "Return the dict of the KeePassEntry entry with its UUID under UUID_KEY"
+    if entry.uuid is None:
+        return entry.as_dict
+    d = dict(entry.as_dict)
+    d[UUID_KEY] = entry.uuid
+    return d
+
+
+class KeyringKeyStore:
+    "Keep the session key in the desktop keyring (Secret Service)"
+    label = 'snapshot-session-key'
+
+    def __init__(self, collection_name=None):
+        from readkeepass import keyring
+        self._keyring = keyring
+        if collection_name is None:
+            collection_name = keyring._DEFAULT_COLLECTION
+        self.collection_name = collection_name
+
+    def get(self):
+        with self._keyring.Keyring(self.collection_name) as ring:
+            secret = ring.get_secret(self.label)
+        try:
+            return bytes.fromhex(secret['key'])
+        except (TypeError, KeyError, ValueError):
+            return None
+
+    def set(self, key):
+        with self._keyring.Keyring(self.collection_name) as ring:
+            ring.set_secret(self.label, key=key.hex())
+
+    def delete(self):
+        with self._keyring.Keyring(self.collection_name) as ring:
+            ring.delete_item(self.label)
+
+
+class KernelKeyStore:
+    "Keep the session key in the kernel's user keyring, using keyctl"
+    description = 'keepass-menu:snapshot-session-key'
+
+    def _keyctl(self, *args, data=None):
+        res = _subprocess.run(
+            ['keyctl'] + list(args), input=data,
+            stdout=_subprocess.PIPE, stderr=_subprocess.DEVNULL,
+        )
+        return res.stdout if res.returncode == 0 else None
+
+    def _key_id(self):
+        key_id = self._keyctl('search', '@u', 'user', self.description)
+        return key_id.strip().decode() if key_id else None
+
+    def get(self):
+        key_id = self._key_id()
+        return self._keyctl('pipe', key_id) if key_id else None
+
+    def set(self, key):
+        if self._keyctl('padd', 'user', self.description, '@u',
+                        data=key) is None:
+            raise OSError('Could not add the key to the kernel keyring.')
+
+    def delete(self):
+        key_id = self._key_id()
+        if key_id:
+            self._keyctl('unlink', key_id, '@u')
+
+
+key_stores = {
+    'keyring': KeyringKeyStore,
+    'kernel': KernelKeyStore,
+}
+
+
+@_utils.root.register(name='SnapshotCache')
+class SnapshotCache:
+    """Encrypted snapshots of the entries of KeePass databases
+
+    Usage example:
+        cache = SnapshotCache()
+        entries = cache.get('db2.kdbx')
+        if entries is None:
+            entries = kdb.load_entries('db2.kdbx', password='testpass1234')
+            cache.put('db2.kdbx', entries)
+    """
+
+    def __init__(self, key_store='keyring', directory=None):
+        """Create a snapshot cache
+
+        key_store is the name of one of the key_stores or an object with
+        get(), set(key) and delete() methods for the session key.
+        """
+        if isinstance(key_store, str):
+            key_store = key_stores[key_store]()
+        self.key_store = key_store
+        self.directory = directory or default_directory()
+        self._session_key = None
+
+    def path(self, db):
+        "Return the path of the snapshot of db"
+        name = _md5(_os.path.realpath(db).encode()).hexdigest()
+        return _os.path.join(self.directory, name + '.snapshot')
+
+    def session_key(self, create=False):
+        """Return the session key, optionally creating a new one
+
+        None is returned if the key store fails, e.g. a locked keyring.
+        """
+        try:
+            if self._session_key is None:
+                key = self.key_store.get()
+                if key is not None and len(key) == SESSION_KEY_LENGTH:
+                    self._session_key = key
+            if self._session_key is None and create:
+                key = _os.urandom(SESSION_KEY_LENGTH)
+                self.key_store.set(key)
+                self._session_key = key
+        except Exception as e:
+            # the snapshots are only an optimization
+            _logger.warning('Session key not available: {!r}'.format(e))
+        return self._session_key
+
+    def get(self, db):
+        """Return the entries of the snapshot of db
+
+        None is returned if there is no valid snapshot for the current file.
+        """
+        try:
+            with _io.open(self.path(db), 'rb') as fh:
+                data = fh.read()
+            identity = file_identity(db)
+        except (OSError, IOError, KeyError, _struct.error):
+            return None
+        key = self.session_key()
+        if key is None:
+            return None
+        aes_key, mac_key = key[:32], key[32:]
+
+        head, mac = data[:-32], data[-32:]
+        expected = _hmac.new(mac_key, head + identity, _hashlib.sha256)
+        if not head.startswith(MAGIC) or \
+           not _hmac.compare_digest(expected.digest(), mac):
+            _logger.debug('Snapshot of {} is stale'.format(db))
+            return None
+        iv = head[len(MAGIC):len(MAGIC) + 16]
+        payload = _crypto.aes_cbc_decrypt(head[len(MAGIC) + 16:], aes_key, iv)
+        entries = loads(_crypto.unpad(payload))
+        _logger.debug('Loaded {} entries of {} from snapshot'.format(
+            len(entries), db))
+        return entries
+
+    @staticmethod
+    def identity(db):
+        """Return the file_identity of db, or None if it cannot be read
+
+        Take it before db is unlocked and pass it to put() or store(), so
+        the snapshot is not tied to a file that was replaced meanwhile.
+        """
+        try:
+            return file_identity(db)
+        except (OSError, IOError, KeyError, _struct.error):
+            return None
+
+    def put(self, db, entries, identity=None):
+        """Store a snapshot of the entries (a list of dicts) of db
+
+        identity is the file_identity of db when the entries were read
+        (default: the current one). Nothing is stored if there is no
+        session key.
+        """
+        if identity is None:
+            identity = file_identity(db)
+        key = self.session_key(create=True)
+        if key is None:
+            _logger.debug('No snapshot of {} without session key'.format(db))
+            return
+        aes_key, mac_key = key[:32], key[32:]
+        iv = _os.urandom(16)
+        payload = _crypto.aes_cbc_encrypt(_crypto.pad(dumps(entries)),
+                                          aes_key, iv)
+        head = MAGIC + iv + payload
+        mac = _hmac.new(mac_key, head + identity, _hashlib.sha256).digest()
+
+        _os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        path = self.path(db)
+        # a temporary file of its own, concurrent launches may store too
+        fd, tmp_path = _tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with _io.open(fd, 'wb') as fh:
+                fh.write(head + mac)
+            _os.replace(tmp_path, path)
+        except BaseException:
+            _os.remove(tmp_path)
+            raise
+        _logger.debug('Stored snapshot of {}'.format(db))
+
+    def load(self, db):
+        "Return the snapshot of db as KeePassDB, or None if there is none"
+        with _instrument.stage('snapshot', db=db) as st:
+            entries = self.get(db)
+            if st:
+                st.set(entries=None if entries is None else len(entries))
+        if entries is None:
+            return None
+        entries = [_kdb.KeePassEntry(x, uuid=x.pop(UUID_KEY, None))
+                   for x in entries]
+        return _kdb.KeePassDB(db_path=db, entries=entries)
+
+    def store(self, kpdb, identities=None):
+        """Store snapshots of all databases in the KeePassDB kpdb
+
+        identities is a dict of the identity() of the databases, taken
+        before they were unlocked; a database without one is skipped.
+        Snapshots that cannot be written are logged and skipped, the
+        snapshots are only an optimization.
+        """
+        for db, entries in kpdb.items():
+            identity = None
+            if identities is not None:
+                identity = identities.get(db)
+                if identity is None:
+                    continue
+            try:
+                self.put(db, [_with_uuid(entry) for entry in entries],
+                         identity)
+            except (OSError, IOError, KeyError, _struct.error) as e:
+                _logger.warning('Could not store the snapshot of {}: {!r}'
+                                .format(db, e))
+
+    def delete(self, db):
+        "Remove the snapshot of db"
+        try:
+            _os.remove(self.path(db))
+        except FileNotFoundError:
+            pass
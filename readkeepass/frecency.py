@@ -0,0 +1,167 @@
+"""
+frecency ranks entries by how often and how recently they were selected.
+
+Every selection adds exp(DECAY * t) to the score of the entry, where t is
+the time of the selection. Older selections count half as much per
+HALF_LIFE, and all scores shrink by the same factor as time passes, so the
+scores do not have to be updated to compare them. They are kept as
+logarithms, which do not overflow.
+
+The selections are appended to a log in $XDG_STATE_HOME/keepass-menu, one
+line per selection:
+
+    E <time> <uuid>
+
+Once the log has more than MAX_LINES lines it is compacted into one line
+per entry with its score:
+
+    S <log of the score> <uuid>
+
+Entries are only known by their UUID, the log holds no titles, usernames or
+passwords.
+
+Usage example:
+    log = SelectionLog()
+    rofi.launch_rofi(kpdb, rank=log.scores())
+    log.record(entry.uuid)
+"""
+import io as _io
+import os as _os
+import math as _math
+import time as _time
+
+import readkeepass.utils as _utils
+
+_logger = _utils.get_logger(__name__)
+
+HALF_LIFE = 30 * 24 * 3600
+DECAY = _math.log(2) / HALF_LIFE
+# compact the log when it has more lines
+MAX_LINES = 1000
+# scores of entries not selected for this many half-lives are dropped
+MAX_AGE = 20 * HALF_LIFE
+
+
+def default_path():
+    "Return the path of the selection log"
+    state_home = _os.environ.get('XDG_STATE_HOME') or \
+        _os.path.join(_os.path.expanduser('~'), '.local', 'state')
+    return _os.path.join(state_home, 'keepass-menu', 'selections.log')
+
+
+def _logaddexp(a, b):
+    "Return log(exp(a) + exp(b))"
+    if a < b:
+        a, b = b, a
+    if b == -_math.inf:
+        return a
+    return a + _math.log1p(_math.exp(b - a))
+
+
+@_utils.root.register(name='SelectionLog')
+class SelectionLog:
+    """The log of selected entries and their frecency scores
+
+    Usage example:
+        log = SelectionLog()
+        log.record(entry.uuid)
+        log.scores()  # uuid -> score, higher is better
+        log.last()    # uuid of the last selected entry
+    """
+
+    def __init__(self, path=None, max_lines=MAX_LINES):
+        self.path = path or default_path()
+        self.max_lines = max_lines
+        self._scores = None
+        self._last = None
+        self._lines = 0
+
+    def _load(self):
+        self._scores = {}
+        self._last = None
+        self._lines = 0
+        try:
+            fh = _io.open(self.path, encoding='ascii', errors='replace')
+        except FileNotFoundError:
+            return
+        with fh:
+            for line in fh:
+                self._lines += 1
+                try:
+                    kind, value, uuid = line.split()
+                    value = float(value)
+                except ValueError:
+                    _logger.debug('Skipping line {!r}'.format(line))
+                    continue
+                if kind == 'E':
+                    value = DECAY * value
+                elif kind != 'S':
+                    continue
+                self._add(uuid, value)
+                self._last = uuid
+
+    def _add(self, uuid, score):
+        self._scores[uuid] = _logaddexp(
+            self._scores.get(uuid, -_math.inf), score)
+
+    def scores(self):
+        """Return a dict of the UUIDs of the selected entries and their scores
+
+        Higher scores belong to entries selected more often and more
+        recently. The dict is updated by record().
+        """
+        if self._scores is None:
+            self._load()
+        return self._scores
+
+    def last(self):
+        "Return the UUID of the last selected entry, or None"
+        self.scores()
+        return self._last
+
+    def record(self, uuid, when=None):
+        """Add a selection of the entry with the UUID uuid at time when
+
+        when defaults to now.
+        """
+        if not uuid:
+            return
+        if when is None:
+            when = _time.time()
+        self.scores()
+        self._add(uuid, DECAY * when)
+        self._last = uuid
+        if self._lines >= self.max_lines:
+            self.compact()
+            return
+        self._makedirs()
+        fd = _os.open(self.path, _os.O_WRONLY | _os.O_APPEND | _os.O_CREAT,
+                      0o600)
+        with _io.open(fd, 'w', encoding='ascii') as fh:
+            fh.write('E {!r} {}\n'.format(float(when), uuid))
+        self._lines += 1
+
+    def compact(self, now=None):
+        "Rewrite the log with one line per entry, dropping stale entries"
+        if now is None:
+            now = _time.time()
+        scores = self.scores()
+        oldest = DECAY * (now - MAX_AGE)
+        for uuid in [u for u, score in scores.items() if score < oldest]:
+            if uuid != self._last:
+                del scores[uuid]
+        # the last selected entry comes last
+        order = sorted(scores, key=lambda uuid: uuid == self._last)
+        self._makedirs()
+        tmp_path = self.path + '.tmp'
+        fd = _os.open(tmp_path, _os.O_WRONLY | _os.O_CREAT | _os.O_TRUNC,
+                      0o600)
+        with _io.open(fd, 'w', encoding='ascii') as fh:
+            for uuid in order:
+                fh.write('S {!r} {}\n'.format(scores[uuid], uuid))
+        _os.replace(tmp_path, self.path)
+        self._lines = len(order)
+        _logger.debug('Compacted {} to {} lines'.format(self.path, len(order)))
+
+    def _makedirs(self):
+        _os.makedirs(_os.path.dirname(self.path), mode=0o700, exist_ok=True)
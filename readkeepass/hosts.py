@@ -0,0 +1,223 @@
+"""
+hosts finds the entries of KeePass databases for a URL.
+
+HostIndex maps the hostnames of the entries' urls and their registrable
+domains (e.g. example.co.uk for login.example.co.uk) to the entries, so the
+entries for a URL are found with a few dict lookups instead of a scan of
+all entries. Registrable domains come from the complete public suffix list
+(ICANN and private domains) shipped in public_suffix_list.dat: a suffix
+missing from it would make all of its tenants, e.g. the shops on
+myshopify.com, one domain that shares its entries.
+
+Usage example:
+    kpdb = kdb.load('db2.kdbx', password='testpass1234')
+    index = HostIndex(kpdb.entries)
+    entries = index.lookup('https://login.corp.example.com/sso')
+"""
+import os as _os
+import ipaddress as _ipaddress
+from urllib.parse import urlsplit as _urlsplit
+
+import readkeepass.utils as _utils
+from readkeepass import kdb as _kdb
+
+_logger = _utils.get_logger(__name__)
+
+SUFFIX_LIST_PATH = _os.path.join(_os.path.dirname(_os.path.abspath(__file__)),
+                                 'public_suffix_list.dat')
+
+
+def hostname(url):
+    """Return the normalized hostname of url, or None if it has none
+
+    The hostname is lower case, without a trailing dot and with
+    internationalized labels in their ASCII (punycode) form. url may leave
+    out the scheme, e.g. 'example.com/login'.
+    """
+    url = str(url).strip()
+    if not url:
+        return None
+    if '://' not in url:
+        url = '//' + url
+    try:
+        host = _urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip('.')
+    try:
+        host = host.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    if '.' not in host and ':' not in host and host != 'localhost':
+        return None
+    return host
+
+
+def _is_ip_address(host):
+    try:
+        _ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def _ascii_rule(rule):
+    "Return rule with internationalized labels in punycode, like hostname()"
+    if rule.isascii():
+        return rule
+    try:
+        return rule.encode('idna').decode('ascii')
+    except UnicodeError:
+        return rule
+
+
+class PublicSuffixList:
+    """The rules of a public suffix list (https://publicsuffix.org/)
+
+    Usage example:
+        psl = PublicSuffixList.from_file(SUFFIX_LIST_PATH)
+        psl.registrable_domain('login.example.co.uk')  # 'example.co.uk'
+    """
+
+    def __init__(self, lines):
+        "Parse the lines of a list in the format of public_suffix_list.dat"
+        self.rules = set()
+        # '*.ck' is kept as 'ck'
+        self.wildcards = set()
+        # '!www.ck' is kept as 'www.ck'
+        self.exceptions = set()
+        for line in lines:
+            line = line.split('//', 1)[0].strip()
+            if not line:
+                continue
+            rule = line.split()[0].lower()
+            if rule.startswith('!'):
+                self.exceptions.add(_ascii_rule(rule[1:]))
+            elif rule.startswith('*.'):
+                self.wildcards.add(_ascii_rule(rule[2:]))
+            else:
+                self.rules.add(_ascii_rule(rule))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as fh:
+            return cls(fh)
+
+    def public_suffix(self, host):
+        "Return the public suffix of the hostname host"
+        labels = host.split('.')
+        # the longest matching rule wins, an exception beats the other rules
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.exceptions:
+                return '.'.join(labels[i + 1:])
+            if candidate in self.rules:
+                return candidate
+            parent = '.'.join(labels[i + 1:])
+            if parent and parent in self.wildcards:
+                return candidate
+        # the implicit rule '*': every top-level domain is a public suffix
+        return labels[-1]
+
+    def registrable_domain(self, host):
+        """Return the registrable domain of the hostname host
+
+        It is the public suffix and the label before it. IP addresses are
+        their own registrable domain. None is returned for public suffixes.
+        """
+        if _is_ip_address(host):
+            return host
+        suffix = self.public_suffix(host)
+        if suffix == host:
+            return None
+        label = host[:-len(suffix) - 1].rsplit('.', 1)[-1]
+        return label + '.' + suffix
+
+
+_default_suffixes = None
+
+
+def default_suffixes():
+    "Return the PublicSuffixList of the list shipped with readkeepass"
+    global _default_suffixes
+    if _default_suffixes is None:
+        _default_suffixes = PublicSuffixList.from_file(SUFFIX_LIST_PATH)
+    return _default_suffixes
+
+
+def _entry_hostname(entry):
+    url = entry.as_dict.get('url')
+    if not url or isinstance(url, _kdb.ProtectedValue):
+        return None
+    return hostname(url)
+
+
+@_utils.root.register(name='HostIndex')
+class HostIndex:
+    """Index of entries by the hostname and registrable domain of their url
+
+    The entries can come from several databases, e.g. KeePassDB.entries of
+    all loaded databases. Protected urls are not indexed.
+    """
+
+    def __init__(self, entries, suffixes=None):
+        """Index the entries (KeePassEntry objects)
+
+        suffixes is a PublicSuffixList, by default the shipped list.
+        """
+        self.suffixes = suffixes or default_suffixes()
+        # hostname -> entries
+        self.hosts = {}
+        # registrable domain -> entries
+        self.domains = {}
+        for entry in entries:
+            host = entry.memoize(('hosts', 'hostname'), _entry_hostname)
+            if host is None:
+                continue
+            self.hosts.setdefault(host, []).append(entry)
+            domain = self.suffixes.registrable_domain(host) or host
+            self.domains.setdefault(domain, []).append(entry)
+        _logger.debug('Indexed {} hosts of {} domains'.format(
+            len(self.hosts), len(self.domains)))
+
+    def lookup(self, url):
+        """Return the entries for url, the best matches first
+
+        First come the entries for the hostname of url, then those for its
+        parent domains down to the registrable domain, and last the other
+        entries of the registrable domain. For https://login.example.com/
+        the entries of login.example.com come before those of example.com
+        and those before the entries of mail.example.com.
+        """
+        host = hostname(url)
+        if host is None:
+            return []
+        domain = self.suffixes.registrable_domain(host) or host
+        found = []
+        seen = set()
+
+        def add(entries):
+            for entry in entries:
+                if id(entry) not in seen:
+                    seen.add(id(entry))
+                    found.append(entry)
+
+        parent = host
+        while True:
+            add(self.hosts.get(parent, ()))
+            if parent == domain or '.' not in parent:
+                break
+            parent = parent.split('.', 1)[1]
+        add(self.domains.get(domain, ()))
+        return found
+
+
+@_utils.root.register(name='find_url')
+def find_url(keepass_db, url):
+    """Return the entries of keepass_db for url, the best matches first
+
+    For several lookups in the same databases build a HostIndex once.
+    """
+    return HostIndex(keepass_db.entries).lookup(url)
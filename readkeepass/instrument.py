@@ -0,0 +1,155 @@
+"""
+instrument records how long the stages of loading and showing databases take.
+
+It is off by default; then stage() returns a shared do-nothing object and
+the instrumented code only pays for a function call. Once enabled, every
+stage is recorded with its start, duration and optional counts:
+
+    with instrument.stage('kdf', rounds=6000) as st:
+        transform_key(...)
+        if st:
+            st.set(bytes_out=32)
+
+Points in time (e.g. when the first rows reach rofi) are recorded with
+mark(). Times are seconds since enable(); records of worker processes can be
+added with merge() since all processes share the monotonic clock.
+
+Usage example:
+    instrument.enable()
+    kpdb = kdb.load('db2.kdbx', password='testpass1234')
+    instrument.dump('profile.json')
+"""
+import io as _io
+import json as _json
+import threading as _threading
+from time import perf_counter as _clock
+
+_enabled = False
+_t0 = None
+_records = []
+
+
+class _NullStage:
+    "The stage returned while instrumentation is disabled"
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **info):
+        pass
+
+
+_NULL = _NullStage()
+
+
+class Stage:
+    "A recorded stage, use it as a context manager"
+    __slots__ = ('record', '_start')
+
+    def __init__(self, name, info):
+        self.record = dict(name=name, thread=_threading.current_thread().name,
+                           **info)
+
+    def __enter__(self):
+        self._start = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = _clock()
+        self.record['start'] = self._start
+        self.record['seconds'] = end - self._start
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        _records.append(self.record)
+        return False
+
+    def __bool__(self):
+        return True
+
+    def set(self, **info):
+        "Add info (e.g. bytes_in, bytes_out, entries) to the record"
+        self.record.update(info)
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    "Start recording; times are measured from now"
+    global _enabled, _t0
+    if _t0 is None:
+        _t0 = _clock()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    "Forget all records and stop recording"
+    global _t0
+    disable()
+    _t0 = None
+    del _records[:]
+
+
+def stage(name, **info):
+    """Return a context manager recording the stage name
+
+    info is stored with the record, e.g. the path of a database.
+    """
+    if not _enabled:
+        return _NULL
+    return Stage(name, info)
+
+
+def add(name, start, seconds, **info):
+    "Record the stage name measured elsewhere; start is a perf_counter() time"
+    if _enabled:
+        _records.append(dict(name=name, start=start, seconds=seconds,
+                             thread=_threading.current_thread().name, **info))
+
+
+def mark(name, **info):
+    "Record that the point name was reached now"
+    if _enabled:
+        _records.append(dict(name=name, start=_clock(), seconds=None,
+                             thread=_threading.current_thread().name, **info))
+
+
+def records():
+    "Return a list of the records (dicts) with perf_counter() start times"
+    return list(_records)
+
+
+def merge(records):
+    "Add the records of another process (see records())"
+    if _enabled:
+        _records.extend(records)
+
+
+def report():
+    "Return the records with their start relative to enable(), sorted by it"
+    t0 = _t0 if _t0 is not None else 0.0
+    result = []
+    for record in sorted(_records, key=lambda r: r['start']):
+        record = dict(record)
+        record['start'] = record['start'] - t0
+        result.append(record)
+    return result
+
+
+def dump(path):
+    "Write report() as JSON to the file path"
+    with _io.open(path, 'w') as fh:
+        _json.dump({'stages': report()}, fh, indent=2)
@@ -4,28 +4,77 @@ kdb contains code to load and manipulate KeePass databases.
 Most users should just call kdb.load()
 """
 import io
+import os
+import sys as _sys
+import struct
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
+from concurrent.futures import as_completed as _as_completed
 from collections import namedtuple as _namedtuple, UserDict as _UserDict
 from collections import OrderedDict as _OrderedDict
 from itertools import chain as _chain, count as _count
 
 import readkeepass.utils as _utils
+import readkeepass.instrument as _instrument
 from . import libkeepass
 _logger = _utils.get_logger(__name__)
 
 
-def _ntuple_from_dict(d, NamedTuple):
+def _ntuple_from_dict(d, NamedTuple, uuid=None):
     """Return instance of NamedTuple based on dict d.
 
     NamedTuple is filled using the key/value pairs
-    found in the dictionary d.
+    found in the dictionary d. Fields missing in d are set to ''.
+    A 'uuid' field is set to uuid.
     """
-    return NamedTuple(
-        **{k: v for k, v in d.items() if k in NamedTuple._fields}
-    )
+    fields = {k: d.get(k, '') for k in NamedTuple._fields}
+    if 'uuid' in fields:
+        fields['uuid'] = uuid
+    return NamedTuple(**fields)
 
 
-def load_entries(db, keyfile='', password=''):
-    "Return the entries in the keepass-db as an iterable of dicts"
+class ProtectedValue:
+    """A protected entry value that is only decrypted when it is read.
+
+    str(value) returns the plain text. It is not stored, so the plain text
+    only lives as long as the caller keeps it.
+    """
+    __slots__ = ('_kdb', '_elem')
+
+    def __init__(self, kdb, elem):
+        self._kdb = kdb
+        self._elem = elem
+
+    def __str__(self):
+        return self._kdb.get_protected_value(self._elem)
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+    def __bool__(self):
+        return bool(self._elem.text)
+
+    def __eq__(self, other):
+        if isinstance(other, ProtectedValue):
+            other = str(other)
+        if not isinstance(other, str):
+            return NotImplemented
+        return str(self) == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return '{}(***)'.format(self.__class__.__name__)
+
+
+def load_entries(db, keyfile='', password='', lazy=False, uuids=False):
+    """Return the entries in the keepass-db as an iterable of dicts
+
+    If lazy is True, protected values (e.g. passwords) are ProtectedValue
+    objects, which are only decrypted when they are converted to str.
+    If uuids is True, (uuid, dict) pairs are returned instead, where uuid is
+    the base64 encoded UUID of the entry (or None).
+    """
     def load_kdb(db, password, keyfile):
         "Return the loaded kdb"
         # kdb = libkeepass.open(db, password='pass')
@@ -34,33 +83,44 @@ def load_entries(db, keyfile='', password=''):
             credentials['keyfile'] = keyfile
         if password:
             credentials['password'] = password
+        if lazy:
+            credentials['unprotect'] = 'lazy'
         with io.open(db, 'rb') as stream:
             signature = libkeepass.common.read_signature(stream)
             cls = libkeepass.get_kdb_reader(signature)
+            if issubclass(cls, libkeepass.kdb4.KDB4Reader):
+                # only extract the entries, without an element tree
+                cls = libkeepass.entries.KDB4EntryReader
+            elif not issubclass(cls, libkeepass.kdb3.KDB3Reader):
+                raise IOError('Cannot extract the entries of {}'.format(db))
             kdb = cls(stream, **credentials)
             kdb.close()
         return kdb
 
-    def entry_to_dict(entry):
-        strs = entry.findall('String')
-        d = {str(s.Key).lower(): str(s.Value) for s in strs}
-        try:
-            d['groupname'] = str(entry.getparent().Name)
-        except AttributeError:  # If there is no group it is deleted or something
-            return None
+    def value(v):
+        if lazy and isinstance(v, libkeepass.entries.ProtectedText):
+            return ProtectedValue(kdb, v)
+        return v
+
+    def record_to_dict(record):
+        d = {k.lower(): value(v) for k, v in record.fields.items()}
+        d['groupname'] = record.group_path[-1] if record.group_path else ''
         return d
+
     msg = 'Loading {} [given keyfile = {}, given password = {}]'
     _logger.debug(msg.format(db, bool(keyfile), bool(password)))
-    kdb = load_kdb(db, password, keyfile)
-    entries = kdb.obj_root.findall('.//Entry')
-    entries2 = []
-    for e in entries:
-        d = entry_to_dict(e)
-        if d:
-            entries2.append(d)
+    with _instrument.stage('load_entries', db=db) as st:
+        kdb = load_kdb(db, password, keyfile)
+        with _instrument.stage('extract', db=db):
+            # both readers extract the entries as EntryRecords
+            entries2 = [(r.uuid, record_to_dict(r)) for r in kdb.entries]
+        if st:
+            st.set(entries=len(entries2), bytes_in=os.path.getsize(db))
     msg = 'Successfully loaded {}: found {} entries'
     _logger.debug(msg.format(db, len(entries2)))
-    return entries2
+    if uuids:
+        return entries2
+    return [d for uuid, d in entries2]
 
 
 class StringElements:
@@ -93,6 +153,10 @@ class StringElements:
     def format(self):
         d_formatted = {}
         for k, v in self.d_entry.items():
+            if isinstance(v, ProtectedValue):
+                # keep protected values encrypted until they are read
+                d_formatted[k] = v
+                continue
             try:
                 if v:
                     d_formatted[k] = getattr(self, k)(str(v))
@@ -144,25 +208,81 @@ class StringElements:
     def __repr__(self):
         return repr(self.d_formatted)
 
-EntryFields = _namedtuple(
-    'EntryFields',
-    ['title', 'url', 'username', 'password', 'groupname'],
-)
+class EntryFields(_namedtuple(
+        'EntryFields',
+        ['title', 'url', 'username', 'password', 'groupname', 'uuid'],
+        defaults=(None,))):
+    "The fields of an entry and its UUID (None if unknown)"
+    __slots__ = ()
+
+
+# values of these fields repeat across entries and are interned
+_INTERNED_FIELDS = frozenset(['groupname', 'url', 'username'])
+
+
+def _intern_dict(d):
+    """Return a copy of the entry dict d with interned keys.
+
+    The values of the fields in _INTERNED_FIELDS are interned too, so that
+    entries with the same group, url or username share one string.
+    Passwords are never interned, interned strings live until exit.
+    """
+    intern = _sys.intern
+    return {
+        intern(k): intern(v) if k in _INTERNED_FIELDS and type(v) is str else v
+        for k, v in d.items()
+    }
 
 
 class KeePassEntry:
+    """A KeePass entry, backed by a dict of its fields (as_dict).
+
+    The namedtuple (as_ntuple) and formatted (as_formatted_dict) views are
+    computed the first time they are read and then kept. They are computed
+    again after as_dict is set.
+    """
+    __slots__ = ('_dict', '_NamedTuple', '_ntuple', '_formatted', '_memo',
+                 'uuid')
     NamedTuple = EntryFields
     dict_formatter = lambda entry_dict: StringElements(entry_dict).format()
 
-    def __init__(self, entry_dict, NamedTuple=None):
+    def __init__(self, entry_dict, NamedTuple=None, uuid=None):
+        self._NamedTuple = NamedTuple
+        self.uuid = uuid
         self.as_dict = entry_dict
-        if NamedTuple:
-            self.NamedTuple = NamedTuple
+
+    @property
+    def as_dict(self):
+        return self._dict
+
+    @as_dict.setter
+    def as_dict(self, entry_dict):
+        self._dict = _intern_dict(entry_dict)
+        self._ntuple = None
+        self._formatted = None
+        self._memo = None
+
+    def memoize(self, key, func):
+        """Return func(self), computed once per key until as_dict is set
+
+        Other modules keep what they derive from the entry here, e.g. the
+        rows of the rofi menu (see readkeepass.rofi).
+        """
+        if self._memo is None:
+            self._memo = {}
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = func(self)
+            return value
 
     def get_as_ntuple(self, NamedTuple=None):
         if NamedTuple:
-            return _ntuple_from_dict(self.as_dict, NamedTuple)
-        return _ntuple_from_dict(self.as_dict, self.NamedTuple)
+            return _ntuple_from_dict(self.as_dict, NamedTuple, self.uuid)
+        if self._ntuple is None:
+            self._ntuple = _ntuple_from_dict(
+                self.as_dict, self._NamedTuple or self.NamedTuple, self.uuid)
+        return self._ntuple
 
     @property
     def as_ntuple(self):
@@ -174,7 +294,9 @@ class KeePassEntry:
 
     @property
     def as_formatted_dict(self):
-        return __class__.dict_formatter(self.as_dict)
+        if self._formatted is None:
+            self._formatted = __class__.dict_formatter(self.as_dict)
+        return self._formatted
 
     def __str__(self):
         fields = []
@@ -187,6 +309,14 @@ class KeePassEntry:
         name = str(self.__class__.__name__)
         return name + '(' + repr(self.as_dict) + ')'
 
+    def __getstate__(self):
+        # the views are computed again after unpickling
+        return self._dict, self._NamedTuple, self.uuid
+
+    def __setstate__(self, state):
+        entry_dict, self._NamedTuple, self.uuid = state
+        self.as_dict = entry_dict
+
 
 class KeePassDB(_OrderedDict):
     def __init__(self, *pargs, db_path='', entries=None):
@@ -213,7 +343,7 @@ class KeePassDB(_OrderedDict):
 
 
 @_utils.root.register(name='load_db')
-def load(db, keyfile='', password=''):
+def load(db, keyfile='', password='', lazy=False):
     """Extract the entries from the KeePass database corresponding to filename.
 
     It returns a named tuple with fields `filename`, and `entries`
@@ -221,6 +351,7 @@ def load(db, keyfile='', password=''):
     :param filename: the path of the KeePass database (db)
     :param password: the password for the db (if there is no pw use '')
     :param keyfile: the key-file for the db (if there is no key-file use '')
+    :param lazy: only decrypt protected values when they are read
     :returns: a named tuple containing (db filename, db entries)
     :rtype: KeePassDB
 
@@ -232,6 +363,96 @@ def load(db, keyfile='', password=''):
     >>> db.entries[0]
     KeePassEntry({'url': '', 'notes': '', 'password': 'andchill', 'title': 'Netflix', 'groupname': 'Root', 'username': 'netflix-user@example.com'})
     """
-    entries = load_entries(db, keyfile, password)
-    return KeePassDB(db_path=db, entries=[KeePassEntry(x) for x in entries])
+    entries = load_entries(db, keyfile, password, lazy=lazy, uuids=True)
+    return KeePassDB(db_path=db, entries=[KeePassEntry(x, uuid=uuid)
+                                          for uuid, x in entries])
     # return _utils.KeePassDB(db, [KeePassEntry(x) for x in entries])
+
+
+def kdf_rounds(db):
+    """Return the number of key transformation rounds of the keepass-db.
+
+    Only the file header is read. If the header cannot be read 0 is returned,
+    the actual error will show up when the db is loaded.
+    """
+    try:
+        return libkeepass.read_header(db).transform_rounds
+    except (IOError, KeyError, struct.error):
+        return 0
+
+
+@_utils.root.register(name='load_dbs')
+def load_many(*credentials, max_workers=None):
+    """Extract the entries from several KeePass databases concurrently.
+
+    Each database is unlocked in its own worker process. The databases with
+    the most key transformation rounds are started first, so the total time
+    approaches the time of the slowest database.
+
+    :param credentials: tuples of (db, keyfile, password), e.g. KPCredentials
+    :param max_workers: the maximum number of worker processes
+    :returns: a list of KeePassDB in the same order as credentials
+    :rtype: list
+    """
+    kpdbs = [None] * len(credentials)
+    for i, kpdb in iter_load_many(*credentials, max_workers=max_workers):
+        kpdbs[i] = kpdb
+    return kpdbs
+
+
+def _load_worker(cred, profile=False):
+    """load() the KPCredentials cred in a worker process
+
+    Returns the KeePassDB and the instrumentation records of the load, which
+    are only recorded if profile is True.
+    """
+    if not profile:
+        return load(*cred), ()
+    # a forked worker starts with the records of its parent
+    _instrument.reset()
+    _instrument.enable()
+    kpdb = load(*cred)
+    return kpdb, _instrument.records()
+
+
+@_utils.root.register(name='iter_load_dbs')
+def iter_load_many(*credentials, max_workers=None):
+    """Yield (index, KeePassDB) for several KeePass databases as they are loaded.
+
+    index is the position of the database in credentials. Without worker
+    processes the databases with the fewest key transformation rounds are
+    loaded first, so the first results come as early as possible.
+    See load_many() for the arguments.
+    """
+    credentials = [_utils.KPCredentials(*cred) for cred in credentials]
+    if max_workers is None:
+        max_workers = min(len(credentials), os.cpu_count() or 1)
+    if len(credentials) < 2:
+        for i, cred in enumerate(credentials):
+            yield i, load(*cred)
+        return
+
+    rounds = [kdf_rounds(cred.db) for cred in credentials]
+    order = sorted(range(len(credentials)), key=rounds.__getitem__,
+                   reverse=max_workers >= 2)
+    if max_workers < 2:
+        for i in order:
+            yield i, load(*credentials[i])
+        return
+
+    msg = 'Loading {} databases with {} workers'
+    _logger.debug(msg.format(len(credentials), max_workers))
+    profile = _instrument.enabled()
+    executor = _ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        # the pool starts the submitted jobs in order
+        futures = {executor.submit(_load_worker, credentials[i], profile): i
+                   for i in order}
+        for future in _as_completed(futures):
+            kpdb, records = future.result()
+            _instrument.merge(records)
+            yield futures[future], kpdb
+    finally:
+        # if the caller stops early, don't start the remaining databases
+        # and don't wait for the running ones
+        executor.shutdown(wait=False, cancel_futures=True)
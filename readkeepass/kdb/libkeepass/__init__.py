@@ -5,6 +5,7 @@ from contextlib import contextmanager
 from . import common
 from . import kdb3
 from . import kdb4
+from . import entries
 # import libkeepass.common
 # import libkeepass.kdb3
 # import libkeepass.kdb4
@@ -26,8 +27,6 @@ def open(filename, **credentials):
     
     Files are identified using their signature and a reader suitable for 
     the file format is intialized and returned.
-    
-    Note: `keyfile` is currently not supported for v3 KeePass files.
     """
     kdb = None
     try:
@@ -43,6 +42,21 @@ def open(filename, **credentials):
         raise
 
 
+def read_header(filename):
+    """
+    Return a reader instance for the KeePass file with `filename`, which only
+    has the file header parsed. Nothing is decrypted, so no credentials are
+    needed. This is a cheap way to look at header fields like the number of
+    key transformation rounds.
+    """
+    with io.open(filename, 'rb') as stream:
+        signature = common.read_signature(stream)
+        cls = get_kdb_reader(signature)
+        kdb = cls()
+        kdb._read_header(stream)
+    return kdb
+
+
 def add_kdb_reader(sub_signature, cls):
     """
     Add or overwrite the class used to process a KeePass file.
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+chacha20.py -- a batched ChaCha20 (RFC 7539) keystream generator
+================================================================
+
+ChaCha20 is used by KDBX 4 files, both as cipher for the payload and as the
+inner random stream that protects values in the XML document. KDBX uses the
+IETF variant with a 96 bit nonce and a 32 bit block counter.
+
+Like fastSalsa20, the keystream for many 64-byte blocks is generated per
+call, using NumPy uint32 lanes if NumPy is installed and plain Python
+integers otherwise. Unlike Salsa20.encryptBytes, data can be processed in
+chunks of any length; unused keystream bytes are kept for the next call.
+
+Sample usage:
+    from chacha20 import ChaCha20
+    cc20 = ChaCha20(key, nonce)
+    dataout = cc20.encryptBytes(datain)   # same for decrypt
+"""
+
+from struct import Struct
+
+from . fastSalsa20 import _np, xor_bytes, MASK32, BLOCK_SIZE, BATCH_BLOCKS
+
+little8_u32 = Struct("<8I")  # 8 little-endian 32-bit unsigned ints.
+little3_u32 = Struct("<3I")  # 3 little-endian 32-bit unsigned ints.
+little16_u32 = Struct("<16I")  # 16 little-endian 32-bit unsigned ints.
+
+# "expand 32-byte k"
+CONSTANTS = (0x61707865, 0x3320646e, 0x79622d32, 0x6b206574)
+
+# the quarter-rounds of a double round as (a, b, c, d) state indices
+_DOUBLE_ROUND = (
+    (0, 4, 8, 12), (1, 5, 9, 13), (2, 6, 10, 14), (3, 7, 11, 15),
+    (0, 5, 10, 15), (1, 6, 11, 12), (2, 7, 8, 13), (3, 4, 9, 14),
+)
+
+
+class ChaCha20(object):
+    def __init__(self, key, nonce, counter=0):
+        if len(key) != 32:
+            raise ValueError("key length isn't 32 bytes.")
+        if len(nonce) != 12:
+            raise ValueError("nonce length isn't 12 bytes.")
+        self.ctx = list(CONSTANTS) + [0] * 12
+        self.ctx[4:12] = little8_u32.unpack(key)
+        self.ctx[13:16] = little3_u32.unpack(nonce)
+        self.setCounter(counter)
+
+    def setCounter(self, counter):
+        """Set the block counter and drop any buffered keystream."""
+        assert (0 <= counter < 1 << 32), "counter < 0 or >= 2**32"
+        self.ctx[12] = counter
+        self._leftover = b''
+
+    def getCounter(self):
+        return self.ctx[12]
+
+    def keystreamBytes(self, length):
+        """Return the next `length` bytes of keystream."""
+        stream = self._leftover[:length]
+        missing = length - len(stream)
+        self._leftover = self._leftover[len(stream):]
+        if missing > 0:
+            nblocks = -(-missing // BLOCK_SIZE)
+            counter = self.ctx[12]
+            if counter + nblocks > 1 << 32:
+                raise OverflowError('ChaCha20 block counter exhausted.')
+            if _np is not None:
+                new = _keystream_numpy(self.ctx, counter, nblocks)
+            else:
+                new = _keystream_python(self.ctx, counter, nblocks)
+            self.ctx[12] = (counter + nblocks) & MASK32
+            stream += new[:missing]
+            self._leftover = new[missing:]
+        return stream
+
+    def encryptBytes(self, data):
+        return xor_bytes(data, self.keystreamBytes(len(data)))
+
+    decryptBytes = encryptBytes  # encrypt and decrypt use same function
+
+
+# --------------------------------------------------------------------------
+
+def _keystream_numpy(ctx, counter, nblocks):
+    """
+    Return `nblocks` keystream blocks starting at block `counter`. Each of the
+    16 state words is a uint32 array holding that word for every block.
+    """
+    out = []
+    for start in range(0, nblocks, BATCH_BLOCKS):
+        n = min(BATCH_BLOCKS, nblocks - start)
+        state = [_np.full(n, word, dtype=_np.uint32) for word in ctx]
+        state[12] = _np.arange(counter + start, counter + start + n,
+                               dtype=_np.uint64).astype(_np.uint32)
+
+        x = [word.copy() for word in state]
+        for i in range(10):
+            for a, b, c, d in _DOUBLE_ROUND:
+                x[a] += x[b]
+                t = x[d] ^ x[a]
+                x[d] = (t << 16) | (t >> 16)
+                x[c] += x[d]
+                t = x[b] ^ x[c]
+                x[b] = (t << 12) | (t >> 20)
+                x[a] += x[b]
+                t = x[d] ^ x[a]
+                x[d] = (t << 8) | (t >> 24)
+                x[c] += x[d]
+                t = x[b] ^ x[c]
+                x[b] = (t << 7) | (t >> 25)
+
+        blocks = _np.empty((n, 16), dtype='<u4')
+        for i in range(16):
+            blocks[:, i] = x[i] + state[i]
+        out.append(blocks.tobytes())
+    return b''.join(out)
+
+
+def _keystream_python(ctx, counter, nblocks):
+    """
+    Return `nblocks` keystream blocks starting at block `counter` using plain
+    Python integers.
+    """
+    M = MASK32
+    pack = little16_u32.pack
+    out = []
+    for n in range(counter, counter + nblocks):
+        state = list(ctx)
+        state[12] = n & M
+        x = list(state)
+        for i in range(10):
+            for a, b, c, d in _DOUBLE_ROUND:
+                x[a] = (x[a] + x[b]) & M
+                t = x[d] ^ x[a]
+                x[d] = ((t << 16) | (t >> 16)) & M
+                x[c] = (x[c] + x[d]) & M
+                t = x[b] ^ x[c]
+                x[b] = ((t << 12) | (t >> 20)) & M
+                x[a] = (x[a] + x[b]) & M
+                t = x[d] ^ x[a]
+                x[d] = ((t << 8) | (t >> 24)) & M
+                x[c] = (x[c] + x[d]) & M
+                t = x[b] ^ x[c]
+                x[b] = ((t << 7) | (t >> 25)) & M
+        out.append(pack(*[(a + b) & M for a, b in zip(x, state)]))
+    return b''.join(out)
@@ -123,6 +123,9 @@ class HeaderDictionary(dict):
 # file baseclass
 
 import io
+import os
+import stat
+import tempfile
 # from libkeepass.crypto import sha256
 from . crypto import sha256
 
@@ -176,6 +179,46 @@ class KDBFile(object):
     def write_to(self, stream):
         raise NotImplementedError('The write_to() method was not implemented.')
 
+    def save(self, filename, **kwargs):
+        """
+        Write the database to the file `filename` with `write_to` (which gets
+        the `kwargs`) and replace the file atomically: the data goes to a
+        temporary file in the same directory, which is synced to disk and
+        then renamed to `filename`. If anything fails, `filename` is left as
+        it was. An existing file keeps its permissions.
+        """
+        filename = os.path.realpath(filename)
+        directory, name = os.path.split(filename)
+        fd, tmp_name = tempfile.mkstemp(prefix='.{}.'.format(name),
+                                        suffix='.tmp', dir=directory)
+        try:
+            try:
+                os.fchmod(fd, stat.S_IMODE(os.stat(filename).st_mode))
+            except FileNotFoundError:
+                pass
+            with io.open(fd, 'wb') as stream:
+                self.write_to(stream, **kwargs)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(tmp_name, filename)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+        # make the rename itself durable
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
     def add_credentials(self, **credentials):
         if 'password' in credentials:
             self.add_key_hash(sha256(credentials['password'].encode('utf-8')))
@@ -267,12 +310,24 @@ def load_xml_keyfile(filename):
     //         <Data>ySFoKuCcJblw8ie6RkMBdVCnAf4EedSch7ItujK6bmI=</Data>
     //     </Key>
     // </KeyFile>
+
+    Version 2.0 keyfiles (KeePass 2.47+, KeePassXC) store the key as
+    hex digits, which may be split by whitespace:
+    //     <Key>
+    //         <Data Hash="A65F0BDA">
+    //             5D53AFA3 91E2C5AB 0C9E1E52 8B3D16D5
+    //             ...
+    //         </Data>
+    //     </Key>
     """
     with open(filename, 'r') as f:
-        # ignore meta, currently there is only version "1.00"
         tree = etree.parse(f).getroot()
+        version = tree.findtext('Meta/Version', '1.00')
+        data = tree.find('Key/Data').text
+        if version.startswith('2.'):
+            return bytes.fromhex(''.join(data.split()))
         # read text from key, data and convert from base64
-        return base64.b64decode(tree.find('Key/Data').text)
+        return base64.b64decode(data)
     raise IOError('Could not parse XML keyfile.')
 
 
@@ -288,7 +343,10 @@ def load_plain_keyfile(filename):
             return key
         # if the length is 64 bytes we assume the key is hex encoded
         if len(key) == 64:
-            return key.decode('hex')
+            try:
+                return bytes.fromhex(key.decode('ascii'))
+            except ValueError:
+                pass
         # anything else may be a file to hash for the key
         return sha256(key)
     raise IOError('Could not read keyfile.')
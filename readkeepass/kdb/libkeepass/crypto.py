@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
+import os
 import hashlib
 import struct
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from Crypto.Cipher import AES
 # from libkeepass.pureSalsa20 import Salsa20
-from . pureSalsa20 import Salsa20
+from . fastSalsa20 import Salsa20, xor_bytes
+from . chacha20 import ChaCha20
 
 AES_BLOCK_SIZE = 16
+# the AES-KDF only uses two cores at or above this number of rounds
+PARALLEL_KDF_MIN_ROUNDS = 100000
 
 
 def sha256(s):
@@ -13,15 +21,69 @@ def sha256(s):
     return bytes(hashlib.sha256(s).digest())
 
 
-def transform_key(key, seed, rounds):
-    """Transform `key` with `seed` `rounds` times using AES ECB."""
+def sha512(s):
+    """Return SHA512 digest of the string `s`."""
+    return bytes(hashlib.sha512(s).digest())
+
+
+def transform_key(key, seed, rounds, parallel=None):
+    """
+    Transform `key` with `seed` `rounds` times using AES ECB.
+
+    In ECB mode the two 16 byte halves of the 32 byte `key` never interact,
+    so they are transformed as two independent lanes. With `parallel` the
+    second lane runs in a worker process while this process transforms the
+    first one. By default lanes only run in parallel for at least
+    PARALLEL_KDF_MIN_ROUNDS rounds, where it outweighs the process startup,
+    and if more than one core is available. They never do in a worker
+    process (e.g. of kdb.load_many) or in another thread than the main one,
+    where starting a process is unsafe.
+    """
+    if parallel is None:
+        parallel = rounds >= PARALLEL_KDF_MIN_ROUNDS and _usable_cores() > 1
+    if parallel and len(key) == 2 * AES_BLOCK_SIZE and _may_start_process():
+        try:
+            return sha256(_transform_lanes_parallel(key, seed, rounds))
+        except (OSError, AssertionError, BrokenProcessPool):
+            # no worker process available (e.g. inside a daemonic process)
+            pass
+    # return hash of transformed key
+    return sha256(_transform_lane(key, seed, rounds))
+
+
+def _usable_cores():
+    """Return the number of cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _may_start_process():
+    """Return True in the main thread of the main process"""
+    return (multiprocessing.parent_process() is None and
+            threading.current_thread() is threading.main_thread())
+
+
+def _transform_lane(lane, seed, rounds):
+    """Encrypt `lane` with `seed` `rounds` times using AES ECB."""
     # create transform cipher with transform seed
     cipher = AES.new(seed, AES.MODE_ECB)
+    encrypt = cipher.encrypt
     # transform composite key rounds times
     for n in range(0, rounds):
-        key = cipher.encrypt(key)
-    # return hash of transformed key
-    return sha256(key)
+        lane = encrypt(lane)
+    return lane
+
+
+def _transform_lanes_parallel(key, seed, rounds):
+    """Transform both 16 byte halves of `key` concurrently."""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(_transform_lane, key[AES_BLOCK_SIZE:],
+                                 seed, rounds)
+        lane0 = _transform_lane(key[:AES_BLOCK_SIZE], seed, rounds)
+        lane1 = future.result()
+    return lane0 + lane1
 
 
 def aes_cbc_decrypt(data, key, enc_iv):
@@ -36,6 +98,69 @@ def aes_cbc_encrypt(data, key, enc_iv):
     return cipher.encrypt(data)
 
 
+class AESCBCDecryptor(object):
+    """
+    Incremental AES CBC decryption of padded data. Feed chunks of any length
+    to `update` and call `finalize` at the end of the data, which returns the
+    last block with the padding removed.
+    """
+
+    def __init__(self, key, enc_iv):
+        self.cipher = AES.new(key, AES.MODE_CBC, enc_iv)
+        self.pending = b''
+
+    def update(self, data):
+        data = self.pending + data
+        # hold back the last complete block, it may contain the padding
+        n = ((len(data) - 1) // AES_BLOCK_SIZE) * AES_BLOCK_SIZE if data else 0
+        self.pending = data[n:]
+        return self.cipher.decrypt(data[:n])
+
+    def finalize(self):
+        if len(self.pending) != AES_BLOCK_SIZE:
+            raise IOError('Encrypted data is not a multiple of the block size.')
+        data = unpad(self.cipher.decrypt(self.pending))
+        self.pending = b''
+        return data
+
+
+class AESCBCEncryptor(object):
+    """
+    Incremental AES CBC encryption with padding, the counterpart of
+    AESCBCDecryptor. Chunks of any length can be fed to `update`; `finalize`
+    pads and encrypts the rest.
+    """
+
+    def __init__(self, key, enc_iv):
+        self.cipher = AES.new(key, AES.MODE_CBC, enc_iv)
+        self.pending = b''
+
+    def update(self, data):
+        if self.pending:
+            data = self.pending + data
+        n = len(data) - len(data) % AES_BLOCK_SIZE
+        self.pending = bytes(data[n:])
+        return self.cipher.encrypt(data[:n]) if n else b''
+
+    def finalize(self):
+        data = self.cipher.encrypt(pad(self.pending))
+        self.pending = b''
+        return data
+
+
+class ChaCha20Decryptor(object):
+    """Incremental ChaCha20 decryption with the interface of AESCBCDecryptor."""
+
+    def __init__(self, key, nonce):
+        self.cipher = ChaCha20(key, nonce)
+
+    def update(self, data):
+        return self.cipher.decryptBytes(data)
+
+    def finalize(self):
+        return b''
+
+
 def unpad(data):
     return data[:len(data) - bytearray(data)[-1]]
 
@@ -46,5 +171,9 @@ def pad(s):
 
 
 def xor(aa, bb):
-    """Return a bytearray of a bytewise XOR of `aa` and `bb`."""
-    return bytearray([a ^ b for a, b in zip(bytearray(aa), bytearray(bb))])
+    """Return a bytearray of a bytewise XOR of `aa` and `bb`.
+
+    Like zip, the result is as long as the shorter argument.
+    """
+    n = min(len(aa), len(bb))
+    return bytearray(xor_bytes(memoryview(aa)[:n], memoryview(bb)[:n]))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Event driven extraction of the entries of a KDBX file.
+
+KDB4EntryReader decrypts a KDBX file like KDB4Reader, but instead of building
+an objectify tree of the whole XML document it feeds the document to a lxml
+parser target (EntryTarget). The target gets start, end and data events and
+only keeps the entries with their group path, so no element tree is built.
+The Meta, Binaries, DeletedObjects and History subtrees are skipped; only the
+lengths of their protected values are counted, since all protected values of
+the document share one inner random stream.
+"""
+import base64
+from collections import namedtuple
+
+from lxml import etree
+
+from . import pipeline
+from ... import instrument
+from . crypto import xor_bytes
+from . kdb4 import KDB4File, keystream_at, _b64_decoded_length
+
+EntryRecord = namedtuple('EntryRecord', 'uuid group_path fields')
+EntryRecord.__doc__ = """\
+An entry of a KeePass database. `uuid` is the base64 encoded UUID of the
+entry, `group_path` a tuple of the names of the groups containing it (from
+the root group down) and `fields` a dict of its string fields."""
+
+# a value which is still protected, at `offset` in the inner random stream
+ProtectedText = namedtuple('ProtectedText', 'offset text')
+
+
+class EntryTarget(object):
+    """
+    A lxml parser target collecting the entries of a KeePass XML document as
+    EntryRecords. Protected values are kept as ProtectedText.
+    """
+    skip_tags = frozenset(['Meta', 'Binaries', 'DeletedObjects', 'History'])
+
+    def __init__(self):
+        self.entries = []
+        # position in the inner random stream of the next protected value
+        self.offset = 0
+        self._tags = []
+        self._groups = []
+        self._skip = 0
+        self._text = None
+        self._protected = False
+        self._entry = None
+        self._key = None
+
+    def start(self, tag, attrib):
+        self._tags.append(tag)
+        if self._skip or tag in self.skip_tags:
+            self._skip += 1
+        elif tag == 'Group':
+            self._groups.append('')
+        elif tag == 'Entry':
+            self._entry = EntryRecord('', tuple(self._groups), {})
+        self._protected = attrib.get('Protected') == 'True'
+        # only collect the text of elements which are used
+        if tag == 'Value' and self._protected or not self._skip and (
+                tag in ('Name', 'Key', 'Value') or
+                tag == 'UUID' and self._tags[-2:-1] == ['Entry']):
+            self._text = []
+        else:
+            self._text = None
+
+    def data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def end(self, tag):
+        self._tags.pop()
+        text = None if self._text is None else ''.join(self._text)
+        self._text = None
+        parent = self._tags[-1] if self._tags else None
+        if tag == 'Value' and self._protected and text:
+            value = ProtectedText(self.offset, text)
+            self.offset += _b64_decoded_length(text)
+        else:
+            value = text or ''
+        self._protected = False
+        if self._skip:
+            self._skip -= 1
+        elif tag == 'Group':
+            self._groups.pop()
+        elif tag == 'Entry':
+            self.entries.append(self._entry)
+            self._entry = None
+        elif tag == 'Name' and parent == 'Group':
+            self._groups[-1] = value
+        elif self._entry is None:
+            pass
+        elif tag == 'UUID' and parent == 'Entry':
+            self._entry = self._entry._replace(uuid=value)
+        elif tag == 'Key' and parent == 'String':
+            self._key = value
+        elif tag == 'Value' and parent == 'String':
+            self._entry.fields[self._key] = value
+
+    def close(self):
+        return self.entries
+
+
+class KDB4EntryReader(KDB4File):
+    """
+    Read the entries of a KDBX file into `entries`, a list of EntryRecords,
+    without building an element tree::
+
+        with open('passwords.kdbx', 'rb') as fh:
+            entries = KDB4EntryReader(fh, password='secret').entries
+
+    With `unprotect=True` (the default) protected values are decrypted in one
+    pass over the inner random stream after the document is read. With
+    `unprotect=False` or `'lazy'` they are left as ProtectedText and can be
+    read with `get_protected_value`.
+    """
+
+    def __init__(self, stream=None, unprotect=True, **credentials):
+        self.unprotect_mode = unprotect
+        self.entries = []
+        self.salsa = None
+        KDB4File.__init__(self, stream, **credentials)
+
+    def _payload_sink(self):
+        self._target = EntryTarget()
+        # huge_tree: documents of large databases exceed the limits of libxml2
+        return pipeline.ParserSink(
+            etree.XMLParser(target=self._target, huge_tree=True))
+
+    def _payload_done(self):
+        self.entries = self._target.entries
+        self._target = None
+        self.salsa = self._inner_random_stream()
+        if self.unprotect_mode is True:
+            self.unprotect()
+
+    def get_protected_value(self, value):
+        """Return the unprotected text of the ProtectedText `value`."""
+        if not value.text:
+            return ''
+        tmp = base64.b64decode(value.text.encode("utf-8"))
+        return xor_bytes(tmp, keystream_at(self.salsa, value.offset,
+                                           len(tmp))).decode("utf-8")
+
+    def unprotect(self):
+        """
+        Replace all ProtectedText values of the entries with their unprotected
+        text. The keystream up to the last of them is generated at once and
+        all values are XORed in one go.
+        """
+        protected = [(fields, key, value)
+                     for _, _, fields in self.entries
+                     for key, value in fields.items()
+                     if isinstance(value, ProtectedText)]
+        if not protected:
+            return
+        with instrument.stage('unprotect', values=len(protected)):
+            self._unprotect_values(protected)
+
+    def _unprotect_values(self, protected):
+        """Unprotect the (fields, key, ProtectedText) in `protected`."""
+        chunks = [base64.b64decode(value.text.encode("utf-8"))
+                  for _, _, value in protected]
+        end = max(value.offset + len(chunk)
+                  for (_, _, value), chunk in zip(protected, chunks))
+        stream = memoryview(keystream_at(self.salsa, 0, end))
+        plain = xor_bytes(
+            b''.join(chunks),
+            b''.join([stream[value.offset:value.offset + len(chunk)]
+                      for (_, _, value), chunk in zip(protected, chunks)]))
+        pos = 0
+        for (fields, key, _), chunk in zip(protected, chunks):
+            fields[key] = plain[pos:pos + len(chunk)].decode("utf-8")
+            pos += len(chunk)
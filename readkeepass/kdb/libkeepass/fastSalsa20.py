@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+fastSalsa20.py -- a batched Salsa20 keystream generator
+=======================================================
+
+This module provides a `Salsa20` class with the same API as the one in
+pureSalsa20.py (setKey, setIV, setCounter, getCounter, setRounds,
+encryptBytes, decryptBytes), but it generates the keystream for many 64-byte
+blocks per call instead of one block per Python call.
+
+If NumPy is installed, the 16 state words of every block are kept in uint32
+lanes (one lane per block) so that each quarter-round is a handful of array
+operations for the whole batch. Without NumPy a pure Python fallback is used,
+which works on plain unsigned integers (no add32/rot32 function calls) and
+XORs the whole message in one big-integer operation.
+
+Sample usage:
+    from fastSalsa20 import Salsa20
+    s20 = Salsa20(key, IV)
+    dataout = s20.encryptBytes(datain)   # same for decrypt
+"""
+
+from struct import Struct
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+little4_u32 = Struct("<4I")  # 4 little-endian 32-bit unsigned ints.
+little2_u32 = Struct("<2I")  # 2 little-endian 32-bit unsigned ints.
+little16_u32 = Struct("<16I")  # 16 little-endian 32-bit unsigned ints.
+
+MASK32 = 0xFFFFFFFF
+BLOCK_SIZE = 64
+# number of blocks which are generated together in one NumPy batch (256 KiB)
+BATCH_BLOCKS = 4096
+
+# the quarter-rounds of a double round as (a, b, c, d) state indices
+_COLUMN_ROUND = ((0, 4, 8, 12), (5, 9, 13, 1), (10, 14, 2, 6), (15, 3, 7, 11))
+_ROW_ROUND = ((0, 1, 2, 3), (5, 6, 7, 4), (10, 11, 8, 9), (15, 12, 13, 14))
+_DOUBLE_ROUND = _COLUMN_ROUND + _ROW_ROUND
+
+
+class Salsa20(object):
+    def __init__(self, key=None, IV=None, rounds=20):
+        self._lastChunk64 = True
+        self._IVbitlen = 64  # must be 64 bits
+        self.ctx = [0] * 16
+        if key:
+            self.setKey(key)
+        if IV:
+            self.setIV(IV)
+
+        self.setRounds(rounds)
+
+    def setKey(self, key):
+        assert type(key) == bytes
+        ctx = self.ctx
+        if len(key) == 32:  # recommended
+            constants = b"expand 32-byte k"
+            ctx[1], ctx[2], ctx[3], ctx[4] = little4_u32.unpack(key[0:16])
+            ctx[11], ctx[12], ctx[13], ctx[14] = little4_u32.unpack(key[16:32])
+        elif len(key) == 16:
+            constants = b"expand 16-byte k"
+            ctx[1], ctx[2], ctx[3], ctx[4] = little4_u32.unpack(key[0:16])
+            ctx[11], ctx[12], ctx[13], ctx[14] = little4_u32.unpack(key[0:16])
+        else:
+            raise Exception("key length isn't 32 or 16 bytes.")
+        ctx[0], ctx[5], ctx[10], ctx[15] = little4_u32.unpack(constants)
+
+    def setIV(self, IV):
+        assert type(IV) == bytes
+        assert len(IV) * 8 == 64, 'nonce (IV) not 64 bits'
+        self.IV = IV
+        ctx = self.ctx
+        ctx[6], ctx[7] = little2_u32.unpack(IV)
+        ctx[8], ctx[9] = 0, 0  # Reset the block counter.
+
+    setNonce = setIV  # support an alternate name
+
+    def setCounter(self, counter):
+        assert (0 <= counter < 1 << 64), "counter < 0 or >= 2**64"
+        ctx = self.ctx
+        ctx[8], ctx[9] = counter & MASK32, counter >> 32
+
+    def getCounter(self):
+        return self.ctx[8] | (self.ctx[9] << 32)
+
+    def setRounds(self, rounds, testing=False):
+        assert testing or rounds in [8, 12, 20], 'rounds must be 8, 12, 20'
+        self.rounds = rounds
+
+    def keystreamBytes(self, length):
+        """
+        Return the next `length` bytes of keystream and advance the block
+        counter past every block that was (partially) used.
+        """
+        assert self._lastChunk64, 'previous chunk not multiple of 64 bytes'
+        nblocks = -(-length // BLOCK_SIZE)
+        counter = self.getCounter()
+        if _np is not None:
+            stream = _keystream_numpy(self.ctx, self.rounds, counter, nblocks)
+        else:
+            stream = _keystream_python(self.ctx, self.rounds, counter, nblocks)
+        # Stopping at 2^70 bytes per nonce is user's responsibility.
+        self.setCounter((counter + nblocks) % 2 ** 64)
+        self._lastChunk64 = not length % BLOCK_SIZE
+        return stream[:length]
+
+    def encryptBytes(self, data):
+        assert type(data) in (bytes, bytearray), 'data must be byes or bytearray'
+        lendata = len(data)
+        stream = self.keystreamBytes(lendata)
+        return xor_bytes(data, stream)
+
+    decryptBytes = encryptBytes  # encrypt and decrypt use same function
+
+
+def xor_bytes(aa, bb):
+    """Return the bytewise XOR of the equally long `aa` and `bb` as bytes."""
+    if not aa:
+        return bytes()
+    if _np is not None:
+        a = _np.frombuffer(aa, dtype=_np.uint8)
+        b = _np.frombuffer(bb, dtype=_np.uint8)
+        return (a ^ b).tobytes()
+    x = int.from_bytes(aa, 'little') ^ int.from_bytes(bb, 'little')
+    return x.to_bytes(len(aa), 'little')
+
+
+# --------------------------------------------------------------------------
+
+def _keystream_numpy(ctx, rounds, counter, nblocks):
+    """
+    Return `nblocks` keystream blocks starting at block `counter`. Each of the
+    16 state words is a uint32 array holding that word for every block.
+    """
+    out = []
+    for start in range(0, nblocks, BATCH_BLOCKS):
+        n = min(BATCH_BLOCKS, nblocks - start)
+        counters = (_np.arange(n, dtype=_np.uint64)
+                    + _np.uint64((counter + start) % 2 ** 64))
+        state = [_np.full(n, word, dtype=_np.uint32) for word in ctx]
+        state[8] = (counters & _np.uint64(MASK32)).astype(_np.uint32)
+        state[9] = (counters >> _np.uint64(32)).astype(_np.uint32)
+
+        x = [word.copy() for word in state]
+        for i in range(rounds // 2):
+            for a, b, c, d in _DOUBLE_ROUND:
+                t = x[a] + x[d]
+                x[b] ^= (t << 7) | (t >> 25)
+                t = x[b] + x[a]
+                x[c] ^= (t << 9) | (t >> 23)
+                t = x[c] + x[b]
+                x[d] ^= (t << 13) | (t >> 19)
+                t = x[d] + x[c]
+                x[a] ^= (t << 18) | (t >> 14)
+
+        blocks = _np.empty((n, 16), dtype='<u4')
+        for i in range(16):
+            blocks[:, i] = x[i] + state[i]
+        out.append(blocks.tobytes())
+    return b''.join(out)
+
+
+def _keystream_python(ctx, rounds, counter, nblocks):
+    """
+    Return `nblocks` keystream blocks starting at block `counter` using plain
+    Python integers.
+    """
+    M = MASK32
+    pack = little16_u32.pack
+    out = []
+    j0, j1, j2, j3, j4, j5, j6, j7, _, _, j10, j11, j12, j13, j14, j15 = ctx
+    for n in range(counter, counter + nblocks):
+        n %= 2 ** 64
+        j8, j9 = n & M, n >> 32
+        x0, x1, x2, x3, x4, x5, x6, x7 = j0, j1, j2, j3, j4, j5, j6, j7
+        x8, x9, x10, x11, x12, x13, x14, x15 = j8, j9, j10, j11, j12, j13, j14, j15
+        for i in range(rounds // 2):
+            t = (x0 + x12) & M; x4 ^= ((t << 7) | (t >> 25)) & M
+            t = (x4 + x0) & M; x8 ^= ((t << 9) | (t >> 23)) & M
+            t = (x8 + x4) & M; x12 ^= ((t << 13) | (t >> 19)) & M
+            t = (x12 + x8) & M; x0 ^= ((t << 18) | (t >> 14)) & M
+            t = (x5 + x1) & M; x9 ^= ((t << 7) | (t >> 25)) & M
+            t = (x9 + x5) & M; x13 ^= ((t << 9) | (t >> 23)) & M
+            t = (x13 + x9) & M; x1 ^= ((t << 13) | (t >> 19)) & M
+            t = (x1 + x13) & M; x5 ^= ((t << 18) | (t >> 14)) & M
+            t = (x10 + x6) & M; x14 ^= ((t << 7) | (t >> 25)) & M
+            t = (x14 + x10) & M; x2 ^= ((t << 9) | (t >> 23)) & M
+            t = (x2 + x14) & M; x6 ^= ((t << 13) | (t >> 19)) & M
+            t = (x6 + x2) & M; x10 ^= ((t << 18) | (t >> 14)) & M
+            t = (x15 + x11) & M; x3 ^= ((t << 7) | (t >> 25)) & M
+            t = (x3 + x15) & M; x7 ^= ((t << 9) | (t >> 23)) & M
+            t = (x7 + x3) & M; x11 ^= ((t << 13) | (t >> 19)) & M
+            t = (x11 + x7) & M; x15 ^= ((t << 18) | (t >> 14)) & M
+
+            t = (x0 + x3) & M; x1 ^= ((t << 7) | (t >> 25)) & M
+            t = (x1 + x0) & M; x2 ^= ((t << 9) | (t >> 23)) & M
+            t = (x2 + x1) & M; x3 ^= ((t << 13) | (t >> 19)) & M
+            t = (x3 + x2) & M; x0 ^= ((t << 18) | (t >> 14)) & M
+            t = (x5 + x4) & M; x6 ^= ((t << 7) | (t >> 25)) & M
+            t = (x6 + x5) & M; x7 ^= ((t << 9) | (t >> 23)) & M
+            t = (x7 + x6) & M; x4 ^= ((t << 13) | (t >> 19)) & M
+            t = (x4 + x7) & M; x5 ^= ((t << 18) | (t >> 14)) & M
+            t = (x10 + x9) & M; x11 ^= ((t << 7) | (t >> 25)) & M
+            t = (x11 + x10) & M; x8 ^= ((t << 9) | (t >> 23)) & M
+            t = (x8 + x11) & M; x9 ^= ((t << 13) | (t >> 19)) & M
+            t = (x9 + x8) & M; x10 ^= ((t << 18) | (t >> 14)) & M
+            t = (x15 + x14) & M; x12 ^= ((t << 7) | (t >> 25)) & M
+            t = (x12 + x15) & M; x13 ^= ((t << 9) | (t >> 23)) & M
+            t = (x13 + x12) & M; x14 ^= ((t << 13) | (t >> 19)) & M
+            t = (x14 + x13) & M; x15 ^= ((t << 18) | (t >> 14)) & M
+        out.append(pack(
+            (x0 + j0) & M, (x1 + j1) & M, (x2 + j2) & M, (x3 + j3) & M,
+            (x4 + j4) & M, (x5 + j5) & M, (x6 + j6) & M, (x7 + j7) & M,
+            (x8 + j8) & M, (x9 + j9) & M, (x10 + j10) & M, (x11 + j11) & M,
+            (x12 + j12) & M, (x13 + j13) & M, (x14 + j14) & M, (x15 + j15) & M,
+        ))
+    return b''.join(out)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import io
+import hmac
 import struct
 import hashlib
 
@@ -7,13 +8,87 @@ import hashlib
 BLOCK_LENGTH = 1024 * 1024
 # HEADER_LENGTH = 4+32+4
 
+# block index (4 bytes), hash (32 bytes) and block length (4 bytes)
+BLOCK_HEADER = struct.Struct('<I32sI')
+_uint32 = struct.Struct('<I')
+
+
 def read_int(stream, length):
     try:
-        return struct.unpack('<I', stream.read(length))[0]
+        return _uint32.unpack_from(stream.read(length))[0]
     except:
         return None
 
 
+def next_block(view, pos=0):
+    """
+    Parse the hashed block at position `pos` of the memoryview `view` and
+    verify its hash in place. Returns a tuple (data, end) of the block data,
+    a memoryview slice of `view`, and the position after the block. The data
+    is empty for the final block of a stream. If `view` ends before the
+    block, data is None and end is the position up to which `view` has to
+    reach to hold the block header or the whole block.
+
+    Raises an IOError if the hash does not match.
+    """
+    start = pos + BLOCK_HEADER.size
+    if len(view) < start:
+        return None, start
+    index, bhash, length = BLOCK_HEADER.unpack_from(view, pos)
+    end = start + length
+    if len(view) < end:
+        return None, end
+    data = view[start:end]
+    if length > 0 and hashlib.sha256(data).digest() != bhash:
+        raise IOError('Block hash mismatch error.')
+    return data, end
+
+
+def iter_blocks(data):
+    """
+    Yield the verified data of each block in the hashed block stream `data`
+    (a bytes-like object) as memoryview slices, without copying it. Raises an
+    IOError if a hash does not match or the stream ends without final block.
+    """
+    view = memoryview(data)
+    pos = 0
+    while True:
+        block, pos = next_block(view, pos)
+        if block is None:
+            raise IOError('Unexpected end of block stream.')
+        if not block:
+            return
+        yield block
+
+
+class HashedBlockReader(io.RawIOBase):
+    """
+    A read-only raw stream of the data in the hashed block stream `data`.
+    Blocks are verified when the reading reaches them and `readinto` copies
+    straight out of `data`, so there are no intermediate buffers. Wrap it in
+    io.BufferedReader for line-wise or small reads.
+    """
+
+    def __init__(self, data):
+        io.RawIOBase.__init__(self)
+        self._blocks = iter_blocks(data)
+        self._block = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._block:
+            self._block = next(self._blocks, None)
+            if self._block is None:
+                self._block = memoryview(b'')
+                return 0
+        n = min(len(b), len(self._block))
+        memoryview(b).cast('B')[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+
 class HashedBlockIO(io.BytesIO):
     """
     The data is stored in hashed blocks. Each block consists of a block index (4
@@ -40,7 +115,10 @@ class HashedBlockIO(io.BytesIO):
                 raise TypeError('Stream does not have the buffer interface.')
             input_stream = block_stream
         elif initial_bytes is not None:
-            input_stream = io.BytesIO(initial_bytes)
+            # verify the blocks in place, without a copy in another BytesIO
+            for block in iter_blocks(initial_bytes):
+                self.write(block)
+            self.seek(0)
         if input_stream is not None:
             self.read_block_stream(input_stream)
 
@@ -107,3 +185,55 @@ class HashedBlockIO(io.BytesIO):
                 stream.write(struct.pack('<I', 0))
                 break
 
+
+# KDBX 4 HMAC-SHA256 block stream
+
+# block index used for the HMAC of the KDBX 4 header
+HEADER_HMAC_INDEX = 0xFFFFFFFFFFFFFFFF
+
+
+def hmac_block_key(key, index):
+    """
+    Return the HMAC key of block number `index`, derived from the 64 byte
+    `key` (SHA-512 of master seed, transformed key and 0x01).
+    """
+    return hashlib.sha512(struct.pack('<Q', index) + key).digest()
+
+
+def hmac_digest(key, index, data):
+    """Return the HMAC-SHA256 of `data` for block number `index`."""
+    return hmac.new(hmac_block_key(key, index), data, hashlib.sha256).digest()
+
+
+def read_hmac_blocks(stream, key):
+    """
+    Read a KDBX 4 HMAC block stream from `stream` and yield the verified data
+    of one block at a time, so the whole stream never has to be in memory.
+
+    Each block consists of its HMAC-SHA256 (32 bytes), the block length (4
+    bytes) and the block data. The HMAC is computed over the 8 byte block
+    index, the length and the data, with a key derived from `key` and the
+    index. A block of length 0 ends the stream. An IOError is raised when a
+    HMAC does not match or the stream ends early.
+    """
+    index = 0
+    while True:
+        block_hmac = stream.read(32)
+        raw_length = stream.read(4)
+        if len(block_hmac) != 32 or len(raw_length) != 4:
+            raise IOError('Unexpected end of block stream.')
+        length = struct.unpack('<i', raw_length)[0]
+        data = stream.read(length) if length > 0 else bytes()
+        if len(data) != max(length, 0):
+            raise IOError('Unexpected end of block stream.')
+
+        mac = hmac.new(hmac_block_key(key, index), digestmod=hashlib.sha256)
+        mac.update(struct.pack('<Q', index))
+        mac.update(raw_length)
+        mac.update(data)
+        if not hmac.compare_digest(mac.digest(), block_hmac):
+            raise IOError('Block HMAC mismatch error.')
+        if length <= 0:
+            return
+        yield data
+        index += 1
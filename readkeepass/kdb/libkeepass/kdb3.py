@@ -15,8 +15,10 @@ import base64
 from . crypto import xor, sha256, aes_cbc_decrypt
 from . crypto import transform_key, unpad
 
-from . common import load_keyfile, stream_unpack
+from . common import load_plain_keyfile, stream_unpack
 from . common import KDBFile, HeaderDictionary
+from . entries import EntryRecord
+from ... import instrument
 
 
 KDB3_SIGNATURE = (0x9AA2D903, 0xB54BFB65)
@@ -60,6 +62,11 @@ class KDB3File(KDBFile):
         self.header = KDB3Header()
         KDBFile.__init__(self, stream, **credentials)
 
+    @property
+    def transform_rounds(self):
+        """The number of key transformation rounds set in the header."""
+        return self.header.KeyEncRounds
+
     def _read_header(self, stream):
         """
         Parses the header and write the values into self.header. Also sets
@@ -84,12 +91,25 @@ class KDB3File(KDBFile):
         if self.header_length != stream.tell():
             raise IOError('Unexpected header length! What did you do!?')
 
+    def add_credentials(self, **credentials):
+        # KeePass 1.x has no XML keyfiles, any keyfile is read as plain key
+        if 'password' in credentials:
+            self.add_key_hash(sha256(credentials['password'].encode('utf-8')))
+        if 'keyfile' in credentials:
+            self.add_key_hash(load_plain_keyfile(credentials['keyfile']))
+
     def _decrypt(self, stream):
+        if not self.header.Flags & 2:
+            raise IOError('Unsupported cipher, only AES is supported.')
         super(KDB3File, self)._decrypt(stream)
 
-        data = aes_cbc_decrypt(stream.read(), self.master_key,
-                               self.header.EncryptionIV)
-        data = unpad(data)
+        with instrument.stage('decrypt') as st:
+            payload = stream.read()
+            data = aes_cbc_decrypt(payload, self.master_key,
+                                   self.header.EncryptionIV)
+            data = unpad(data)
+            if st:
+                st.set(bytes_in=len(payload), bytes_out=len(data))
 
         if self.header.ContentHash == sha256(data):
             # put data in bytes io
@@ -107,24 +127,135 @@ class KDB3File(KDBFile):
         combination with the master seed.
         """
         super(KDB3File, self)._make_master_key()
-        # print "masterkey:", ''.join(self.keys).encode('hex')
-        #composite = sha256(''.join(self.keys))
-        #TODO python-keepass does not support keyfiles, there seems to be a
-        # different way to hash those keys in kdb3
-        composite = self.keys[0]
-        tkey = transform_key(composite,
-                             self.header.MasterSeed2,
-                             self.header.KeyEncRounds)
+        # unlike kdb4 a single key is used as it is, the password hash and
+        # the keyfile key are hashed together
+        if len(self.keys) == 1:
+            composite = self.keys[0]
+        else:
+            composite = sha256(b''.join(self.keys))
+        with instrument.stage('kdf', rounds=self.header.KeyEncRounds):
+            tkey = transform_key(composite,
+                                 self.header.MasterSeed2,
+                                 self.header.KeyEncRounds)
         self.master_key = sha256(self.header.MasterSeed + tkey)
 
 
+# field types of the group and entry records
+FIELD_END = 0xFFFF
+GROUP_ID = 0x0001
+GROUP_NAME = 0x0002
+GROUP_LEVEL = 0x0008
+ENTRY_UUID = 0x0001
+ENTRY_GROUP_ID = 0x0002
+ENTRY_BINARY_DESC = 0x000D
+# entry field type -> key of the string field in kdb4
+ENTRY_STRINGS = {
+    0x0004: 'Title',
+    0x0005: 'URL',
+    0x0006: 'UserName',
+    0x0007: 'Password',
+    0x0008: 'Notes',
+}
+
+_FIELD_HEADER = struct.Struct('<HI')
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+
+
+def _text(view, pos, size):
+    """Return the null terminated utf-8 string of size bytes at pos."""
+    end = pos + size
+    if size and view[end - 1] == 0:
+        end -= 1
+    return str(view[pos:end], 'utf-8', 'replace')
+
+
+def _is_meta_stream(fields, binary_desc):
+    """Return True for the entries KeePass 1.x stores its settings in."""
+    return (binary_desc == 'bin-stream' and
+            fields.get('Title') == 'Meta-Info' and
+            fields.get('UserName') == 'SYSTEM' and
+            fields.get('URL') == '$')
+
+
 class KDBExtension:
     """
-    The KDB3 payload is a ... #TODO ...
+    The KDB3 payload is a list of the groups followed by a list of the
+    entries (their number is in the header). Each group and entry is a list
+    of fields, each field is a uint16 type, a uint32 size and the data. A
+    FIELD_END field ends the group or entry.
+
+    The groups form a tree by their level; the entries refer to their group
+    by its id. `entries` is the list of the entries as EntryRecords, like
+    those of the KDB4EntryReader. The payload is read through a memoryview,
+    only the strings are copied out of it.
     """
 
     def __init__(self):
-        pass
+        self.entries = []
+        if self.opened:
+            with instrument.stage('parse') as st, \
+                    self.in_buffer.getbuffer() as view:
+                self.entries = self._parse_payload(view)
+                if st:
+                    st.set(bytes_in=len(view), entries=len(self.entries))
+
+    def _parse_payload(self, view):
+        """Return the entries of the payload in the memoryview `view`."""
+        unpack_field = _FIELD_HEADER.unpack_from
+        pos, end = 0, len(view)
+        try:
+            # group id -> group path
+            groups = {}
+            path = []
+            for _ in range(self.header.Groups):
+                group_id, name, level = None, '', 0
+                while True:
+                    field, size = unpack_field(view, pos)
+                    pos += 6
+                    if pos + size > end:
+                        raise struct.error()
+                    if field == FIELD_END:
+                        pos += size
+                        break
+                    if field == GROUP_ID:
+                        group_id = _UINT32.unpack_from(view, pos)[0]
+                    elif field == GROUP_NAME:
+                        name = _text(view, pos, size)
+                    elif field == GROUP_LEVEL:
+                        level = _UINT16.unpack_from(view, pos)[0]
+                    pos += size
+                del path[level:]
+                path.append(name)
+                groups[group_id] = tuple(path)
+
+            entries = []
+            for _ in range(self.header.Entries):
+                uuid, group_id, binary_desc, fields = '', None, '', {}
+                while True:
+                    field, size = unpack_field(view, pos)
+                    pos += 6
+                    if pos + size > end:
+                        raise struct.error()
+                    if field == FIELD_END:
+                        pos += size
+                        break
+                    if field in ENTRY_STRINGS:
+                        fields[ENTRY_STRINGS[field]] = _text(view, pos, size)
+                    elif field == ENTRY_UUID:
+                        uuid = base64.b64encode(
+                            view[pos:pos + size]).decode('ascii')
+                    elif field == ENTRY_GROUP_ID:
+                        group_id = _UINT32.unpack_from(view, pos)[0]
+                    elif field == ENTRY_BINARY_DESC:
+                        binary_desc = _text(view, pos, size)
+                    pos += size
+                if not _is_meta_stream(fields, binary_desc):
+                    entries.append(
+                        EntryRecord(uuid, groups.get(group_id, ()), fields))
+        except struct.error:
+            raise IOError('Unexpected end of the payload.')
+        return entries
 
 
 class KDB3Reader(KDB3File, KDBExtension):
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 import io
+import hmac
 import uuid
 import zlib
-import gzip
 import struct
 import hashlib
 import base64
@@ -15,17 +15,33 @@ import base64
 # from libkeepass.common import KDBFile, HeaderDictionary
 # from libkeepass.hbio import HashedBlockIO
 
-from . crypto import xor, sha256, aes_cbc_decrypt, aes_cbc_encrypt
-from . crypto import transform_key, pad, unpad
+from . crypto import xor, sha256, sha512, aes_cbc_decrypt
+from . crypto import transform_key, unpad
+from . crypto import AESCBCDecryptor, AESCBCEncryptor, ChaCha20Decryptor
 
 from . common import load_keyfile, stream_unpack
 
 from . common import KDBFile, HeaderDictionary
-from . hbio import HashedBlockIO
+from . hbio import read_hmac_blocks, hmac_digest, HEADER_HMAC_INDEX
+from . import kdf
+from . import pipeline
+from . import variantdict
+from ... import instrument
 
 
 KDB4_SALSA20_IV = bytes(bytearray.fromhex('e830094b97205d2a'))
 KDB4_SIGNATURE = (0x9AA2D903, 0xB54BFB67)
+# files with this major version use the KDBX 4 layout
+KDBX4_MAJOR_VERSION = 4
+KDBX_MAX_MAJOR_VERSION = 4
+
+# payload ciphers (CipherID)
+CIPHER_AES256 = bytes(bytearray.fromhex('31c1f2e6bf714350be5805216afc5aff'))
+CIPHER_CHACHA20 = bytes(bytearray.fromhex('d6038a2b8b6f4cb5a524339a31dbb59a'))
+
+# inner random streams (InnerRandomStreamID)
+STREAM_SALSA20 = 2
+STREAM_CHACHA20 = 3
 
 
 class KDB4Header(HeaderDictionary):
@@ -50,16 +66,47 @@ class KDB4Header(HeaderDictionary):
         'StreamStartBytes': 9,
         # cipher used to protect data in xml (ARC4 or Salsa20)
         'InnerRandomStreamID': 10,
+        # KDBX 4: VariantDictionary with the key derivation function and its
+        # parameters, replaces TransformSeed and TransformRounds
+        'KdfParameters': 11,
+        # KDBX 4: VariantDictionary with plugin data
+        'PublicCustomData': 12,
     }
 
-    fmt = {3: '<I', 6: '<q'}
+    fmt = {3: '<I', 6: '<q', 10: '<I'}
+
+
+class KDB4InnerHeader(HeaderDictionary):
+    """
+    The inner header at the start of the decrypted KDBX 4 payload. Its fields
+    replace ProtectedStreamKey and InnerRandomStreamID of the outer header and
+    hold the attachments, which are collected in a list (`binaries`) since the
+    Binary field can occur many times.
+    """
+    fields = {
+        'EndOfHeader': 0,
+        'InnerRandomStreamID': 1,
+        'InnerRandomStreamKey': 2,
+        'Binary': 3,
+    }
+
+    fmt = {1: '<I'}
 
 
 class KDB4File(KDBFile):
     def __init__(self, stream=None, **credentials):
         self.header = KDB4Header()
+        self.inner_header = KDB4InnerHeader()
+        self.binaries = []
+        # (major, minor) file version, set by _read_header
+        self.version = (3, 1)
         KDBFile.__init__(self, stream, **credentials)
 
+    @property
+    def is_kdbx4(self):
+        """True if the file uses the KDBX 4 layout."""
+        return self.version[0] >= KDBX4_MAJOR_VERSION
+
     def set_compression(self, flag=1):
         """Dis- (0) or enable (default: 1) compression"""
         if flag not in [0, 1]:
@@ -69,6 +116,22 @@ class KDB4File(KDBFile):
     # def set_comment(self, comment):
     # self.header.Comment = comment
 
+    @property
+    def transform_rounds(self):
+        """
+        The number of key transformation rounds set in the header. For KDBX 4
+        files using Argon2 this is a comparable measure of the KDF work, see
+        `kdf.cost`.
+        """
+        if self.is_kdbx4:
+            return kdf.cost(self.kdf_parameters)
+        return self.header.TransformRounds
+
+    @property
+    def kdf_parameters(self):
+        """The parsed KdfParameters VariantDictionary of a KDBX 4 header."""
+        return variantdict.parse(self.header.KdfParameters)
+
     def read_from(self, stream):
         """
         Read, parse, decrypt, decompress a KeePass file from a stream.
@@ -76,20 +139,26 @@ class KDB4File(KDBFile):
         :arg stream: A file-like object (opened in 'rb' mode) or IO buffer
             containing a KeePass file.
         """
+        # the payload is decompressed while it is decrypted
         super(KDB4File, self).read_from(stream)
-        if self.header.CompressionFlags == 1:
-            self._unzip()
 
-    def write_to(self, stream):
+    def write_to(self, stream, write_xml=None):
         """
         Write the KeePass database back to a KeePass2 compatible file.
         
         :arg stream: A writeable file-like object or IO buffer.
+        :arg write_xml: A function `write_xml(out, header)` writing the XML
+            document to the file-like `out`, given the serialized `header`.
+            By default the in-buffer is written.
         """
-        if not (isinstance(stream, io.IOBase) or isinstance(stream, file)):
+        if not self._is_file(stream):
             raise TypeError('Stream does not have the buffer interface.')
+        if self.is_kdbx4:
+            raise NotImplementedError('Writing KDBX 4 files is not supported.')
+        if write_xml is None:
+            write_xml = self._write_buffer
 
-        self._write_header(stream)
+        self._write_header(stream, write_xml)
 
     def _read_header(self, stream):
         """
@@ -99,10 +168,18 @@ class KDB4File(KDBFile):
         # KeePass 2.07 has version 1.01,
         # 2.08 has 1.02,
         # 2.09 has 2.00, 2.10 has 2.02, 2.11 has 2.04,
-        # 2.15 has 3.00.
+        # 2.15 has 3.00, 2.35 has 4.00.
         # The first 2 bytes are critical (i.e. loading will fail, if the
         # file version is too high), the last 2 bytes are informational.
-        # TODO implement version check
+        # (They are stored in little endian order after the signature,
+        # so the minor version comes first.)
+        minor = stream_unpack(stream, 8, 2, 'H')
+        major = stream_unpack(stream, None, 2, 'H')
+        if major > KDBX_MAX_MAJOR_VERSION:
+            raise IOError('Unsupported file version {}.{}.'.format(major, minor))
+        self.version = (major, minor)
+        # KDBX 4 stores the length of a field in 4 bytes instead of 2
+        length_size, length_code = (4, 'I') if self.is_kdbx4 else (2, 'h')
 
         # the first header field starts at byte 12 after the signature
         stream.seek(12)
@@ -111,12 +188,12 @@ class KDB4File(KDBFile):
             # field_id is a single byte
             field_id = stream_unpack(stream, None, 1, 'b')
 
-            # field_id >10 is undefined
+            # field_id >12 is undefined
             if not field_id in self.header.fields.values():
                 raise IOError('Unknown header field found.')
 
-            # two byte (short) length of field data
-            length = stream_unpack(stream, None, 2, 'h')
+            # length of field data
+            length = stream_unpack(stream, None, length_size, length_code)
             if length > 0:
                 data = stream_unpack(stream, None, length, '{}s'.format(length))
                 self.header.b[field_id] = data
@@ -146,37 +223,45 @@ class KDB4File(KDBFile):
 
         return header
 
-    def _write_header(self, stream):
+    def _write_header(self, stream, write_xml):
         """Serialize the header fields from self.header into a byte stream, prefix
-        with file signature and version before writing header and out-buffer
+        with file signature and version before writing header and payload
         to `stream`.
 
+        The XML document written by `write_xml` is compressed, split into
+        hashed blocks and encrypted as it is written, so neither the document
+        nor the payload is held in memory as a whole.
+
         Note, that `stream` is flushed, but not closed!"""
         header = self._header()
 
         # write header to stream
         stream.write(header)
 
-        headerHash = base64.b64encode(sha256(header))
-        self.obj_root.Meta.HeaderHash = headerHash
-
-        # create HeaderHash if it does not exist
-        if len(self.obj_root.Meta.xpath("HeaderHash")) < 1:
-            etree.SubElement(self.obj_root.Meta, "HeaderHash")
-
-        # reload out_buffer because we just changed the HeaderHash
-        self.protect()
-        self.out_buffer = io.BytesIO(self.pretty_print())
-
+        # rebuild master key from (possibly) updated header
+        self._make_master_key()
+        out = pipeline.StreamSink(stream)
+        sink = pipeline.Encrypt(
+            AESCBCEncryptor(self.master_key, self.header.EncryptionIV), out)
+        # write start bytes (for successful decrypt check)
+        sink.feed(self.header.StreamStartBytes)
+        sink = pipeline.MakeHashedBlocks(sink)
         # zip or not according to header setting
         if self.header.CompressionFlags == 1:
-            self._zip()
-
-        self._encrypt();
-
-        # write encrypted block to stream
-        stream.write(self.out_buffer)
-        stream.flush()
+            sink = pipeline.Deflate(sink)
+        with instrument.stage('write') as st:
+            write_xml(pipeline.StageWriter(sink), header)
+            sink.flush()
+            if st:
+                st.set(bytes_out=len(header) + out.bytes)
+
+    def _write_buffer(self, out, header):
+        """Write the in-buffer to `out`."""
+        if self.in_buffer is None:
+            raise IOError('There is no in-buffer to write.')
+        self.in_buffer.seek(0)
+        for chunk in pipeline.read_chunks(self.in_buffer):
+            out.write(chunk)
 
     def _decrypt(self, stream):
         """
@@ -187,67 +272,126 @@ class KDB4File(KDBFile):
         in-buffer.
         """
         super(KDB4File, self)._decrypt(stream)
+        if self.is_kdbx4:
+            return self._decrypt4(stream)
 
-        data = aes_cbc_decrypt(stream.read(), self.master_key,
-                               self.header.EncryptionIV)
-        data = unpad(data)
-
-        length = len(self.header.StreamStartBytes)
-        if self.header.StreamStartBytes == data[:length]:
-            # skip startbytes and wrap data in a hashed block io
-            self.in_buffer = HashedBlockIO(initial_bytes=data[length:])
-            # set successful decryption flag
-            self.opened = True
-        else:
+        sink = self._payload_sink()
+        if self.header.CompressionFlags == 1:
+            sink = pipeline.Inflate(sink)
+        stage = pipeline.Decrypt(
+            AESCBCDecryptor(self.master_key, self.header.EncryptionIV),
+            pipeline.StartBytes(self.header.StreamStartBytes,
+                                pipeline.HashedBlocks(sink)))
+        self._run_pipeline(pipeline.read_chunks(stream), stage)
+        # set successful decryption flag
+        self.opened = True
+        self._payload_done()
+
+    def _decrypt4(self, stream):
+        """
+        Verify the KDBX 4 header, then read the HMAC block stream after it
+        block by block: verify, decrypt and decompress each block as it
+        arrives. The inner header is parsed and the XML document is passed on
+        to the payload sink.
+        """
+        header_hash = stream.read(32)
+        header_hmac = stream.read(32)
+        stream.seek(0)
+        header = stream.read(self.header_length)
+        stream.seek(self.header_length + 64)
+        if sha256(header) != header_hash:
+            raise IOError('Header hash mismatch error.')
+        expected = hmac_digest(self.hmac_key, HEADER_HMAC_INDEX, header)
+        if not hmac.compare_digest(expected, header_hmac):
             raise IOError('Master key invalid.')
+        # the credentials are correct now
+        self.opened = True
+
+        sink = pipeline.HeaderFields(self._read_inner_field,
+                                     self._payload_sink())
+        if self.header.CompressionFlags == 1:
+            sink = pipeline.Inflate(sink)
+        stage = pipeline.Decrypt(self._payload_cipher(), sink)
+        self._run_pipeline(read_hmac_blocks(stream, self.hmac_key), stage)
+        self._payload_done()
 
-    def _encrypt(self):
+    def _run_pipeline(self, chunks, stage):
         """
-        Rebuild the master key from header settings and key-hash list. Encrypt
-        the stream start bytes and the out-buffer formatted as hashed block
-        stream with padding added as needed.
+        Run the payload pipeline. With instrumentation enabled the whole run
+        and each of its stages are recorded.
         """
-        # rebuild master key from (possibly) updated header
-        self._make_master_key()
+        if not instrument.enabled():
+            return pipeline.run(chunks, stage)
+        head, probes = pipeline.probe(stage)
+        with instrument.stage('payload', version=list(self.version)) as st:
+            pipeline.run(chunks, head)
+        for name, seconds, bytes_in, bytes_out in pipeline.stage_times(probes):
+            instrument.add(name, st.record['start'], seconds,
+                           bytes_in=bytes_in, bytes_out=bytes_out)
+
+    def _payload_sink(self):
+        """
+        Return the pipeline sink for the decrypted XML document. It collects
+        the document, which becomes the in-buffer in `_payload_done`.
+        """
+        self._buffer_sink = pipeline.BufferSink()
+        return self._buffer_sink
 
-        # make hashed block stream
-        block_buffer = HashedBlockIO()
-        block_buffer.write(self.out_buffer.read())
-        # data is buffered in hashed block io, start a new one
-        self.out_buffer = io.BytesIO()
-        # write start bytes (for successful decrypt check)
-        self.out_buffer.write(self.header.StreamStartBytes)
-        # append blocked data to out-buffer
-        block_buffer.write_block_stream(self.out_buffer)
-        block_buffer.close()
-        self.out_buffer.seek(0)
+    def _payload_done(self):
+        """Called when the whole payload went through the pipeline."""
+        self.in_buffer = self._buffer_sink.buffer
+        self._buffer_sink = None
 
-        # encrypt the whole thing with header settings and master key
-        data = pad(self.out_buffer.read())
-        self.out_buffer = aes_cbc_encrypt(data, self.master_key,
-                                          self.header.EncryptionIV)
+    def _inner_random_stream(self):
+        """
+        Return the cipher that protects values in the XML document. KDBX 4
+        files set it in the inner header, older files in the outer header.
+        """
+        if self.is_kdbx4:
+            stream_id = self.inner_header.InnerRandomStreamID
+            key = self.inner_header.InnerRandomStreamKey
+        else:
+            stream_id = self.header.get(10, STREAM_SALSA20)
+            key = self.header.ProtectedStreamKey
+        if stream_id == STREAM_SALSA20:
+            return Salsa20(sha256(key), KDB4_SALSA20_IV)
+        if stream_id == STREAM_CHACHA20:
+            key = sha512(key)
+            return ChaCha20(key[:32], key[32:44])
+        raise IOError('Unsupported inner random stream.')
+
+    def _payload_cipher(self):
+        """Return a decryptor for the payload of a KDBX 4 file."""
+        cipher_id = self.header.CipherID
+        if cipher_id == CIPHER_AES256:
+            return AESCBCDecryptor(self.master_key, self.header.EncryptionIV)
+        if cipher_id == CIPHER_CHACHA20:
+            return ChaCha20Decryptor(self.master_key, self.header.EncryptionIV)
+        raise IOError('Unsupported cipher.')
+
+    def _read_inner_field(self, field_id, value):
+        """
+        Store a field of the KDBX 4 inner header in self.inner_header, or in
+        self.binaries if it is an attachment.
+        """
+        if not field_id in self.inner_header.fields.values():
+            raise IOError('Unknown inner header field found.')
+        if field_id == self.inner_header.fields['Binary']:
+            # first byte are flags, bit 0 means memory protection
+            self.binaries.append(value[1:])
+        elif field_id != 0:
+            self.inner_header.b[field_id] = value
 
     def _unzip(self):
         """
         Inplace decompress in-buffer. Read/write position is moved to 0.
         """
-        self.in_buffer.seek(0)
         d = zlib.decompressobj(16 + zlib.MAX_WBITS)
-        self.in_buffer = io.BytesIO(d.decompress(self.in_buffer.read()))
+        # decompress straight from the buffer, without reading a copy
+        with self.in_buffer.getbuffer() as data:
+            self.in_buffer = io.BytesIO(d.decompress(data))
         self.in_buffer.seek(0)
 
-    def _zip(self):
-        """
-        Inplace compress out-buffer. Read/write position is moved to 0.
-        """
-        data = self.out_buffer.read()
-        self.out_buffer = io.BytesIO()
-        # note: compresslevel=6 seems to be important for kdb4!
-        gz = gzip.GzipFile(fileobj=self.out_buffer, mode='wb', compresslevel=6)
-        gz.write(data)
-        gz.close()
-        self.out_buffer.seek(0)
-
     def _make_master_key(self):
         """
         Make the master key by (1) combining the credentials to create 
@@ -257,16 +401,25 @@ class KDB4File(KDBFile):
         """
         super(KDB4File, self)._make_master_key()
         composite = sha256(b''.join(self.keys))
-        tkey = transform_key(composite,
-                             self.header.TransformSeed,
-                             self.header.TransformRounds)
+        with instrument.stage('kdf') as st:
+            if st:
+                st.set(rounds=self.transform_rounds)
+            if self.is_kdbx4:
+                tkey = kdf.transform_key(composite, self.kdf_parameters)
+                # KDBX 4 authenticates header and blocks with keys derived
+                # from this hash
+                self.hmac_key = sha512(self.header.MasterSeed + tkey + b'\x01')
+            else:
+                tkey = transform_key(composite,
+                                     self.header.TransformSeed,
+                                     self.header.TransformRounds)
         self.master_key = sha256(self.header.MasterSeed + tkey)
 
 
 from lxml import etree
 from lxml import objectify
 # from libkeepass.crypto import Salsa20
-from . crypto import Salsa20
+from . crypto import Salsa20, ChaCha20, xor_bytes
 
 
 class KDBXmlExtension:
@@ -275,24 +428,67 @@ class KDBXmlExtension:
     a lxml.objectify'ed version of the XML-tree as the `obj_root` attribute.
     
     More importantly though in the XML document text values can be protected
-    using Salsa20. Protected elements are unprotected by default (passwords are
-    in clear). You can override this with the `unprotect=False` argument.
+    using Salsa20 (or ChaCha20 in KDBX 4). Protected elements are unprotected
+    by default (passwords are in clear). You can override this with the
+    `unprotect=False` argument.
+
+    With `unprotect='lazy'` the protected elements keep their protected text,
+    but the position of each value in the keystream is recorded, so a single
+    value can be decrypted on demand with `get_protected_value`.
     """
 
     def __init__(self, unprotect=True):
         self._salsa_buffer = bytearray()
-        self.salsa = Salsa20(
-            sha256(self.header.ProtectedStreamKey),
-            KDB4_SALSA20_IV)
-
-        self.in_buffer.seek(0)
-        self.tree = objectify.parse(self.in_buffer)
+        self.salsa = self._inner_random_stream()
+        # element path -> (keystream offset, length) of protected values
+        self._protected_offsets = None
+
+        root = getattr(self, 'parsed_root', None)
+        if root is not None:
+            # the document was parsed while it was decrypted
+            self.tree = root.getroottree()
+        else:
+            self.in_buffer.seek(0)
+            self.tree = objectify.parse(self.in_buffer)
         objectify.deannotate(self.tree, pytype=True, cleanup_namespaces=True)
         self.obj_root = self.tree.getroot()
 
-        if unprotect:
+        if unprotect == 'lazy':
+            self.index_protected()
+        elif unprotect:
             self.unprotect()
 
+    def index_protected(self):
+        """
+        Record the keystream offset and length of every protected value in
+        document order, without decrypting anything. The protected values can
+        then be read with `get_protected_value`.
+        """
+        # objectify elements compare by value, so they are keyed by their path
+        getpath = self.tree.getpath
+        offsets = {}
+        offset = 0
+        for elem in self.obj_root.iterfind('.//Value[@Protected="True"]'):
+            if elem.text is not None:
+                length = _b64_decoded_length(elem.text)
+                offsets[getpath(elem)] = (offset, length)
+                offset += length
+        self._protected_offsets = offsets
+
+    def get_protected_value(self, elem):
+        """
+        Return the unprotected text of the protected element `elem`, which
+        must have been recorded by `index_protected`. Only the keystream
+        blocks covering this value are generated, by moving the stream
+        counter to the right block.
+        """
+        if not elem.text:
+            return ''
+        offset, length = self._protected_offsets[self.tree.getpath(elem)]
+        stream = keystream_at(self.salsa, offset, length)
+        tmp = base64.b64decode(elem.text.encode("utf-8"))
+        return xor(tmp, stream).decode("utf-8")
+
     def unprotect(self):
         """
         Find all elements with a 'Protected=True' attribute and replace the text
@@ -303,12 +499,15 @@ class KDBXmlExtension:
         """
         self._reset_salsa()
         self.obj_root.Meta.MemoryProtection.ProtectPassword._setText('False')
-        for elem in self.obj_root.iterfind('.//Value[@Protected="True"]'):
-            if elem.text is not None:
-                elem.set('ProtectedValue', elem.text)
-                elem.set('Protected', 'False')
-                unprotected_text = self._unprotect(elem.text)
-                elem._setText(unprotected_text)
+        elems = [elem for elem in
+                 self.obj_root.iterfind('.//Value[@Protected="True"]')
+                 if elem.text is not None]
+        with instrument.stage('unprotect', values=len(elems)):
+            texts = self._unprotect_all([elem.text for elem in elems])
+        for elem, unprotected_text in zip(elems, texts):
+            elem.set('ProtectedValue', elem.text)
+            elem.set('Protected', 'False')
+            elem._setText(unprotected_text)
 
     def protect(self):
         """
@@ -322,13 +521,20 @@ class KDBXmlExtension:
         all text values of elements with 'Protected=False'. So you could use
         this after modifying a password, adding a completely new entry or
         deleting entry history items.
+
+        Values which are still protected (read with `unprotect=False` or
+        `'lazy'`) are unprotected first, so that all values are reencrypted
+        with one consistent stream.
         """
+        if self.obj_root.find('.//Value[@Protected="True"]') is not None:
+            self.unprotect()
         self._reset_salsa()
         self.obj_root.Meta.MemoryProtection.ProtectPassword._setText('True')
-        for elem in self.obj_root.iterfind('.//Value[@Protected="False"]'):
+        elems = list(self.obj_root.iterfind('.//Value[@Protected="False"]'))
+        texts = self._protect_all([elem.text or '' for elem in elems])
+        for elem, protected_text in zip(elems, texts):
             etree.strip_attributes(elem, 'ProtectedValue')
             elem.set('Protected', 'True')
-            protected_text = self._protect(elem.text)
             elem._setText(protected_text)
 
     def pretty_print(self):
@@ -336,11 +542,22 @@ class KDBXmlExtension:
         return etree.tostring(self.obj_root, pretty_print=True,
                               encoding='utf-8', standalone=True)
 
-    def write_to(self, stream):
-        """Serialize the element tree to the out-buffer."""
-        if self.out_buffer is None:
-            self.protect()
-            self.out_buffer = io.BytesIO(self.pretty_print())
+    def write_xml(self, out, header):
+        """
+        Set the HeaderHash of the serialized `header`, protect the values and
+        serialize the element tree to the file-like `out`, as it goes.
+        """
+        headerHash = base64.b64encode(sha256(header))
+        self.obj_root.Meta.HeaderHash = headerHash
+
+        # create HeaderHash if it does not exist
+        if len(self.obj_root.Meta.xpath("HeaderHash")) < 1:
+            etree.SubElement(self.obj_root.Meta, "HeaderHash")
+
+        self.protect()
+        with etree.xmlfile(out, encoding='utf-8') as xf:
+            xf.write_declaration(standalone=True)
+            xf.write(self.obj_root, pretty_print=True)
 
     def _reset_salsa(self):
         """Clear the salsa buffer and reset algorithm counter to 0."""
@@ -352,9 +569,11 @@ class KDBXmlExtension:
         Returns the next section of the "random" Salsa20 bytes with the 
         requested `length`.
         """
-        while length > len(self._salsa_buffer):
-            new_salsa = self.salsa.encryptBytes(bytearray(64))
-            self._salsa_buffer.extend(new_salsa)
+        missing = length - len(self._salsa_buffer)
+        if missing > 0:
+            # generate all missing 64 byte blocks in one go
+            nbytes = -(-missing // 64) * 64
+            self._salsa_buffer.extend(self.salsa.keystreamBytes(nbytes))
         nacho = self._salsa_buffer[:length]
         del self._salsa_buffer[:length]
         return nacho
@@ -367,6 +586,26 @@ class KDBXmlExtension:
         tmp = base64.b64decode(string.encode("utf-8"))
         return xor(tmp, self._get_salsa(len(tmp))).decode("utf-8")
 
+    def _unprotect_all(self, strings):
+        """
+        Unprotect the list of base64 `strings`, which follow each other in the
+        salsa stream. The keystream for all of them is generated and XORed in
+        one go. Returns a list of unprotected strings.
+        """
+        chunks = [base64.b64decode(string.encode("utf-8")) for string in strings]
+        plain = _xor_stream(b''.join(chunks), self._get_salsa)
+        return [chunk.decode("utf-8") for chunk in _split(plain, chunks)]
+
+    def _protect_all(self, strings):
+        """
+        Protect the list of `strings` with consecutive sections of the salsa
+        stream in one go. Returns a list of protected base64 strings.
+        """
+        chunks = [string.encode("utf-8") for string in strings]
+        cipher = _xor_stream(b''.join(chunks), self._get_salsa)
+        return [base64.b64encode(chunk).decode("utf-8")
+                for chunk in _split(cipher, chunks)]
+
     def _protect(self, string):
         """
         XORs the given `string` with the next salsa and base64 encodes it.
@@ -377,6 +616,38 @@ class KDBXmlExtension:
         return base64.b64encode(tmp).decode("utf-8")
 
 
+def keystream_at(cipher, offset, length):
+    """
+    Return `length` bytes of the keystream of the Salsa20 or ChaCha20
+    `cipher` from byte `offset` on, by moving its counter to the right block.
+    """
+    block, skip = divmod(offset, 64)
+    cipher.setCounter(block)
+    # always request whole blocks, the stream can continue from there
+    nbytes = -(-(skip + length) // 64) * 64
+    return cipher.keystreamBytes(nbytes)[skip:skip + length]
+
+
+def _xor_stream(data, get_stream):
+    """XOR `data` with the next len(data) bytes from `get_stream`."""
+    return xor_bytes(data, bytes(get_stream(len(data))))
+
+
+def _split(data, chunks):
+    """Split `data` into pieces as long as the items in `chunks`."""
+    view = memoryview(data)
+    pos = 0
+    for chunk in chunks:
+        yield bytes(view[pos:pos + len(chunk)])
+        pos += len(chunk)
+
+
+def _b64_decoded_length(text):
+    """Return the number of bytes the base64 encoded `text` decodes to."""
+    text = ''.join(text.split())
+    return len(text) * 3 // 4 - text[-2:].count('=')
+
+
 class KDB4Reader(KDB4File, KDBXmlExtension):
     """
     Usually you would want to use the `keepass.open` context manager to open a
@@ -394,17 +665,59 @@ class KDB4Reader(KDB4File, KDBXmlExtension):
         with open('passwords.kdb', 'rb') as fh:
             kdb = keepass.KDB4Reader(fh, password='secret')
     
+    The `unprotect` argument (True, False or 'lazy') is passed on to
+    KDBXmlExtension when the file is read.
+
+    The XML document is parsed while the file is decrypted, without keeping
+    a copy of it. Use `keep_buffer=True` to keep it in the in-buffer, which
+    `read` and `write_to(stream, use_etree=False)` need.
     """
 
-    def __init__(self, stream=None, **credentials):
+    def __init__(self, stream=None, unprotect=True, keep_buffer=False,
+                 **credentials):
+        self.unprotect_mode = unprotect
+        self.keep_buffer = keep_buffer
+        # root element of the document parsed by the payload pipeline
+        self.parsed_root = None
         KDB4File.__init__(self, stream, **credentials)
 
-    def read_from(self, stream, unprotect=True):
+    def _payload_sink(self):
+        """
+        Return the pipeline sink for the decrypted XML document, which feeds
+        it to an objectify parser (and to the in-buffer with `keep_buffer`).
+        """
+        # huge_tree: documents of large databases exceed the limits of libxml2
+        self._parser_sink = pipeline.ParserSink(
+            objectify.makeparser(huge_tree=True))
+        if self.keep_buffer:
+            return pipeline.Tee(self._parser_sink,
+                                KDB4File._payload_sink(self))
+        return self._parser_sink
+
+    def _payload_done(self):
+        self.parsed_root = self._parser_sink.root
+        self._parser_sink = None
+        if self.keep_buffer:
+            KDB4File._payload_done(self)
+
+    def read_from(self, stream, unprotect=None):
+        if unprotect is None:
+            unprotect = self.unprotect_mode
         KDB4File.read_from(self, stream)
         # the extension requires parsed header and decrypted self.in_buffer, so
         # initialize only here
         KDBXmlExtension.__init__(self, unprotect)
 
+    def set_document(self, root, unprotect=False):
+        """
+        Use the objectify'ed element `root` as the XML document, e.g. for a
+        database built from scratch instead of read from a file. Its
+        protected values are expected in clear (`unprotect=False`), they are
+        protected again by `write_to`.
+        """
+        self.parsed_root = root
+        KDBXmlExtension.__init__(self, unprotect)
+
     def write_to(self, stream, use_etree=True):
         """
         Write the KeePass database back to a KeePass2 compatible file.
@@ -415,6 +728,7 @@ class KDB4Reader(KDB4File, KDBXmlExtension):
             instead.
         """
         if use_etree:
-            KDBXmlExtension.write_to(self, stream)
-        KDB4File.write_to(self, stream)
+            KDB4File.write_to(self, stream, self.write_xml)
+        else:
+            KDB4File.write_to(self, stream)
 
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Key derivation functions of KDBX 4 files.
+
+The KDF and its parameters are stored as a VariantDictionary in the
+KdfParameters header field. The `$UUID` item selects the function:
+
+- AES-KDF: `R` rounds of AES ECB with the seed `S` (like KDBX 3.x)
+- Argon2d and Argon2id: salt `S`, parallelism `P`, memory `M` (bytes),
+  iterations `I` and version `V`
+
+Argon2 is computed with the argon2-cffi package. Its libargon2 fills the `P`
+lanes of the Argon2 memory with `P` worker threads, without holding the GIL.
+"""
+from . crypto import transform_key as aes_transform_key
+
+try:
+    from argon2 import low_level as _argon2
+except ImportError:
+    _argon2 = None
+
+AES_KDF = bytes.fromhex('c9d9f39a628a4460bf740d08c18a4fea')
+ARGON2D = bytes.fromhex('ef636ddf8c29444b91f7a9a403e30a0c')
+ARGON2ID = bytes.fromhex('9e298b1956db4773b23dfc3ec6f0a1e6')
+
+
+def transform_key(key, params):
+    """
+    Transform the composite `key` with the KDF described by the parsed
+    KdfParameters `params` and return the 32 byte transformed key.
+    """
+    kdf_uuid = params.get('$UUID')
+    if kdf_uuid == AES_KDF:
+        return aes_transform_key(key, params['S'], params['R'])
+    if kdf_uuid in (ARGON2D, ARGON2ID):
+        return argon2(key, params, kdf_uuid)
+    raise IOError('Unknown key derivation function.')
+
+
+def argon2(key, params, kdf_uuid=ARGON2D):
+    """Return the Argon2d or Argon2id hash of `key` with the given `params`."""
+    if _argon2 is None:
+        raise IOError('The argon2-cffi package is needed for Argon2 keys.')
+    if params.get('K') or params.get('A'):
+        raise IOError('Argon2 secret keys and associated data are not '
+                      'supported.')
+    argon2_type = _argon2.Type.ID if kdf_uuid == ARGON2ID else _argon2.Type.D
+    return _argon2.hash_secret_raw(
+        secret=key,
+        salt=params['S'],
+        time_cost=params['I'],
+        memory_cost=params['M'] // 1024,
+        parallelism=params['P'],
+        hash_len=32,
+        type=argon2_type,
+        version=params.get('V', 0x13),
+    )
+
+
+def cost(params):
+    """
+    Return a rough measure of the work the KDF in `params` takes: the number
+    of rounds for AES-KDF, and the iterations times the memory in KiB for
+    Argon2, since each pass touches every 1 KiB block.
+    """
+    kdf_uuid = params.get('$UUID')
+    if kdf_uuid == AES_KDF:
+        return params['R']
+    if kdf_uuid in (ARGON2D, ARGON2ID):
+        return params['I'] * params['M'] // 1024
+    return 0
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental processing of the encrypted payload of a KDBX file.
+
+The payload is read in chunks of CHUNK_SIZE bytes and pushed through a chain
+of stages. Each stage has a `feed(data)` method, which processes a chunk and
+feeds its output to the next stage (its `sink`), and a `flush()` method,
+which is called once at the end of the data. A KDBX 3.x payload goes through
+
+    Decrypt -> StartBytes -> HashedBlocks -> Inflate -> sink
+
+and the sink is either a BufferSink collecting the XML document or a
+ParserSink feeding it to a lxml parser. No stage holds more than a chunk, an
+AES block or a hashed block at a time, so the parser can start working before
+the file is decrypted and memory does not grow with the size of the file.
+KDBX 4 payloads are read as verified HMAC blocks and go through
+
+    Decrypt -> Inflate -> HeaderFields -> sink
+
+Files are written the other way round: the XML document is serialized
+into a StageWriter and goes through
+
+    Deflate -> MakeHashedBlocks -> Encrypt -> StreamSink
+
+with the stream start bytes fed to Encrypt first.
+
+To measure the stages, `probe` puts a Probe in front of each of them.
+"""
+import io
+import zlib
+import struct
+import hashlib
+from time import perf_counter as _clock
+
+from . import hbio
+
+# number of bytes read from the file at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def read_chunks(stream, size=None):
+    """
+    Yield the rest of `stream` in chunks of at most `size` bytes (default:
+    CHUNK_SIZE).
+    """
+    size = size or CHUNK_SIZE
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def run(chunks, stage):
+    """Feed all `chunks` to the first `stage` of a pipeline and flush it."""
+    for chunk in chunks:
+        stage.feed(chunk)
+    stage.flush()
+
+
+class Stage(object):
+    """A pipeline stage which passes data unchanged to its `sink`."""
+    name = 'stage'
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def feed(self, data):
+        if data:
+            self.sink.feed(data)
+
+    def flush(self):
+        self.sink.flush()
+
+
+class Decrypt(Stage):
+    """
+    Decrypt the data with `decryptor`, an object with `update(data)` and
+    `finalize()` methods like crypto.AESCBCDecryptor.
+    """
+    name = 'decrypt'
+
+    def __init__(self, decryptor, sink):
+        Stage.__init__(self, sink)
+        self.decryptor = decryptor
+
+    def feed(self, data):
+        Stage.feed(self, self.decryptor.update(data))
+
+    def flush(self):
+        Stage.feed(self, self.decryptor.finalize())
+        Stage.flush(self)
+
+
+class StartBytes(Stage):
+    """
+    Check that the data starts with the `expected` bytes and strip them. An
+    IOError is raised if they differ, which means the master key is wrong.
+    """
+    name = 'start_bytes'
+
+    def __init__(self, expected, sink):
+        Stage.__init__(self, sink)
+        self.expected = bytes(expected)
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        if self.buffer is None:
+            return Stage.feed(self, data)
+        self.buffer.extend(data)
+        if len(self.buffer) >= len(self.expected):
+            self._check()
+
+    def flush(self):
+        if self.buffer is not None:
+            self._check()
+        Stage.flush(self)
+
+    def _check(self):
+        length = len(self.expected)
+        if bytes(self.buffer[:length]) != self.expected:
+            raise IOError('Master key invalid.')
+        rest, self.buffer = bytes(self.buffer[length:]), None
+        Stage.feed(self, rest)
+
+
+class HashedBlocks(Stage):
+    """
+    Verify and unwrap a hashed block stream (see hbio.HashedBlockIO). A block
+    is passed on once it is complete and its SHA-256 hash matches, otherwise
+    an IOError is raised. Data after the final, empty block is ignored.
+
+    Blocks which lie within one chunk are verified in place and passed on as
+    memoryview slices of the chunk. Only a block spanning several chunks is
+    collected in a buffer.
+    """
+    name = 'hashed_blocks'
+
+    def __init__(self, sink):
+        Stage.__init__(self, sink)
+        self.buffer = bytearray()
+        # length the buffer needs before the next block can be parsed
+        self.needed = 0
+        self.done = False
+
+    def feed(self, data):
+        if self.done:
+            return
+        if self.buffer:
+            self.buffer.extend(data)
+            if len(self.buffer) < self.needed:
+                return
+            data, self.buffer = self.buffer, bytearray()
+        view = memoryview(data)
+        pos = 0
+        while True:
+            block, end = hbio.next_block(view, pos)
+            if block is None:
+                self.buffer.extend(view[pos:])
+                self.needed = end - pos
+                return
+            if not block:
+                self.done = True
+                return
+            Stage.feed(self, block)
+            pos = end
+
+    def flush(self):
+        if not self.done:
+            raise IOError('Unexpected end of block stream.')
+        Stage.flush(self)
+
+
+class HeaderFields(Stage):
+    """
+    Split off a header of (field id (1 byte), length (4 bytes), value) fields
+    like the KDBX 4 inner header. `on_field(field_id, value)` is called for
+    each field; the field with id 0 ends the header and the rest of the data
+    is passed on.
+    """
+    name = 'inner_header'
+    field_header = struct.Struct('<bI')
+
+    def __init__(self, on_field, sink):
+        Stage.__init__(self, sink)
+        self.on_field = on_field
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        if self.buffer is None:
+            return Stage.feed(self, data)
+        self.buffer.extend(data)
+        size = self.field_header.size
+        while len(self.buffer) >= size:
+            field_id, length = self.field_header.unpack_from(self.buffer)
+            if len(self.buffer) < size + length:
+                return
+            value = bytes(self.buffer[size:size + length])
+            del self.buffer[:size + length]
+            self.on_field(field_id, value)
+            if field_id == 0:
+                rest, self.buffer = bytes(self.buffer), None
+                return Stage.feed(self, rest)
+
+    def flush(self):
+        if self.buffer is not None:
+            raise IOError('Unexpected end of inner header.')
+        Stage.flush(self)
+
+
+class Inflate(Stage):
+    """Decompress gzip data."""
+    name = 'inflate'
+
+    def __init__(self, sink):
+        Stage.__init__(self, sink)
+        self.unzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data):
+        Stage.feed(self, self.unzip.decompress(data))
+
+    def flush(self):
+        Stage.feed(self, self.unzip.flush())
+        Stage.flush(self)
+
+
+class Deflate(Stage):
+    """Compress the data with gzip."""
+    name = 'deflate'
+
+    def __init__(self, sink, level=6):
+        Stage.__init__(self, sink)
+        self.zip = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def feed(self, data):
+        Stage.feed(self, self.zip.compress(data))
+
+    def flush(self):
+        Stage.feed(self, self.zip.flush())
+        Stage.flush(self)
+
+
+class MakeHashedBlocks(Stage):
+    """
+    Wrap the data in a hashed block stream (see hbio.HashedBlockIO), the
+    counterpart of HashedBlocks. Blocks of `block_length` bytes (default:
+    hbio.BLOCK_LENGTH) are passed on
+    as soon as they are full; the flush passes on the rest and the final,
+    empty block.
+    """
+    name = 'make_blocks'
+
+    def __init__(self, sink, block_length=None):
+        Stage.__init__(self, sink)
+        self.block_length = block_length or hbio.BLOCK_LENGTH
+        self.buffer = bytearray()
+        self.index = 0
+
+    def feed(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) < self.block_length:
+            return
+        view = memoryview(self.buffer)
+        pos = 0
+        while len(view) - pos >= self.block_length:
+            self._block(view[pos:pos + self.block_length])
+            pos += self.block_length
+        rest = bytes(view[pos:])
+        view.release()
+        self.buffer = bytearray(rest)
+
+    def flush(self):
+        if self.buffer:
+            self._block(self.buffer)
+            self.buffer = bytearray()
+        Stage.feed(self, hbio.BLOCK_HEADER.pack(self.index, b'\x00' * 32, 0))
+        Stage.flush(self)
+
+    def _block(self, data):
+        Stage.feed(self, hbio.BLOCK_HEADER.pack(
+            self.index, hashlib.sha256(data).digest(), len(data)))
+        Stage.feed(self, data)
+        self.index += 1
+
+
+class Encrypt(Stage):
+    """
+    Encrypt the data with `encryptor`, an object with `update(data)` and
+    `finalize()` methods like crypto.AESCBCEncryptor.
+    """
+    name = 'encrypt'
+
+    def __init__(self, encryptor, sink):
+        Stage.__init__(self, sink)
+        self.encryptor = encryptor
+
+    def feed(self, data):
+        Stage.feed(self, self.encryptor.update(data))
+
+    def flush(self):
+        Stage.feed(self, self.encryptor.finalize())
+        Stage.flush(self)
+
+
+class StreamSink(object):
+    """Write the data to the file-like `stream`, counting the `bytes`."""
+    name = 'write'
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def feed(self, data):
+        self.stream.write(data)
+        self.bytes += len(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class StageWriter(object):
+    """
+    A write-only file-like object feeding the data written to it to `stage`,
+    e.g. for lxml.etree.xmlfile. The stage is not flushed.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def write(self, data):
+        self.stage.feed(data)
+        return len(data)
+
+
+class BufferSink(object):
+    """Collect the data in the BytesIO `buffer`."""
+    name = 'buffer'
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def feed(self, data):
+        self.buffer.write(data)
+
+    def flush(self):
+        self.buffer.seek(0)
+
+
+class ParserSink(object):
+    """
+    Feed the data to the lxml `parser`. After the flush, `root` is the root
+    element of the parsed document.
+    """
+    name = 'parse'
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.root = None
+
+    def feed(self, data):
+        # the lxml feed parser only takes bytes
+        self.parser.feed(bytes(data))
+
+    def flush(self):
+        self.root = self.parser.close()
+
+
+class Tee(object):
+    """Feed the data to all `sinks`."""
+    name = 'tee'
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def feed(self, data):
+        for sink in self.sinks:
+            sink.feed(data)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+
+class Probe(object):
+    """
+    Pass the data unchanged to `sink`, counting the bytes and the seconds
+    spent in the sink and the stages after it.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def feed(self, data):
+        start = _clock()
+        self.sink.feed(data)
+        self.seconds += _clock() - start
+        self.bytes += len(data)
+
+    def flush(self):
+        start = _clock()
+        self.sink.flush()
+        self.seconds += _clock() - start
+
+
+def probe(stage):
+    """
+    Put a Probe in front of `stage` and of each stage after it. Return the
+    first probe, which is fed instead of `stage`, and the list of probes.
+    """
+    probes = [Probe(stage)]
+    while isinstance(stage, Stage):
+        stage.sink = Probe(stage.sink)
+        probes.append(stage.sink)
+        stage = stage.sink.sink
+    return probes[0], probes
+
+
+def stage_times(probes):
+    """
+    Yield (name, seconds, bytes in, bytes out) for each stage measured by the
+    `probes` of `probe`. The seconds do not include the following stages.
+    """
+    for i, p in enumerate(probes):
+        after = probes[i + 1] if i + 1 < len(probes) else None
+        seconds = p.seconds - (after.seconds if after else 0.0)
+        yield (getattr(p.sink, 'name', type(p.sink).__name__), seconds,
+               p.bytes, after.bytes if after else None)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+KDBX 4 stores the KDF parameters (and the public custom data) of the header
+in a VariantDictionary. It starts with a 2 byte version, followed by items of
+the form::
+
+    type (1 byte) | name length (4 bytes) | name | value length (4 bytes) | value
+
+A type of 0 marks the end of the dictionary.
+"""
+import struct
+from collections import OrderedDict
+
+VERSION = 0x0100
+# the high byte of the version is critical, the low byte informational
+VERSION_CRITICAL_MASK = 0xFF00
+
+UINT32 = 0x04
+UINT64 = 0x05
+BOOL = 0x08
+INT32 = 0x0C
+INT64 = 0x0D
+STRING = 0x18
+BYTE_ARRAY = 0x42
+
+_fmt = {
+    UINT32: '<I',
+    UINT64: '<Q',
+    BOOL: '<?',
+    INT32: '<i',
+    INT64: '<q',
+}
+
+
+def parse(data):
+    """
+    Parse the VariantDictionary in the bytes-like `data` and return an
+    OrderedDict of name -> value. Numbers are returned as int, strings as str
+    and byte arrays as bytes.
+    """
+    view = memoryview(data)
+    try:
+        version, = struct.unpack_from('<H', view, 0)
+        if version & VERSION_CRITICAL_MASK > VERSION & VERSION_CRITICAL_MASK:
+            raise IOError('Unsupported VariantDictionary version.')
+        pos = 2
+        items = OrderedDict()
+        while True:
+            vtype = view[pos]
+            pos += 1
+            if vtype == 0:
+                return items
+            nlen, = struct.unpack_from('<i', view, pos)
+            name = bytes(view[pos + 4:pos + 4 + nlen]).decode('utf-8')
+            pos += 4 + nlen
+            vlen, = struct.unpack_from('<i', view, pos)
+            pos += 4
+            value = view[pos:pos + vlen]
+            if len(value) != vlen:
+                raise IOError('Truncated VariantDictionary.')
+            pos += vlen
+            if vtype in _fmt:
+                items[name], = struct.unpack(_fmt[vtype], value)
+            elif vtype == STRING:
+                items[name] = bytes(value).decode('utf-8')
+            elif vtype == BYTE_ARRAY:
+                items[name] = bytes(value)
+            else:
+                raise IOError('Unknown VariantDictionary value type.')
+    except (struct.error, IndexError):
+        raise IOError('Truncated VariantDictionary.')
@@ -1,8 +1,10 @@
 import json as _json
+import threading as _threading
 from hashlib import md5 as _md5
 from collections import namedtuple as _namedtuple
 
 import secretstorage  # https://pythonhosted.org/SecretStorage/
+from secretstorage.util import open_session as _open_session
 import readkeepass.utils as _utils
 
 
@@ -25,6 +27,59 @@ def _unlock(collection):
         collection.unlock()
 
 
+class _Pool:
+    """The connection to the Secret Service shared by the Keyrings of a process
+
+    Opening a connection, finding a collection by its label and negotiating
+    the session that encrypts the secrets each take D-Bus round-trips, so
+    they are only done once.
+    """
+
+    def __init__(self):
+        self.lock = _threading.Lock()
+        self.bus = None
+        self.session = None
+        # collection label -> secretstorage.Collection
+        self.collections = {}
+
+    def collection(self, label):
+        "Return the collection called label on the shared connection"
+        with self.lock:
+            if self.bus is None:
+                _logger.debug('Connecting to the Secret Service')
+                self.bus = secretstorage.dbus_init()
+                self.session = _open_session(self.bus)
+            coll = self.collections.get(label)
+            if coll is None:
+                coll = Keyring._get_or_make_coll(self.bus, label)
+                # the items found in coll share the session
+                coll.session = self.session
+                self.collections[label] = coll
+            return coll
+
+    def forget(self, label):
+        "Forget the collection called label, e.g. after deleting it"
+        with self.lock:
+            self.collections.pop(label, None)
+
+    def close(self):
+        "Close the shared connection"
+        with self.lock:
+            if self.bus is not None:
+                self.bus.close()
+            self.bus = None
+            self.session = None
+            self.collections = {}
+
+
+_pool = _Pool()
+
+
+def close_connection():
+    "Close the connection to the Secret Service shared by the Keyrings"
+    _pool.close()
+
+
 class Secret:
 
     @staticmethod
@@ -38,9 +93,20 @@ class Secret:
 
 class Keyring:
 
-    def __init__(self, collection_name):
-        self.bus = secretstorage.dbus_init()
-        self.coll = self._get_or_make_coll(self.bus, collection_name)
+    def __init__(self, collection_name, bus=None):
+        """Open the collection collection_name, creating it if necessary
+
+        The connection to the Secret Service is shared with the other
+        Keyrings of the process, unless a connection bus is given.
+        """
+        if bus is None:
+            self.coll = _pool.collection(collection_name)
+            self.bus = self.coll.connection
+            self._own_bus = False
+        else:
+            self.bus = bus
+            self.coll = self._get_or_make_coll(bus, collection_name)
+            self._own_bus = True
         self.collection_name = collection_name
 
     def __enter__(self):
@@ -66,7 +132,24 @@ class Keyring:
         )
         return Secret.parse(item.secret)
 
+    def get_secrets(self, item_labels):
+        """Return a dict of the labels in item_labels and their secrets
+
+        The collection is unlocked at most once for all of them. Labels
+        without an item are left out.
+        """
+        _unlock(self.coll)
+        secrets = {}
+        for label in item_labels:
+            item = self.get_item(label)
+            if item is not None:
+                secrets[label] = Secret.parse(item.secret)
+        return secrets
+
     def close(self):
+        "Close the connection, unless it is shared"
+        if not self._own_bus:
+            return
         try:
             self.bus.close()
         except AttributeError:
@@ -74,6 +157,7 @@ class Keyring:
 
     def delete_keyring(self):
         self.coll.delete()
+        _pool.forget(self.collection_name)
 
     @staticmethod
     def _get_or_make_coll(bus, label):
@@ -146,9 +230,27 @@ class Keyring:
             _unlock(self.coll)
         return _get()
 
+    def find_items(self, item_label):
+        """Return the items labeled item_label as a list of tuples
+
+        Only the secrets of these items are transferred.
+        """
+        def _get():
+            # the items are found by their attribute, see _make_item
+            found = self.coll.search_items({'readkeepass:db': str(item_label)})
+            return [KeyringItem(
+                label=item_label,
+                secret=item.get_secret().decode(),
+                raw=item,
+            ) for item in found]
+        try:
+            return _get()
+        except secretstorage.LockedException:
+            _unlock(self.coll)
+        return _get()
+
     def get_item(self, item_label):
-        items = self.get_items()
-        items = [x for x in items if x.label == item_label]
+        items = self.find_items(item_label)
         li = len(items)
         msg = 'Found {} in collection {}'
         if li == 1:
@@ -222,7 +324,24 @@ class Credentials:
 
     def _keyring(self):
         return KPKeyring(db=self.db_path, collection_name=self.collection_name)
-        
+
+    @staticmethod
+    def get_many(db_paths, collection_name=_DEFAULT_COLLECTION):
+        """Return a dict of the db_paths found in the keyring and their KPCredentials
+
+        The keyring is unlocked at most once for all of the databases.
+        """
+        labels = {_text_to_md5_digest(db): db for db in db_paths}
+        with Keyring(collection_name) as ring:
+            secrets = ring.get_secrets(labels)
+        creds = {}
+        for label, secret in secrets.items():
+            try:
+                creds[labels[label]] = KPCredentials(**secret)
+            except TypeError:
+                _logger.debug('Invalid secret for {}'.format(labels[label]))
+        return creds
+
     def get(self):
         with self._keyring() as ring:
             return ring.get_secret()
@@ -1,8 +1,9 @@
 import sys as _sys
 from subprocess import Popen as _Popen, PIPE as _PIPE
 from readkeepass import utils as _utils
-from . import autotype as _autotype
-_simulate = _autotype.simulate
+from readkeepass import plugins as _plugins
+# the autotype backends are registered lazily (see gui.py), so that gi, Gtk
+# and pyautogui are only imported when they are used
 
 
 output = _utils.root('output')
@@ -35,18 +36,15 @@ def copy(username, password, *pargs, **kwargs):
     _xsel(password, selection='primary')
 
 
-@output.register
-def autotype(username, password, *pargs, **kwargs):
-    "Click on username and password, and then it autotypes."
-    _autotype.type_at_clicks(username, password)
-    # _simulate.enter_key()
-
+output.register_lazy(
+    'autotype', 'readkeepass.output.gui:autotype',
+    doc="Click on username and password, and then it autotypes.",
+)
 
-@output.register
-def autotype_tab(username, password, *pargs, **kwargs):
-    "Click on username, and then it will autotype using tab to switch fields."
-    tab = _simulate.tab_key
-    _autotype.click_and_type(username, password, sep=tab)
+output.register_lazy(
+    'autotype_tab', 'readkeepass.output.gui:autotype_tab',
+    doc="Click on username, and then it will autotype using tab to switch fields.",
+)
 
 
 @output.register
@@ -59,3 +57,7 @@ def stdout(username, password, *pargs, **kwargs):
     for k, v in kwargs.items():
         lines.append('@{}: {}\n'.format(k, v))
     _sys.stdout.writelines(lines)
+
+
+# backends of other packages (see readkeepass.plugins)
+output.discover(_plugins.GROUPS['output'])
@@ -0,0 +1,18 @@
+"""The output methods needing gi and pyautogui
+
+They are registered lazily in readkeepass.output.
+"""
+from . import autotype as _autotype
+_simulate = _autotype.simulate
+
+
+def autotype(username, password, *pargs, **kwargs):
+    "Click on username and password, and then it autotypes."
+    _autotype.type_at_clicks(username, password)
+    # _simulate.enter_key()
+
+
+def autotype_tab(username, password, *pargs, **kwargs):
+    "Click on username, and then it will autotype using tab to switch fields."
+    tab = _simulate.tab_key
+    _autotype.click_and_type(username, password, sep=tab)
@@ -0,0 +1,179 @@
+"""
+plugins finds the output methods and password queries of other packages.
+
+A package adds backends by declaring entry points in the groups of GROUPS,
+e.g. in its setup.py:
+
+    entry_points={
+        'keepass_menu.output': ['xdotool = mypkg.backends:xdotool'],
+        'keepass_menu.userinput': ['zenity = mypkg.backends:zenity'],
+    }
+
+The backends take the same arguments as the built-in ones of
+readkeepass.output and readkeepass.userinput. They are registered lazily
+(see utils.LazyLeaf), so a plugin module is only imported when its backend
+is used.
+
+Reading the entry points of all installed distributions and the help text
+(docstring) of each backend is slow, so they are kept in an index in
+$XDG_CACHE_HOME/keepass-menu/plugins.json. The index is keyed by the
+installed distributions, i.e. the names of the *.dist-info and *.egg-info
+directories on sys.path, and rebuilt when they change.
+
+Usage example:
+    index = PluginIndex()
+    index.backends('keepass_menu.output')  # [(name, path, doc), ...]
+    rkp.output.discover('keepass_menu.output', index)
+"""
+import io as _io
+import os as _os
+import sys as _sys
+import json as _json
+import inspect as _inspect
+from hashlib import sha1 as _sha1
+
+import readkeepass.utils as _utils
+
+_logger = _utils.get_logger(__name__)
+
+# node name -> entry point group
+GROUPS = {
+    'output': 'keepass_menu.output',
+    'userinput': 'keepass_menu.userinput',
+}
+_DIST_SUFFIXES = ('.dist-info', '.egg-info', '.egg-link')
+
+
+def default_path():
+    "Return the path of the plugin index"
+    cache_home = _os.environ.get('XDG_CACHE_HOME') or \
+        _os.path.join(_os.path.expanduser('~'), '.cache')
+    return _os.path.join(cache_home, 'keepass-menu', 'plugins.json')
+
+
+def distributions_key(path=None):
+    """Return a digest of the distributions installed on path
+
+    path defaults to sys.path. Only the directories are listed; the metadata
+    of the distributions is not read.
+    """
+    names = []
+    for directory in (_sys.path if path is None else path):
+        try:
+            with _os.scandir(directory or '.') as it:
+                names.extend(e.name for e in it
+                             if e.name.endswith(_DIST_SUFFIXES))
+        except OSError:
+            # missing directories and zip files
+            continue
+    names.sort()
+    return _sha1('\n'.join(names).encode('utf-8', 'replace')).hexdigest()
+
+
+def _entry_points(group):
+    "Return a list of the (name, 'module:attribute') of the entry points in group"
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        import pkg_resources
+        return [(ep.name, '{}:{}'.format(ep.module_name, '.'.join(ep.attrs)))
+                for ep in pkg_resources.iter_entry_points(group)]
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=group)
+    else:
+        eps = eps.get(group, ())
+    return [(ep.name, ep.value) for ep in eps]
+
+
+def find_backends(group, failed=None):
+    """Return a list of the (name, path, doc) of the backends in group
+
+    Each backend is imported to get its docstring; backends failing to
+    import are logged and left out. Their names are appended to the list
+    failed.
+    """
+    backends = []
+    for name, path in _entry_points(group):
+        try:
+            obj = _utils.LazyLeaf(name, path).resolve()
+        except Exception:
+            _logger.warning('Skipping plugin {} ({})'.format(name, path),
+                            exc_info=True)
+            if failed is not None:
+                failed.append(name)
+            continue
+        backends.append((name, path, _inspect.getdoc(obj)))
+    return backends
+
+
+@_utils.root.register(name='PluginIndex')
+class PluginIndex:
+    """The backends of the entry point groups, cached on disk
+
+    Usage example:
+        index = PluginIndex()
+        for name, path, doc in index.backends('keepass_menu.output'):
+            ...
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self._data = None
+        # groups with plugins that failed to import are not written to the
+        # index, so they are searched again by the next process
+        self._incomplete = set()
+
+    def _load(self):
+        key = distributions_key()
+        try:
+            with _io.open(self.path, encoding='utf-8') as fh:
+                data = _json.load(fh)
+        except (OSError, ValueError):
+            data = None
+        if not isinstance(data, dict) or data.get('key') != key:
+            data = {'key': key, 'groups': {}}
+        self._data = data
+
+    def backends(self, group):
+        """Return a list of the (name, path, doc) of the backends in group
+
+        The group is only searched if it is not in the index yet, or if the
+        installed distributions changed. If a plugin of the group fails to
+        import, the group is searched again the next time keepass-menu runs.
+        """
+        if self._data is None:
+            self._load()
+        groups = self._data['groups']
+        if group not in groups:
+            failed = []
+            groups[group] = find_backends(group, failed)
+            if failed:
+                self._incomplete.add(group)
+            self._save()
+        return [tuple(x) for x in groups[group]]
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            _os.makedirs(_os.path.dirname(self.path), mode=0o700,
+                         exist_ok=True)
+            groups = {group: backends
+                      for group, backends in self._data['groups'].items()
+                      if group not in self._incomplete}
+            with _io.open(tmp_path, 'w', encoding='utf-8') as fh:
+                _json.dump({'key': self._data['key'], 'groups': groups}, fh)
+            _os.replace(tmp_path, self.path)
+        except OSError as e:
+            _logger.debug('Could not write {}: {!r}'.format(self.path, e))
+
+
+_index = None
+
+
+def default_index():
+    "Return the PluginIndex shared by the nodes"
+    global _index
+    if _index is None:
+        _index = PluginIndex()
+    return _index
@@ -1,102 +1,427 @@
+import threading as _threading
 import subprocess as sp
-from collections import OrderedDict
+from wcwidth import wcswidth as _wcswidth
 from readkeepass import utils as _utils
-from tabulate import tabulate
+from readkeepass import instrument as _instrument
 
 _logger = _utils.get_logger(__name__)
 
+# entry_sep in the rows is shown as this look-alike, so rofi does not split them
+SEP_REPLACEMENTS = {'+': '\u02d6'}
+
+
 def _get_rofi_cmd(n_lines_per_key, entry_sep):
+    # rofi prints the index of the selected row
     if n_lines_per_key > 1:
-        cmd = ('rofi', '-fullscreen', '-dmenu', '-i', '-eh', str(n_lines_per_key),
-               '-sep', entry_sep)
+        cmd = ('rofi', '-fullscreen', '-dmenu', '-i', '-format', 'i',
+               '-eh', str(n_lines_per_key), '-sep', entry_sep)
     else:
-        cmd = ('rofi', '-fullscreen', '-dmenu', '-i')
+        cmd = ('rofi', '-fullscreen', '-dmenu', '-i', '-format', 'i')
     return cmd
 
 
+def _escape_sep(row, entry_sep):
+    "Replace entry_sep in row, so that rofi sees it as one row"
+    if entry_sep and entry_sep in row:
+        row = row.replace(entry_sep, SEP_REPLACEMENTS.get(entry_sep, ' '))
+    return row
+
+
+class MenuRows:
+    """The rows of a rofi menu and the values they stand for
+
+    Rows and values are kept in two lists; a row is found by its index,
+    which is what rofi returns (-format i). Unlike a dict keyed by the row
+    text, rows that look the same are all kept.
+    """
+    __slots__ = ('_rows', '_values')
+
+    def __init__(self, rows=(), values=()):
+        self._rows = list(rows)
+        self._values = list(values)
+
+    @classmethod
+    def from_dict(cls, stdin_dict):
+        "Return the MenuRows of a dict mapping row text to value"
+        if isinstance(stdin_dict, cls):
+            return stdin_dict
+        return cls(stdin_dict.keys(), stdin_dict.values())
+
+    def append(self, row, value):
+        self._rows.append(row)
+        self._values.append(value)
+
+    def keys(self):
+        "Return the list of rows"
+        return self._rows
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._rows, self._values)
+
+    def get(self, index, default=None):
+        "Return the value of the row at index (an int or str), or default"
+        try:
+            index = int(index)
+        except (TypeError, ValueError):
+            return default
+        if 0 <= index < len(self._values):
+            return self._values[index]
+        return default
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
 def _prepare_stdin_dict(stdin_dict, n_lines_per_key):
-    stdin_dict = OrderedDict((k.strip(), v) for k, v in stdin_dict.items())
+    menu_rows = MenuRows.from_dict(stdin_dict)
+    menu_rows = MenuRows([row.strip() for row in menu_rows.keys()],
+                         menu_rows.values())
     if n_lines_per_key == -1:
-        n_lines_per_key = max(key.count('\n') for key in stdin_dict) + 1
+        n_lines_per_key = max(row.count('\n') for row in menu_rows) + 1
         msg = 'n_lines_per_key was not specified: found to be {}'
         _logger.debug(msg.format(n_lines_per_key))
-    return stdin_dict, n_lines_per_key
-
-
-def run(stdin_dict, n_lines_per_key=-1, entry_sep='+'):
-    """Launch rofi and return its output.
+    return menu_rows, n_lines_per_key
 
-    run() concatenates the keys of stdin_dict and sends it to rofi's stdin.
-    rofi returns one of the keys.
-    Finally, the corresponding value (stdin_dict[key]) is returned.
 
-    Each key in stdin_dict is expected to be a string, and they should
-    all have the same number of newlines.
+def prepare(stdin_dict, n_lines_per_key=-1, entry_sep='+'):
+    """Return the rofi command, its stdin (bytes) and the MenuRows.
 
-    n_lines_per_key can be set explicitly. It is the number of expected
-    newlines in each key.
-
-    entry_sep is the separator that will be used by rofi.
-    Choose something that will not likely appear in any of the keys.
-    #TODO Replace any instance of entry_sep in keys with some other character.
+    See run() for the arguments.
     """
-    stdin_dict, n_lines_per_key = _prepare_stdin_dict(stdin_dict, n_lines_per_key)
+    menu_rows, n_lines_per_key = _prepare_stdin_dict(stdin_dict, n_lines_per_key)
 
     cmd = _get_rofi_cmd(n_lines_per_key, entry_sep)
     if n_lines_per_key == 1:
-        entry_sep = ''
         # no additional separator if each entry is only one line
+        entries = '\n'.join(menu_rows)
+    else:
+        entries = ('\n' + entry_sep).join(
+            _escape_sep(row, entry_sep) for row in menu_rows)
+    return cmd, entries.encode(), menu_rows
+
+
+def run(stdin_dict, n_lines_per_key=-1, entry_sep='+'):
+    """Launch rofi and return the selected row and its value.
+
+    stdin_dict is a MenuRows or a dict mapping the rows (strings) to their
+    values. The rows are sent to rofi's stdin and rofi returns the index
+    of the selected row. ('', None) is returned if nothing was selected.
+
+    The rows should all have the same number of newlines.
+    n_lines_per_key can be set explicitly. It is the number of expected
+    newlines in each row.
+
+    entry_sep is the separator that will be used by rofi. It is replaced
+    in the rows (see SEP_REPLACEMENTS).
+    """
+    cmd, entries, menu_rows = prepare(stdin_dict, n_lines_per_key, entry_sep)
 
-    def _run_process(cmd, stdin_dict, entry_sep):
-        entries = ('\n' + entry_sep).join(stdin_dict)
-        entries = entries.encode()
+    def _run_process(cmd, entries):
         p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE, stdin=sp.PIPE)
+        # rofi gets all rows at once
+        _instrument.mark('first_row', rows=len(menu_rows))
         stdout, stderr = p.communicate(entries)
         p.terminate()
-        return stdout.decode().rstrip()
+        return stdout.strip()
+
+    with _instrument.stage('rofi', rows=len(menu_rows), bytes_in=len(entries)):
+        output = _run_process(cmd, entries)
+    return _selected(menu_rows, output)
+
+
+def _selected(menu_rows, output):
+    "Return the row and value of the index printed by rofi"
+    value = menu_rows.get(output)
+    if value is None:
+        return '', None
+    return menu_rows.keys()[int(output)], value
+
+
+class StreamingMenu:
+    """A rofi menu that is shown at once and filled while it is open
+
+    rofi reads its stdin asynchronously, so the entries added with add()
+    can be searched while other databases are still being unlocked.
+    Every entry has one line per row of layout.
+
+    Usage example:
+        menu = StreamingMenu()
+        menu.start()
+        for kpdb in keepass_dbs:
+            if not menu.add(kpdb):
+                break   # an entry was already selected
+        key, entry = menu.finish()
+    """
+
+    def __init__(self, layout=None, entry_sep='+', rank=None):
+        """Create the menu
 
-    key = _run_process(cmd, stdin_dict, entry_sep)
-    return key, stdin_dict.get(key)
+        rank is a dict of the UUIDs of entries and their scores (see
+        readkeepass.frecency); the entries of each database added are
+        ordered by it.
+        """
+        self.layout = layout or ENTRY_LAYOUT
+        self.rank = rank
+        n_lines_per_key = len(self.layout)
+        self.cmd = _get_rofi_cmd(n_lines_per_key, entry_sep) + \
+            ('-async-pre-read', '0')
+        # each entry is terminated, so rofi can show it before the next one
+        self.entry_sep = entry_sep if n_lines_per_key > 1 else ''
+        self.menu_rows = MenuRows()
+        self.process = None
+        # True once the first rows were sent to rofi
+        self._shown = False
 
+    def start(self):
+        "Launch rofi"
+        self.process = sp.Popen(self.cmd, stdin=sp.PIPE, stdout=sp.PIPE,
+                                stderr=sp.DEVNULL)
+        self._output = b''
+        # rofi's stdin is written and closed by one thread at a time
+        self._lock = _threading.Lock()
+        # reads the selection, so wait() returns as soon as rofi exits
+        self._reader = _threading.Thread(target=self._read, name='rofi-reader',
+                                         daemon=True)
+        self._reader.start()
 
-def build_rofi_input(keepass_db):
-    """Create a rofi-usable dict from a KeePassDB object.
+    def _read(self):
+        self._output = self.process.stdout.read()
+        self.process.stdout.close()
+
+    def add(self, keepass_db):
+        """Add the entries of the KeePassDB keepass_db to the menu.
+
+        Returns False if rofi has already exited.
+        """
+        if self.process.poll() is not None:
+            return False
+        with _instrument.stage('render', entries=len(keepass_db.entries)):
+            entries = _ranked(keepass_db.entries, self.rank)
+            rows = render_rows(entries, self.layout, multiline=False)
+            data = []
+            for row, entry in zip(rows, entries):
+                row = row.strip()
+                # a row is known before rofi can return its index
+                self.menu_rows.append(row, entry.as_ntuple)
+                # each entry is terminated, so rofi can show it before the next
+                data.append(_escape_sep(row, self.entry_sep) + '\n' +
+                            self.entry_sep)
+            data = ''.join(data).encode()
+        with self._lock:
+            try:
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                # rofi has exited or the input was closed
+                return False
+        if data and not self._shown:
+            self._shown = True
+            _instrument.mark('first_row', rows=len(self.menu_rows))
+        return True
+
+    def close_input(self):
+        "Tell rofi that all entries were added"
+        with self._lock:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def wait(self, timeout=None):
+        "Wait until rofi exits; returns False if it is still open after timeout"
+        self._reader.join(timeout)
+        return not self._reader.is_alive()
+
+    def finish(self):
+        "Wait for rofi and return the selected key and its value, like run()"
+        with _instrument.stage('rofi', rows=len(self.menu_rows)):
+            self.close_input()
+            self.wait()
+            self.process.wait()
+        return _selected(self.menu_rows, self._output.strip())
+
+    def kill(self):
+        "Close rofi without a selection"
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+# the fields of an entry in the menu: one tuple per line, one field per column
+ENTRY_LAYOUT = (('title', 'url'), ('username', 'groupname'), ('notes', None))
+COLUMN_SEP = '  '
+# the first column is at least this wide (as it was with tabulate)
+MIN_FIRST_WIDTH = 7
+
+
+def _cell(value):
+    """Return the lines of a menu cell as (line, display width) pairs
+
+    The second item of the returned tuple is True if value contains newlines.
+    """
+    text = str(value) if value else ''
+    multiline = '\n' in text or '\r' in text
+    text = text.strip()
+    if '\n' in text or '\r' in text:
+        lines = text.splitlines()
+    else:
+        lines = [text] if text else []
+    return tuple((x, _wcswidth(x)) for x in lines), multiline
+
+
+def _entry_rows(entry, layout=ENTRY_LAYOUT):
+    """Return the rows of the entry in the menu and if it has multi-line fields
+
+    Each row is a tuple of cells, see _cell().
+    """
+    d = entry.as_formatted_dict
+    rows = []
+    multiline = False
+    for fields in layout:
+        cells = []
+        for key in fields:
+            cell, cell_multiline = _cell(d.get(key))
+            multiline = multiline or cell_multiline
+            cells.append(cell)
+        rows.append(tuple(cells))
+    return tuple(rows), multiline
+
+
+def render_rows(entries, layout=ENTRY_LAYOUT, multiline=None):
+    """Yield the text of each of the entries in the menu.
+
+    The fields are laid out in a table (like tabulate's 'plain' format):
+    each column is as wide as its widest line and columns are separated by
+    COLUMN_SEP. Widths are display widths, so wide characters line up.
+    The rows of each entry are computed once and kept by the entry.
+
+    If multiline is False every row is one line (only the first line of a
+    field is shown), so each entry has len(layout) lines. By default this
+    is only the case if no field has several lines.
+    """
+    rendered = [entry.memoize(('rofi', layout),
+                              lambda e: _entry_rows(e, layout))
+                for entry in entries]
+    if not rendered:
+        return
+    if multiline is None:
+        # if any field has several lines, the rows of all entries get as
+        # high as their highest cell, otherwise every row is one line
+        multiline = any(m for rows, m in rendered)
+    widths = [0] * max(len(fields) for fields in layout)
+    widths[0] = MIN_FIRST_WIDTH
+    for rows, _ in rendered:
+        for cells in rows:
+            for i, cell in enumerate(cells):
+                for line, width in cell:
+                    if width > widths[i]:
+                        widths[i] = width
+    blank = ('', 0)
+    for rows, _ in rendered:
+        lines = []
+        for cells in rows:
+            height = max(map(len, cells)) if multiline else 1
+            for n in range(height):
+                parts = []
+                for i, width in enumerate(widths):
+                    cell = cells[i] if i < len(cells) else ()
+                    line, line_width = cell[n] if n < len(cell) else blank
+                    parts.append(line + ' ' * (width - line_width))
+                lines.append(COLUMN_SEP.join(parts).rstrip())
+        lines.append('')
+        yield '\n'.join(lines).lstrip()
+
+
+def _ranked(entries, rank):
+    """Return the entries with the highest ranked first
+
+    rank maps the UUIDs of entries to scores. Unranked entries come last;
+    entries with the same score keep their order.
+    """
+    if not rank:
+        return entries
+    unranked = -float('inf')
+    return sorted(entries, key=lambda e: rank.get(e.uuid, unranked),
+                  reverse=True)
+
+
+def build_rofi_input(keepass_db, rank=None):
+    """Create the rofi menu (MenuRows) of a KeePassDB object.
 
     keepass_db is just a namedtuple with fields 'filename' and 'entries'
 
-    The keys are display strings for each entry in the keepass database
-    The values are a namedtuple containing all of an entry's info.
+    The rows (keys()) are display strings for each entry in the keepass
+    database. The values are a namedtuple containing all of an entry's info.
+    rank maps the UUIDs of entries to scores, the rows of the entries with
+    the highest scores come first (see readkeepass.frecency).
     """
-    entry_sentinel = '@@!$#@@'
-    def tabulate_list(entries, entry_layout):
-        to_format = []
-        for e in entries:
-            d = e.as_formatted_dict
-            for row in entry_layout:
-                vals = [d.get(key, ' ') for key in row]
-                vals = [x if x else ' ' for x in vals]
-                to_format.append(tuple(vals))
-            to_format.append([entry_sentinel] + [''] * (len(row)-1))
-        return to_format
-
-    entries = keepass_db.entries
-    entry_layout = (('title', 'url'), ('username', 'groupname'), ('notes', None))
-
-    to_format = tabulate_list(entries, entry_layout)
-    table_str = tabulate(to_format, tablefmt='plain')
-    
-    table = table_str.split(entry_sentinel)
-    table = [x.lstrip() for x in table]
-    table = [x for x in table if x]
-    return OrderedDict(zip(table, [x.as_ntuple for x in entries]))
+    with _instrument.stage('render', entries=len(keepass_db.entries)) as st:
+        entries = _ranked(keepass_db.entries, rank)
+        menu_rows = MenuRows(render_rows(entries),
+                             [x.as_ntuple for x in entries])
+        if st:
+            st.set(bytes_out=sum(len(row) for row in menu_rows))
+    return menu_rows
 
 
-@_utils.root.register(name='rofi')
-def launch_rofi(*keepass_dbs):
-    # TODO Docstrings & rename
+def build_menu(*keepass_dbs, rank=None):
+    "Return the MenuRows (see build_rofi_input) of several KeePassDBs"
     keepass_db = type(keepass_dbs[0])()
     for d in keepass_dbs:
         keepass_db.update(d)
+    return build_rofi_input(keepass_db, rank=rank)
 
-    totald = build_rofi_input(keepass_db)
+
+@_utils.root.register(name='rofi')
+def launch_rofi(*keepass_dbs, rank=None):
+    # TODO Docstrings & rename
+    totald = build_menu(*keepass_dbs, rank=rank)
     return run(totald)
+
+
+@_utils.root.register(name='rofi_stream')
+def launch_rofi_stream(keepass_dbs, rank=None):
+    """Launch rofi and add each KeePassDB of the iterable keepass_dbs to it.
+
+    rofi is shown before the first database is ready. Returns the selected
+    key and entry like rofi() as soon as rofi exits, even if databases are
+    still being loaded. The entries of each database are ordered by rank
+    (see build_rofi_input).
+    """
+    menu = StreamingMenu(rank=rank)
+    menu.start()
+    errors = []
+
+    def feed():
+        try:
+            for keepass_db in keepass_dbs:
+                if not menu.add(keepass_db):
+                    break
+            else:
+                menu.close_input()
+        except BaseException as e:
+            errors.append(e)
+            menu.kill()
+        finally:
+            # e.g. stops the loading of the remaining databases
+            close = getattr(keepass_dbs, 'close', None)
+            if close is not None:
+                close()
+
+    # the databases are loaded in the background while rofi is watched here
+    feeder = _threading.Thread(target=feed, name='rofi-feeder', daemon=True)
+    feeder.start()
+    try:
+        menu.wait()
+    except BaseException:
+        menu.kill()
+        raise
+    if errors:
+        raise errors[0]
+    return menu.finish()
@@ -0,0 +1,225 @@
+"""
+search finds entries of KeePass databases without rofi.
+
+SearchIndex indexes the words of the title, username, url, group and notes
+of the entries, and the trigrams of those words. A query is split into
+terms and every term has to match a word of one of the fields of an entry:
+
+    - a word matches if it has at least MIN_COVERAGE of the term's grams,
+      so 'githb' still finds 'github'. Equal words rank above words that
+      start with the term, and those above words that contain it.
+    - a short term that matches no word this way matches the words it
+      abbreviates instead ('gh' -> 'github').
+
+A match in the title counts more than one in the username, url, group or
+notes (see FIELD_WEIGHTS). The words are looked up once per query in the
+vocabulary of all words, so queries stay fast on large databases. With
+NumPy the scores of the entries are combined in arrays, which keeps
+queries matching most of the entries fast as well.
+
+Usage example:
+    kpdb = kdb.load('db2.kdbx', password='testpass1234')
+    for result in search(kpdb, 'gh work'):
+        print(result.score, result.entry.as_dict['title'])
+"""
+import re as _re
+import heapq as _heapq
+from collections import Counter as _Counter, namedtuple as _namedtuple
+from itertools import chain as _chain
+
+import readkeepass.utils as _utils
+from readkeepass import kdb as _kdb
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+# the indexed fields and the weight of a match in each of them
+FIELD_WEIGHTS = (
+    ('title', 1.0),
+    ('username', 0.8),
+    ('url', 0.7),
+    ('groupname', 0.5),
+    ('notes', 0.3),
+)
+# a word matches a term if it has this fraction of the term's grams
+MIN_COVERAGE = 0.5
+# terms up to this length can match the words they abbreviate
+MAX_ABBREVIATION = 4
+ABBREVIATION_QUALITY = 0.4
+
+_WORD = _re.compile(r'\w+')
+# mark the start and end of a word in its grams
+_START, _END = '\x02', '\x03'
+
+SearchResult = _namedtuple('SearchResult', 'score entry')
+
+
+def words(text):
+    "Return the lower-case words in text"
+    return _WORD.findall(str(text).casefold())
+
+
+def word_grams(word):
+    "Return the set of grams of a word of an entry"
+    padded = _START + word + _END
+    grams = {padded[:2]}
+    grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def term_grams(term):
+    """Return the list of grams of a query term
+
+    A word starting with term has all of them but the last one, which
+    marks the end of the word.
+    """
+    padded = _START + term
+    grams = [padded[:2]]
+    grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    grams.append((padded + _END)[-3:])
+    return list(dict.fromkeys(grams))
+
+
+def _abbreviates(term, word):
+    "Return True if word contains the characters of term in order"
+    chars = iter(word)
+    return all(c in chars for c in term)
+
+
+class SearchIndex:
+    """Index of entries for ranked fuzzy search
+
+    Usage example:
+        index = SearchIndex(kpdb.entries)
+        results = index.search('netflix')
+    """
+
+    def __init__(self, entries, fields=FIELD_WEIGHTS):
+        """Index the entries (KeePassEntry objects)
+
+        fields is a sequence of (field name, weight) pairs. Protected values
+        are not indexed, so they stay encrypted.
+        """
+        self.entries = list(entries)
+        self.fields = tuple(fields)
+        # (word, index of field) -> indices of the entries
+        postings = {}
+        for i, entry in enumerate(self.entries):
+            d = entry.as_dict
+            for field, (name, weight) in enumerate(self.fields):
+                value = d.get(name)
+                if not value or isinstance(value, _kdb.ProtectedValue):
+                    continue
+                for word in set(words(value)):
+                    postings.setdefault((word, field), []).append(i)
+        # word -> [(index of field, indices of the entries), ...]
+        self._postings = {}
+        for (word, field), indices in postings.items():
+            if _np is not None:
+                indices = _np.array(indices, dtype=_np.intp)
+            self._postings.setdefault(word, []).append((field, indices))
+        # gram -> words of the vocabulary
+        grams = {}
+        for word in self._postings:
+            for gram in word_grams(word):
+                grams.setdefault(gram, []).append(word)
+        self._grams = grams
+
+    def __len__(self):
+        return len(self.entries)
+
+    def match_words(self, term):
+        "Return a dict of the words matching term and the quality (0-1) of the match"
+        grams = term_grams(term)
+        counts = _Counter()
+        for gram in grams:
+            counts.update(self._grams.get(gram, ()))
+        need = MIN_COVERAGE * len(grams)
+        matches = {word: n / len(grams) for word, n in counts.items()
+                   if n >= need}
+        if not matches and 1 < len(term) <= MAX_ABBREVIATION:
+            for word in self._grams.get(_START + term[0], ()):
+                if word not in matches and _abbreviates(term, word):
+                    matches[word] = ABBREVIATION_QUALITY
+        return matches
+
+    def _levels(self, term):
+        """Return (score, indices of entries) of the matches of term
+
+        The list is sorted by score, the best matches come last.
+        """
+        weights = [weight for name, weight in self.fields]
+        levels = {}
+        for word, quality in self.match_words(term).items():
+            for field, indices in self._postings[word]:
+                levels.setdefault(quality * weights[field], []).append(indices)
+        if _np is not None:
+            return [(score, _np.concatenate(indices))
+                    for score, indices in sorted(levels.items())]
+        return [(score, _chain.from_iterable(indices))
+                for score, indices in sorted(levels.items())]
+
+    def term_scores(self, term):
+        "Return a dict of the indices of the entries matching term and their scores"
+        scores = {}
+        for score, indices in self._levels(term):
+            if _np is not None:
+                indices = indices.tolist()
+            scores.update(dict.fromkeys(indices, score))
+        return scores
+
+    def _search_numpy(self, terms, limit):
+        "search() with the scores of all entries in arrays"
+        total = _np.zeros(len(self.entries))
+        matched = _np.ones(len(self.entries), dtype=bool)
+        for term in terms:
+            scores = _np.zeros(len(self.entries))
+            for score, indices in self._levels(term):
+                scores[indices] = score
+            total += scores
+            matched &= scores > 0
+        candidates = _np.flatnonzero(matched)
+        if len(candidates) > limit:
+            # keep the entries scoring at least as much as the limit-th best
+            kth = _np.partition(total[candidates], -limit)[-limit]
+            candidates = candidates[total[candidates] >= kth]
+        # by descending score, then in the order of the entries
+        order = _np.lexsort((candidates, -total[candidates]))[:limit]
+        return [(int(i), float(total[i])) for i in candidates[order]]
+
+    def _search_python(self, terms, limit):
+        "search() with the scores of the matching entries in dicts"
+        term_scores = sorted(map(self.term_scores, terms), key=len)
+        scores = term_scores[0]
+        for other in term_scores[1:]:
+            scores = {i: score + other[i] for i, score in scores.items()
+                      if i in other}
+        return _heapq.nlargest(limit, scores.items(),
+                               key=lambda item: (item[1], -item[0]))
+
+    def search(self, query, limit=10):
+        """Return the SearchResults of the limit entries best matching query
+
+        The score of a result is between 0 and 1. Results with the same
+        score keep the order of the entries.
+        """
+        terms = words(query)
+        if not terms or limit < 1:
+            return []
+        if _np is not None:
+            best = self._search_numpy(terms, limit)
+        else:
+            best = self._search_python(terms, limit)
+        return [SearchResult(score / len(terms), self.entries[i])
+                for i, score in best]
+
+
+@_utils.root.register(name='search')
+def search(keepass_db, query, limit=10):
+    """Return the SearchResults of the entries of keepass_db best matching query
+
+    For several queries on the same database build a SearchIndex once.
+    """
+    return SearchIndex(keepass_db.entries).search(query, limit)
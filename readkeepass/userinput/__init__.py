@@ -1,7 +1,9 @@
 import sys as _sys
 from getpass import getpass as _getpass
 from readkeepass import utils as _utils
-from . import xquery as _xquery
+from readkeepass import plugins as _plugins
+# the graphical backends are registered lazily (see gui.py), so that tkinter
+# and pyautogui are only imported when they are used
 
 
 userinput = _utils.root('userinput')
@@ -20,24 +22,16 @@ def stdin(db_name='', *pargs, **kwargs):
     return p
 
 
-@userinput.register
-def tk(db_name='', *pargs, **kwargs):
-    """Query user for a password using a tk window.
+userinput.register_lazy(
+    'tk', 'readkeepass.userinput.gui:tk',
+    doc="Query user for a password using a tk window.",
+)
 
-    It returns the entered password as a string.
-    """
-    prompt = 'Enter password for {}:'.format(db_name)
-    button = 'OK'
-    password = True
-    return _xquery.run(prompt, button, password)
+userinput.register_lazy(
+    'pymsgbox', 'readkeepass.userinput.gui:pymsgbox',
+    doc="Query user for a password using the graphical pymsgbox.",
+)
 
 
-@userinput.register
-def pymsgbox(db_name='', *pargs, **kwargs):
-    """Query user for a password using the graphical pymsgbox.
-
-    It returns the entered password as a string.
-    """
-    import pyautogui
-    prompt = 'Enter password for {}:'.format(db_name)
-    return pyautogui.password(text=prompt, title='keepass-menu', mask='•')
+# backends of other packages (see readkeepass.plugins)
+userinput.discover(_plugins.GROUPS['userinput'])
@@ -0,0 +1,26 @@
+"""The password queries needing tkinter and pyautogui
+
+They are registered lazily in readkeepass.userinput.
+"""
+from . import xquery as _xquery
+
+
+def tk(db_name='', *pargs, **kwargs):
+    """Query user for a password using a tk window.
+
+    It returns the entered password as a string.
+    """
+    prompt = 'Enter password for {}:'.format(db_name)
+    button = 'OK'
+    password = True
+    return _xquery.run(prompt, button, password)
+
+
+def pymsgbox(db_name='', *pargs, **kwargs):
+    """Query user for a password using the graphical pymsgbox.
+
+    It returns the entered password as a string.
+    """
+    import pyautogui
+    prompt = 'Enter password for {}:'.format(db_name)
+    return pyautogui.password(text=prompt, title='keepass-menu', mask='•')
@@ -1,4 +1,5 @@
 import logging
+from importlib import import_module as _import_module
 from inspect import signature as _signature
 from functools import wraps as _wraps, partial as _partial
 from collections import OrderedDict as _OrderedDict
@@ -25,6 +26,9 @@ def get_logger(name):
     return logger
 
 
+_logger = get_logger(__name__)
+
+
 class LoggerD:
     "A logger decorator factory"
 
@@ -94,6 +98,42 @@ class OrderedNamespace:
         return ''.join(tot)
 
 
+class LazyLeaf:
+    """A leaf of a Node that is imported the first time it is used
+
+    path is 'module:attribute', e.g. 'readkeepass.output.gui:autotype'.
+    Calling the leaf or getting one of its attributes imports the module;
+    the name and the docstring are available without importing it.
+    """
+    def __init__(self, name, path, doc=None):
+        self.__name__ = name
+        self.__doc__ = doc
+        self.path = path
+        self._obj = None
+
+    def resolve(self):
+        "Import and return the object at self.path"
+        if self._obj is None:
+            module, _, attr = self.path.partition(':')
+            obj = _import_module(module)
+            for name in attr.split('.'):
+                obj = getattr(obj, name)
+            self._obj = obj
+        return self._obj
+
+    def __call__(self, *pargs, **kwargs):
+        return self.resolve()(*pargs, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_obj':
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(
+            self.__class__.__name__, self.__name__, self.path)
+
+
 class Node(OrderedNamespace):
     """Node is a namespace class for registering objects
 
@@ -104,6 +144,11 @@ class Node(OrderedNamespace):
         def somefunc(): pass
         root.register({'a':1, 'b':2}, name='somedict')
 
+    Use Node().register_lazy to register objects that are imported when
+    they are first used (see LazyLeaf)
+    Example:
+        root.register_lazy('somefunc', 'some.module:somefunc', doc='...')
+
     Use Node().__call__ to add sub-nodes
     Example:
         root = Node('root')
@@ -116,11 +161,64 @@ class Node(OrderedNamespace):
         if name is None:
             name = obj.__name__
         if (overwrite is False) and (name in self.__dict__):
-            msg = "{} is already registered in {}"
-            raise ValueError(msg.format(name, self))
+            # the module of a lazy leaf may register the object itself
+            if not isinstance(self.__dict__[name], LazyLeaf):
+                msg = "{} is already registered in {}"
+                raise ValueError(msg.format(name, self))
         setattr(self, name, obj)
         return obj
 
+    def register_lazy(self, name, path, doc=None, overwrite=False):
+        """Register the object at path ('module:attribute') as name
+
+        The module is only imported when the leaf is used. doc is the
+        docstring shown without importing it.
+        """
+        return self.register(LazyLeaf(name, path, doc), name=name,
+                             overwrite=overwrite)
+
+    def discover(self, group, index=None):
+        """Register the backends of the entry point group lazily
+
+        index is a readkeepass.plugins.PluginIndex (default: the shared one).
+        The group is only searched on the first lookup of a name that is not
+        registered, or when the node is iterated (e.g. node_leaves), so not
+        while the package registering its own backends is imported.
+        Backends already registered under the same name are kept.
+        """
+        self.__dict__.setdefault('_pending', []).append((group, index))
+
+    def _discover_pending(self):
+        "Search the groups of discover(); returns False if there were none"
+        pending = self.__dict__.pop('_pending', None)
+        if not pending:
+            return False
+        from readkeepass import plugins
+        for group, index in pending:
+            if index is None:
+                index = plugins.default_index()
+            for name, path, doc in index.backends(group):
+                if name in self.__dict__:
+                    msg = "Plugin {} ({}) is already registered in {}"
+                    _logger.debug(msg.format(name, path, self))
+                    continue
+                self.register_lazy(name, path, doc)
+        return True
+
+    def __getattr__(self, name):
+        # only called for names that are not registered
+        if not name.startswith('_') and self._discover_pending():
+            return getattr(self, name)
+        raise AttributeError('{} is not registered in {}'.format(name, self))
+
+    def __contains__(self, key):
+        self._discover_pending()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._discover_pending()
+        return super().__iter__()
+
     def __call__(self, name, overwrite=False):
         if (overwrite is False) and (name in self.__dict__):
             return getattr(self, name)
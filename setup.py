@@ -11,9 +11,13 @@ setup(
         "readkeepass.userinput",
         "keepass_menu",
     ],
+    package_data={
+        "readkeepass": ["public_suffix_list.dat"],
+    },
     entry_points = {
         'console_scripts': [
-            'keepass-menu = keepass_menu:main'
+            'keepass-menu = keepass_menu:main',
+            'keepass-menu-client = keepass_menu.client:main',
         ]
     },    
     author="Idaho Frost",
@@ -27,10 +31,16 @@ setup(
     install_requires=[
         "lxml>=3.2.1",
         "pycrypto>=2.6.1",
-        "tabulate>=0.7.5",
+        "wcwidth>=0.1.7",
         "PyAutoGUI>=0.9.33",
         "SecretStorage>=2.2.1",
     ],
+    extras_require={
+        # vectorized Salsa20 keystream for protected values
+        "fast": ["numpy>=1.9"],
+        # Argon2 key derivation of KDBX 4 files
+        "kdbx4": ["argon2-cffi>=16.0"],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Programming Language :: Python :: 3",
@@ -0,0 +1,220 @@
+import unittest
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+from os import path
+from unittest import mock
+
+from readkeepass import kdb, frecency
+from readkeepass.utils import KPCredentials
+import keepass_menu
+from keepass_menu import agent, client
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+
+class TestAgent(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.db = path.join(self.tmp, 'db2.kdbx')
+        shutil.copy(path.join(data_dir, 'db2.kdbx'), self.db)
+        self.path = path.join(self.tmp, 'run', 'agent.sock')
+        self.loaded = []
+        self.typed = []
+
+        def load(db_paths):
+            self.loaded.extend(cred.db for cred in db_paths)
+            return [kdb.load(*cred) for cred in db_paths]
+
+        def output(username, password):
+            self.typed.append((username, password))
+
+        self.agent = agent.Agent(
+            [KPCredentials(self.db, '', 'testpass1234')], load,
+            {'autotype': output}, idle_timeout=10, path=self.path,
+        )
+
+    def start(self):
+        ready = threading.Event()
+        thread = threading.Thread(target=self.agent.serve_forever,
+                                  args=(ready,))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.agent.lock)
+        # wake up the accept() of a running agent when the test ends
+        self.addCleanup(lambda: self.request('ping') if thread.is_alive()
+                        else None)
+        self.assertTrue(ready.wait(5))
+        return thread
+
+    def request(self, cmd, **kwargs):
+        kwargs['cmd'] = cmd
+        return client.request(kwargs, path=self.path, timeout=5)
+
+    def select_index(self, title):
+        "Return the index of the row of title and the menu's id"
+        menu = self.request('menu')
+        self.assertNotIn('cmd', menu)
+        self.assertEqual(client.rofi_cmd(menu['lines'], menu['sep'])[:2],
+                         ['rofi', '-fullscreen'])
+        # multi-line entries are separated by '+' lines
+        rows = menu['input'].split('\n+')
+        index = next(i for i, row in enumerate(rows) if title in row)
+        return index, menu['menu_id']
+
+    def select(self, title, **kwargs):
+        index, menu_id = self.select_index(title)
+        return self.request('select', index=index, menu_id=menu_id, **kwargs)
+
+    def test_socket_permissions(self):
+        self.start()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.stat(path.dirname(self.path)).st_mode & 0o777,
+                         0o700)
+
+    def test_refuse_shared_directory(self):
+        os.makedirs(path.dirname(self.path), mode=0o700)
+        os.chmod(path.dirname(self.path), 0o755)
+        with self.assertRaises(PermissionError):
+            self.agent._bind()
+
+    def test_refuse_symlink(self):
+        target = path.join(self.tmp, 'elsewhere')
+        os.mkdir(target, 0o700)
+        os.symlink(target, path.dirname(self.path))
+        with self.assertRaises(PermissionError):
+            self.agent._bind()
+        os.symlink(target, path.join(self.tmp, 'keepass-menu'))
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.tmp}):
+            with self.assertRaises(PermissionError):
+                client.socket_path()
+            with self.assertRaises(client.AgentError):
+                client.request({'cmd': 'ping'})
+
+    def test_rofi_cmd(self):
+        self.assertEqual(client.rofi_cmd(), ['rofi', '-fullscreen', '-dmenu',
+                                             '-i', '-format', 'i'])
+        self.assertEqual(client.rofi_cmd(3, '+')[-4:], ['-eh', '3', '-sep', '+'])
+        with self.assertRaises(ValueError):
+            client.rofi_cmd('1; touch x')
+        with self.assertRaises(ValueError):
+            client.rofi_cmd(2, '-e')
+
+    def test_select(self):
+        self.start()
+        self.assertTrue(self.request('ping')['ok'])
+        answer = self.select('Google')
+        self.assertNotIn('entry', answer)
+        self.assertEqual(self.typed, [('googleuser@mydomain.net', 'asdf')])
+        answer = self.select('Netflix', output='stdout')
+        self.assertEqual(answer['entry'], {'username': 'netflix-user@example.com',
+                                           'password': 'andchill'})
+        self.assertEqual(self.loaded, [self.db])
+
+    def test_history(self):
+        self.agent.history = frecency.SelectionLog(
+            path.join(self.tmp, 'selections.log'))
+        self.start()
+        first = self.request('menu')['input'].split('\n+')[0]
+        self.assertNotIn('Google', first)
+        self.select('Google')
+        self.assertEqual(self.select_index('Google')[0], 0)
+        google = next(e for e in self.agent.kpdbs[self.db].entries
+                      if e.as_dict['title'] == 'Google')
+        self.assertEqual(self.agent.history.last(), google.uuid)
+
+    def test_errors(self):
+        self.start()
+        menu_id = self.request('menu')['menu_id']
+        with self.assertRaises(client.AgentError):
+            self.request('select', index=1000, menu_id=menu_id)
+        with self.assertRaises(client.AgentError):
+            self.request('unknown')
+
+    def test_reload(self):
+        self.start()
+        self.request('menu')
+        st = os.stat(self.db)
+        os.utime(self.db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.request('menu')
+        self.assertEqual(self.loaded, [self.db, self.db])
+
+    def test_stale_menu(self):
+        self.agent.history = frecency.SelectionLog(
+            path.join(self.tmp, 'selections.log'))
+        self.start()
+        index, menu_id = self.select_index('Google')
+        # the database changed after the menu was shown
+        st = os.stat(self.db)
+        os.utime(self.db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.request('menu')
+        with self.assertRaises(client.AgentError):
+            self.request('select', index=index, menu_id=menu_id)
+        # a selection reorders the menu
+        index, menu_id = self.select_index('Google')
+        self.request('select', index=index, menu_id=menu_id)
+        with self.assertRaises(client.AgentError):
+            self.request('select', index=index, menu_id=menu_id)
+        self.assertEqual(len(self.typed), 1)
+        with self.assertRaises(client.AgentError):
+            self.request('select', index=index)
+
+    def test_lock(self):
+        thread = self.start()
+        self.request('lock')
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.agent.kpdbs, {})
+        self.assertFalse(path.exists(self.path))
+        with self.assertRaises(client.AgentError):
+            self.request('ping')
+
+    def test_idle_timeout(self):
+        self.agent.idle_timeout = 0.2
+        thread = self.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(self.agent.locked.is_set())
+
+
+
+class TestAgentCredentials(unittest.TestCase):
+    "The agent reloads changed databases without asking for passwords"
+    def setUp(self):
+        self.args = argparse.Namespace(cache=None, pw_query='stdin',
+                                       key_ring=False, key_ring_delete=False)
+        self.db = path.join(data_dir, 'db2.kdbx')
+        self.queried = []
+
+        def get_creds(args, *db_paths):
+            self.queried.extend(x.db for x in db_paths)
+            return [KPCredentials(x.db, '', 'testpass1234') for x in db_paths]
+
+        patch = mock.patch.object(keepass_menu, 'get_creds', get_creds)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_reuse(self):
+        credentials = {}
+        db_paths = [KPCredentials(self.db, '', '')]
+        kpdbs = keepass_menu.load_databases(self.args, db_paths, credentials)
+        self.assertEqual(len(kpdbs[0].entries), len(
+            keepass_menu.load_databases(self.args, db_paths, credentials,
+                                        query=False)[0].entries))
+        self.assertEqual(self.queried, [self.db])
+
+    def test_no_query(self):
+        with self.assertRaises(KeyError):
+            keepass_menu.load_databases(
+                self.args, [KPCredentials(self.db, '', '')], {}, query=False)
+        self.assertEqual(self.queried, [])
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
@@ -0,0 +1,29 @@
+import sys
+import shutil
+import tempfile
+import unittest
+from os import path
+
+root_dir = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, path.join(root_dir, 'benchmarks'))
+
+import bench_stages
+import kdbx_generator
+
+
+class TestBenchStages(unittest.TestCase):
+    "Smoke run of the stage benchmark"
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_large_document(self):
+        "A document above libxml2's 10 MB limit is parsed like the readers do"
+        db = path.join(self.tmp, 'large.kdbx')
+        kdbx_generator.generate(db, n_entries=15000, rounds=10)
+        times = bench_stages.bench_database(db, repeat=1)
+        self.assertEqual(set(times), set(bench_stages.STAGES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+import os
+import shutil
+import tempfile
+from os import path
+from unittest import mock
+
+from readkeepass import cache
+from readkeepass import kdb
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+
+class MemoryKeyStore:
+    def __init__(self):
+        self.key = None
+
+    def get(self):
+        return self.key
+
+    def set(self, key):
+        self.key = key
+
+    def delete(self):
+        self.key = None
+
+
+class LockedKeyStore:
+    "Fails like a locked or unreachable keyring"
+    def get(self):
+        raise OSError('keyring is locked')
+
+    set = delete = get
+
+
+class TestSerialize(unittest.TestCase):
+    def test_roundtrip(self):
+        entries = [{'title': 'ünïcödé', 'password': ''}, {}, {'a': 'b' * 1000}]
+        self.assertEqual(cache.loads(cache.dumps(entries)), entries)
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.db = path.join(self.tmp, 'db2.kdbx')
+        shutil.copy(path.join(data_dir, 'db2.kdbx'), self.db)
+        self.entries = kdb.load_entries(self.db, password='testpass1234')
+        self.key_store = MemoryKeyStore()
+        self.cache = cache.SnapshotCache(key_store=self.key_store,
+                                         directory=path.join(self.tmp, 'cache'))
+
+    def test_roundtrip(self):
+        self.assertIsNone(self.cache.get(self.db))
+        self.cache.put(self.db, self.entries)
+        self.assertEqual(len(self.key_store.key), cache.SESSION_KEY_LENGTH)
+        self.assertEqual(self.cache.get(self.db), self.entries)
+        with open(self.cache.path(self.db), 'rb') as fh:
+            self.assertNotIn(b'andchill', fh.read())
+
+    def test_key_store_error(self):
+        self.cache.put(self.db, self.entries)
+        locked = cache.SnapshotCache(key_store=LockedKeyStore(),
+                                     directory=self.cache.directory)
+        self.assertIsNone(locked.get(self.db))
+        locked.put(self.db, self.entries)
+        locked.store(kdb.load(self.db, password='testpass1234'))
+        # the snapshot written with the working key store is left alone
+        self.assertEqual(self.cache.get(self.db), self.entries)
+
+    def test_identity_before_unlock(self):
+        identity = self.cache.identity(self.db)
+        kpdb = kdb.load(self.db, password='testpass1234')
+        # the file is replaced while it is unlocked
+        st = os.stat(self.db)
+        os.utime(self.db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.cache.store(kpdb, {self.db: identity})
+        self.assertIsNone(self.cache.get(self.db))
+        self.cache.store(kpdb, {self.db: None})
+        self.assertIsNone(self.cache.get(self.db))
+        self.assertIsNone(self.cache.identity(path.join(self.tmp, 'missing')))
+
+    def test_store_error(self):
+        # the cache directory cannot be created
+        with open(self.cache.directory, 'w'):
+            pass
+        kpdb = kdb.load(self.db, password='testpass1234')
+        with self.assertLogs('readkeepass.cache', 'WARNING'):
+            self.cache.store(kpdb)
+        with self.assertRaises(OSError):
+            self.cache.put(self.db, self.entries)
+
+    def test_temporary_file(self):
+        self.cache.put(self.db, self.entries)
+        with mock.patch('os.replace', side_effect=OSError('full')):
+            with self.assertRaises(OSError):
+                self.cache.put(self.db, self.entries)
+        self.assertEqual(os.listdir(self.cache.directory),
+                         [path.basename(self.cache.path(self.db))])
+        self.assertEqual(self.cache.get(self.db), self.entries)
+
+    def test_load(self):
+        kpdb = kdb.load(self.db, password='testpass1234')
+        self.cache.store(kpdb)
+        cached = self.cache.load(self.db)
+        self.assertEqual(cached.paths, [self.db])
+        self.assertEqual([x.as_dict for x in cached.entries],
+                         [x.as_dict for x in kpdb.entries])
+        self.assertEqual([x.uuid for x in cached.entries],
+                         [x.uuid for x in kpdb.entries])
+
+    def test_file_changed(self):
+        self.cache.put(self.db, self.entries)
+        st = os.stat(self.db)
+        os.utime(self.db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertIsNone(self.cache.get(self.db))
+
+    def test_other_key(self):
+        self.cache.put(self.db, self.entries)
+        other = cache.SnapshotCache(key_store=MemoryKeyStore(),
+                                    directory=self.cache.directory)
+        self.assertIsNone(other.get(self.db))
+
+    def test_tampered(self):
+        self.cache.put(self.db, self.entries)
+        with open(self.cache.path(self.db), 'r+b') as fh:
+            fh.seek(30)
+            byte = fh.read(1)
+            fh.seek(30)
+            fh.write(bytes([byte[0] ^ 1]))
+        self.assertIsNone(self.cache.get(self.db))
+
+    def test_delete(self):
+        self.cache.put(self.db, self.entries)
+        self.cache.delete(self.db)
+        self.assertIsNone(self.cache.get(self.db))
+        self.cache.delete(self.db)
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
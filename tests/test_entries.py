@@ -0,0 +1,99 @@
+import unittest
+from os import path
+
+from lxml import etree
+
+from readkeepass.kdb import libkeepass
+from readkeepass.kdb.libkeepass import entries
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+document = b'''<KeePassFile>
+<Meta><Generator>test</Generator><Binaries><Binary ID="0">QUJD</Binary></Binaries></Meta>
+<Root>
+<Group><UUID>cm9vdA==</UUID><Name>Root</Name>
+  <Entry><UUID>ZTE=</UUID>
+    <String><Key>Title</Key><Value>one</Value></String>
+    <String><Key>Password</Key><Value Protected="True">AAAA</Value></String>
+    <History><Entry><UUID>ZTE=</UUID>
+      <String><Key>Title</Key><Value>old</Value></String>
+      <String><Key>Password</Key><Value Protected="True">AAAAAA==</Value></String>
+    </Entry></History>
+  </Entry>
+  <Group><UUID>c3Vi</UUID><Name>sub</Name>
+    <Entry><UUID>ZTI=</UUID>
+      <String><Key>Title</Key><Value>two</Value></String>
+      <String><Key>Notes</Key><Value/></String>
+      <String><Key>Password</Key><Value Protected="True">AAAAAAA=</Value></String>
+    </Entry>
+  </Group>
+</Group>
+<DeletedObjects><DeletedObject><UUID>ZTM=</UUID></DeletedObject></DeletedObjects>
+</Root>
+</KeePassFile>'''
+
+
+class TestEntryTarget(unittest.TestCase):
+    def test_parse(self):
+        target = entries.EntryTarget()
+        records = etree.fromstring(document, etree.XMLParser(target=target))
+        self.assertEqual([r.uuid for r in records], ['ZTE=', 'ZTI='])
+        self.assertEqual([r.group_path for r in records],
+                         [('Root',), ('Root', 'sub')])
+        self.assertEqual(records[0].fields['Title'], 'one')
+        self.assertEqual(records[1].fields['Notes'], '')
+        # the protected password in the history takes 4 bytes of the stream
+        self.assertEqual(records[0].fields['Password'],
+                         entries.ProtectedText(0, 'AAAA'))
+        self.assertEqual(records[1].fields['Password'],
+                         entries.ProtectedText(7, 'AAAAAAA='))
+        self.assertEqual(target.offset, 12)
+
+
+class TestEntryReader(unittest.TestCase):
+    """KDB4EntryReader finds the same entries as the objectify tree"""
+    databases = [
+        ('exampledatabase.kdbx',
+         dict(password='pass',
+              keyfile=path.join(data_dir, 'exampledatabase.key'))),
+        ('kdbx4_argon2id_chacha20.kdbx',
+         dict(password='pass',
+              keyfile=path.join(data_dir, 'exampledatabase.key'))),
+    ]
+
+    @staticmethod
+    def tree_entries(kdb):
+        for entry in kdb.obj_root.findall('.//Entry'):
+            if entry.getparent().tag == 'History':
+                continue
+            fields = {str(s.Key): str(s.Value) for s in entry.findall('String')}
+            yield str(entry.UUID), fields
+
+    def test_same_entries(self):
+        for name, credentials in self.databases:
+            db = path.join(data_dir, name)
+            with libkeepass.open(db, **credentials) as kdb:
+                expected = list(self.tree_entries(kdb))
+            with open(db, 'rb') as stream:
+                records = entries.KDB4EntryReader(stream, **credentials).entries
+            self.assertEqual([(r.uuid, r.fields) for r in records], expected)
+
+    def test_lazy(self):
+        name, credentials = self.databases[1]
+        with open(path.join(data_dir, name), 'rb') as stream:
+            kdb = entries.KDB4EntryReader(stream, unprotect='lazy',
+                                          **credentials)
+        passwords = [r.fields['Password'] for r in kdb.entries]
+        self.assertIsInstance(passwords[0], entries.ProtectedText)
+        # empty values are not protected
+        self.assertEqual(passwords[-1], '')
+        self.assertEqual([kdb.get_protected_value(p) for p in passwords[-2::-1]],
+                         ['meow', 'coolbeans', 'yolo2'])
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import shutil
+import tempfile
+from os import path
+
+from readkeepass import frecency
+
+DAY = 24 * 3600
+NOW = 1.7e9
+
+
+class TestSelectionLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = path.join(self.tmp, 'state', 'selections.log')
+        self.log = frecency.SelectionLog(self.path)
+
+    def reopen(self):
+        return frecency.SelectionLog(self.path)
+
+    def ranking(self, log):
+        scores = log.scores()
+        return sorted(scores, key=scores.get, reverse=True)
+
+    def test_empty(self):
+        self.assertEqual(self.log.scores(), {})
+        self.assertIsNone(self.log.last())
+        self.assertFalse(path.exists(self.path))
+
+    def test_record(self):
+        self.log.record('a', NOW - 2 * DAY)
+        self.log.record('b', NOW - DAY)
+        self.log.record('a', NOW)
+        self.assertEqual(self.ranking(self.log), ['a', 'b'])
+        self.assertEqual(self.log.last(), 'a')
+        log = self.reopen()
+        self.assertEqual(log.scores(), self.log.scores())
+        self.assertEqual(log.last(), 'a')
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_frequency_and_recency(self):
+        # selected often two months ago or once yesterday
+        for i in range(5):
+            self.log.record('often', NOW - 60 * DAY + i)
+        self.log.record('recent', NOW - DAY)
+        self.assertEqual(self.ranking(self.log), ['often', 'recent'])
+        # a month later 'often' is selected less than twice as often,
+        # but two months longer ago
+        self.log.record('recent', NOW)
+        self.assertEqual(self.ranking(self.log), ['recent', 'often'])
+
+    def test_compact(self):
+        for i in range(20):
+            self.log.record('abc'[i % 3], NOW - i * DAY)
+        self.log.record('old', NOW - frecency.MAX_AGE - DAY)
+        self.log.record('b', NOW)
+        scores = dict(self.log.scores())
+        self.log.compact(now=NOW)
+        with open(self.path) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[-1].endswith(' b'))
+        log = self.reopen()
+        self.assertEqual(log.last(), 'b')
+        self.assertNotIn('old', log.scores())
+        for uuid, score in log.scores().items():
+            self.assertAlmostEqual(score, scores[uuid])
+
+    def test_compact_when_full(self):
+        log = frecency.SelectionLog(self.path, max_lines=10)
+        for i in range(25):
+            log.record(str(i % 4), NOW + i)
+        with open(self.path) as fh:
+            self.assertLessEqual(len(fh.readlines()), 10)
+        self.assertEqual(self.ranking(self.reopen()), self.ranking(log))
+        self.assertEqual(self.reopen().last(), '0')
+
+    def test_bad_lines(self):
+        os.makedirs(path.dirname(self.path))
+        with open(self.path, 'w') as fh:
+            fh.write('E 1 a\ngarbage\nX 1 b\nE nan? c\n')
+        self.assertEqual(list(self.log.scores()), ['a'])
+        self.assertEqual(self.log.last(), 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
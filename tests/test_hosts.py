@@ -0,0 +1,94 @@
+import unittest
+
+from readkeepass import kdb, hosts
+
+
+class TestHostname(unittest.TestCase):
+    def test_normalize(self):
+        for url in ('https://Login.Example.com/sso?a=b',
+                    'login.example.com',
+                    'login.example.com./path',
+                    'ftp://user:pw@LOGIN.example.com:2121'):
+            self.assertEqual(hosts.hostname(url), 'login.example.com')
+
+    def test_special(self):
+        self.assertEqual(hosts.hostname('http://bücher.de'), 'xn--bcher-kva.de')
+        self.assertEqual(hosts.hostname('http://[::1]:8080/'), '::1')
+        self.assertEqual(hosts.hostname('http://localhost:8000'), 'localhost')
+        for url in ('', '   ', 'just some text', 'http://[broken'):
+            self.assertIsNone(hosts.hostname(url))
+
+
+class TestPublicSuffixList(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.psl = hosts.default_suffixes()
+
+    def test_registrable_domain(self):
+        expected = {
+            'example.com': 'example.com',
+            'login.corp.example.com': 'example.com',
+            'www.example.co.uk': 'example.co.uk',
+            'me.github.io': 'me.github.io',
+            'a.b.example.ck': 'b.example.ck',   # *.ck
+            'www.ck': 'www.ck',                 # !www.ck
+            'host.unlisted-tld': 'host.unlisted-tld',
+            '10.0.0.1': '10.0.0.1',
+            'co.uk': None,
+            'github.io': None,
+            # private suffixes: every tenant is a domain of its own
+            'evil.myshopify.com': 'evil.myshopify.com',
+            'docs.project.readthedocs.io': 'project.readthedocs.io',
+            'xn--55qx5d.cn': None,              # 公司.cn
+            'shop.xn--55qx5d.cn': 'shop.xn--55qx5d.cn',
+        }
+        for host, domain in expected.items():
+            self.assertEqual(self.psl.registrable_domain(host), domain, host)
+
+    def test_rules(self):
+        psl = hosts.PublicSuffixList(['// comment', '', 'Com ', '*.x', '!a.x'])
+        self.assertEqual(psl.rules, {'com'})
+        self.assertEqual(psl.public_suffix('b.c.x'), 'c.x')
+        self.assertEqual(psl.public_suffix('b.a.x'), 'x')
+
+
+class TestHostIndex(unittest.TestCase):
+    def setUp(self):
+        urls = ['https://example.com', 'login.corp.example.com/sso',
+                'https://mail.example.com', 'https://corp.example.com',
+                'https://example.co.uk', '', 'no url here']
+        self.entries = [kdb.KeePassEntry({'title': str(i), 'url': url})
+                        for i, url in enumerate(urls)]
+        self.index = hosts.HostIndex(self.entries)
+
+    def titles(self, url):
+        return [e.as_dict['title'] for e in self.index.lookup(url)]
+
+    def test_lookup(self):
+        # host, parents down to the registrable domain, the other hosts
+        self.assertEqual(self.titles('https://login.corp.example.com/x'),
+                         ['1', '3', '0', '2'])
+        self.assertEqual(self.titles('http://EXAMPLE.com'),
+                         ['0', '1', '2', '3'])
+        self.assertEqual(self.titles('https://shop.example.co.uk'), ['4'])
+        self.assertEqual(self.titles('https://example.org'), [])
+        self.assertEqual(self.titles('not a url'), [])
+
+    def test_private_suffix(self):
+        entries = [kdb.KeePassEntry({'title': 'a', 'url': 'a.myshopify.com'})]
+        index = hosts.HostIndex(entries)
+        self.assertEqual(index.lookup('https://evil.myshopify.com'), [])
+        self.assertEqual(index.lookup('https://admin.a.myshopify.com'), entries)
+
+    def test_find_url(self):
+        kpdb = kdb.KeePassDB(entries=self.entries)
+        self.assertEqual(hosts.find_url(kpdb, 'corp.example.com'),
+                         [self.entries[i] for i in (3, 0, 1, 2)])
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
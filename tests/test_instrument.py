@@ -0,0 +1,93 @@
+import unittest
+import json
+import shutil
+import tempfile
+from os import path
+
+from readkeepass import instrument, kdb, rofi
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+
+class TestInstrument(unittest.TestCase):
+    def setUp(self):
+        instrument.reset()
+        self.addCleanup(instrument.reset)
+
+    def test_disabled(self):
+        with instrument.stage('nothing', a=1) as st:
+            self.assertFalse(st)
+            st.set(b=2)
+        instrument.mark('point')
+        self.assertEqual(instrument.records(), [])
+
+    def test_stage(self):
+        instrument.enable()
+        with instrument.stage('outer', db='x') as st:
+            self.assertTrue(st)
+            with instrument.stage('inner'):
+                pass
+            st.set(entries=3)
+        instrument.mark('point', rows=1)
+        with self.assertRaises(KeyError):
+            with instrument.stage('failed'):
+                raise KeyError()
+        report = instrument.report()
+        self.assertEqual([r['name'] for r in report],
+                         ['outer', 'inner', 'point', 'failed'])
+        outer = report[0]
+        self.assertEqual((outer['db'], outer['entries']), ('x', 3))
+        self.assertGreaterEqual(outer['seconds'], report[1]['seconds'])
+        self.assertGreaterEqual(report[1]['start'], outer['start'])
+        self.assertIsNone(report[2]['seconds'])
+        self.assertEqual(report[3]['error'], 'KeyError')
+
+    def test_load(self):
+        instrument.enable()
+        db = path.join(data_dir, 'db2.kdbx')
+        kpdb = kdb.load(db, password='testpass1234')
+        rofi.build_rofi_input(kpdb)
+        stages = {r['name']: r for r in instrument.report()}
+        for name in ('kdf', 'payload', 'decrypt', 'start_bytes',
+                     'hashed_blocks', 'inflate', 'parse', 'unprotect',
+                     'extract', 'load_entries', 'render'):
+            self.assertIn(name, stages)
+        self.assertEqual(stages['kdf']['rounds'], 100000)
+        self.assertEqual(stages['decrypt']['bytes_out'],
+                         stages['start_bytes']['bytes_in'])
+        self.assertEqual(stages['inflate']['bytes_out'],
+                         stages['parse']['bytes_in'])
+        self.assertEqual(stages['load_entries']['entries'], len(kpdb.entries))
+        self.assertEqual(stages['render']['entries'], len(kpdb.entries))
+
+    def test_workers(self):
+        instrument.enable()
+        db = path.join(data_dir, 'db2.kdbx')
+        creds = [(db, '', 'testpass1234')] * 2
+        loaded = list(kdb.iter_load_many(*creds, max_workers=2))
+        self.assertEqual(len(loaded), 2)
+        names = [r['name'] for r in instrument.records()]
+        self.assertEqual(names.count('load_entries'), 2)
+        self.assertEqual(names.count('kdf'), 2)
+
+    def test_dump(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        instrument.enable()
+        with instrument.stage('a'):
+            pass
+        out = path.join(tmp, 'profile.json')
+        instrument.dump(out)
+        with open(out) as fh:
+            stages = json.load(fh)['stages']
+        self.assertEqual([r['name'] for r in stages], ['a'])
+
+    def test_merge(self):
+        instrument.merge([{'name': 'lost', 'start': 0.0, 'seconds': 1.0}])
+        instrument.enable()
+        instrument.merge([{'name': 'worker', 'start': 0.0, 'seconds': 1.0}])
+        self.assertEqual([r['name'] for r in instrument.records()], ['worker'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import io
+import os
+import base64
+import shutil
+import struct
+import hashlib
+import tempfile
+import unittest
+from os import path
+
+from Crypto.Cipher import AES
+
+from readkeepass import kdb
+from readkeepass.kdb import libkeepass
+from readkeepass.kdb.libkeepass import common, crypto, kdb3
+
+ROUNDS = 50
+# (level, name) of the groups in tree order, their ids are 1, 2, ...
+GROUPS = [(0, 'Internet'), (1, 'Mail'), (0, 'Bank')]
+# (group id, title, url, username, password, notes)
+ENTRIES = [
+    (1, 'Forum', 'https://forum.example', 'me', 'pw1', ''),
+    (2, 'Webmail', 'https://mail.example', 'me@mail', 'pässwörd', 'x\ny'),
+    (3, 'Bank', '', 'customer', 'pw3', 'notes'),
+]
+
+
+def field(ftype, data):
+    return struct.pack('<HI', ftype, len(data)) + data
+
+
+def text(s):
+    return s.encode('utf-8') + b'\x00'
+
+
+def payload(groups=GROUPS, entries=ENTRIES, meta_stream=True):
+    "Return the plain payload of a kdb3 file and its number of entries"
+    out = []
+    for i, (level, name) in enumerate(groups, start=1):
+        out += [field(1, struct.pack('<I', i)), field(2, text(name)),
+                field(3, b'\x00' * 5), field(7, struct.pack('<I', 0)),
+                field(8, struct.pack('<H', level)),
+                field(9, struct.pack('<I', 0)), field(0xFFFF, b'')]
+    records = [(struct.pack('<I', i) * 4,) + e for i, e in enumerate(entries)]
+    if meta_stream:
+        records.append((b'\xff' * 16, 1, 'Meta-Info', '$', 'SYSTEM', '',
+                        'KPX_GROUP_TREE_STATE'))
+    for uuid, gid, title, url, user, pw, notes in records:
+        out += [field(0, b'ignored'), field(1, uuid),
+                field(2, struct.pack('<I', gid)), field(3, b'\x00' * 4)]
+        out += [field(t, text(v)) for t, v in
+                zip(range(4, 9), (title, url, user, pw, notes))]
+        desc = 'bin-stream' if title == 'Meta-Info' else ''
+        out += [field(0x000D, text(desc)), field(0x000E, b''),
+                field(0xFFFF, b'')]
+    return b''.join(out), len(records)
+
+
+def write_kdb3(filename, password=None, keyfile_key=None, **kwargs):
+    "Write an AES encrypted kdb3 file with the GROUPS and ENTRIES"
+    data, n_entries = payload(**kwargs)
+    keys = []
+    if password is not None:
+        keys.append(hashlib.sha256(password.encode('utf-8')).digest())
+    if keyfile_key is not None:
+        keys.append(keyfile_key)
+    composite = keys[0] if len(keys) == 1 else hashlib.sha256(
+        b''.join(keys)).digest()
+    master_seed, iv, seed2 = b'm' * 16, b'i' * 16, b's' * 32
+    ecb = AES.new(seed2, AES.MODE_ECB)
+    for _ in range(ROUNDS):
+        composite = ecb.encrypt(composite)
+    master_key = hashlib.sha256(
+        master_seed + hashlib.sha256(composite).digest()).digest()
+    header = struct.pack('<IIII', kdb3.KDB3_SIGNATURE[0],
+                         kdb3.KDB3_SIGNATURE[1], 3, 0x00030002)
+    header += master_seed + iv
+    header += struct.pack('<II', len(GROUPS), n_entries)
+    header += hashlib.sha256(data).digest() + seed2
+    header += struct.pack('<I', ROUNDS)
+    with io.open(filename, 'wb') as fh:
+        fh.write(header)
+        fh.write(crypto.aes_cbc_encrypt(crypto.pad(data), master_key, iv))
+
+
+class TestKDB3(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.db = path.join(self.tmp, 'db.kdb')
+
+    def write_keyfile(self, content):
+        keyfile = path.join(self.tmp, 'key')
+        with io.open(keyfile, 'wb') as fh:
+            fh.write(content)
+        return keyfile
+
+    def test_records(self):
+        write_kdb3(self.db, password='pass')
+        with libkeepass.open(self.db, password='pass') as reader:
+            self.assertIsInstance(reader, kdb3.KDB3Reader)
+            records = reader.entries
+        self.assertEqual([r.group_path for r in records],
+                         [('Internet',), ('Internet', 'Mail'), ('Bank',)])
+        self.assertEqual(records[0].uuid,
+                         base64.b64encode(b'\x00' * 16).decode())
+        self.assertEqual(records[1].fields, {
+            'Title': 'Webmail', 'URL': 'https://mail.example',
+            'UserName': 'me@mail', 'Password': 'pässwörd', 'Notes': 'x\ny'})
+
+    def test_load(self):
+        write_kdb3(self.db, password='pass')
+        kpdb = kdb.load(self.db, password='pass')
+        entries = kpdb.entries
+        self.assertEqual(len(entries), len(ENTRIES))
+        self.assertEqual(entries[1].as_dict, {
+            'title': 'Webmail', 'url': 'https://mail.example',
+            'username': 'me@mail', 'password': 'pässwörd', 'notes': 'x\ny',
+            'groupname': 'Mail'})
+        self.assertEqual(entries[2].uuid,
+                         base64.b64encode(b'\x02\x00\x00\x00' * 4).decode())
+        self.assertEqual(kdb.kdf_rounds(self.db), ROUNDS)
+
+    def test_wrong_password(self):
+        write_kdb3(self.db, password='pass')
+        with self.assertRaises(IOError):
+            kdb.load(self.db, password='wrong')
+
+    def test_keyfile(self):
+        key = bytes(range(32))
+        write_kdb3(self.db, password='pass', keyfile_key=key)
+        for content in (key, key.hex().encode()):
+            keyfile = self.write_keyfile(content)
+            kpdb = kdb.load(self.db, keyfile=keyfile, password='pass')
+            self.assertEqual(len(kpdb.entries), len(ENTRIES))
+        with self.assertRaises(IOError):
+            kdb.load(self.db, password='pass')
+
+    def test_only_keyfile(self):
+        content = b'<KeyFile>any file is hashed</KeyFile>'
+        write_kdb3(self.db, keyfile_key=hashlib.sha256(content).digest())
+        keyfile = self.write_keyfile(content)
+        kpdb = kdb.load(self.db, keyfile=keyfile)
+        self.assertEqual(len(kpdb.entries), len(ENTRIES))
+
+    def test_truncated(self):
+        data, n_entries = payload()
+
+        class Reader(kdb3.KDBExtension):
+            opened = False
+            header = kdb3.KDB3Header({4: len(GROUPS), 5: n_entries})
+        with self.assertRaises(IOError):
+            Reader()._parse_payload(memoryview(data[:-20]))
+        self.assertEqual(len(Reader()._parse_payload(memoryview(data))),
+                         len(ENTRIES))
+
+
+class TestPlainKeyfile(unittest.TestCase):
+    def test_hex(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        keyfile = path.join(tmp, 'key')
+        for content, key in [
+                (b'ab' * 32, b'\xab' * 32),
+                (b'zz' * 32, hashlib.sha256(b'zz' * 32).digest())]:
+            with io.open(keyfile, 'wb') as fh:
+                fh.write(content)
+            self.assertEqual(common.load_plain_keyfile(keyfile), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
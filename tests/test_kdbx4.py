@@ -0,0 +1,192 @@
+import unittest
+import io
+import os
+import struct
+from os import path
+from unittest import mock
+
+from readkeepass.kdb import libkeepass
+from readkeepass.kdb.libkeepass import chacha20, fastSalsa20, hbio, kdb4
+from readkeepass.kdb.libkeepass import kdf, variantdict
+
+try:
+    data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+except NameError:
+    data_dir = path.join(os.getcwd(), 'data')
+
+# RFC 7539, section 2.4.2
+rfc7539_vector = {
+    'key': bytes(range(32)),
+    'nonce': bytes.fromhex('000000000000004a00000000'),
+    'counter': 1,
+    'plaintext': (b"Ladies and Gentlemen of the class of '99: If I could offer "
+                  b"you only one tip for the future, sunscreen would be it."),
+    'ciphertext': bytes.fromhex(
+        '6e2e359a2568f98041ba0728dd0d6981e97e7aec1d4360c20a27afccfd9fae0b'
+        'f91b65c5524733ab8f593dabcd62b3571639d624e65152ab8f530c359f0861d8'
+        '07ca0dbf500d6a6156a38e088a22b65e52bc514d16ccf806818ce91ab7793736'
+        '5af90bbf74a35be6b40b8eedf2785e42874d'
+    ),
+}
+
+
+class TestChaCha20(unittest.TestCase):
+    def encrypt(self, chunks):
+        v = rfc7539_vector
+        cipher = chacha20.ChaCha20(v['key'], v['nonce'], v['counter'])
+        data, out = v['plaintext'], []
+        for start, end in zip(chunks, chunks[1:] + [len(data)]):
+            out.append(cipher.encryptBytes(data[start:end]))
+        return b''.join(out)
+
+    def test_vector(self):
+        self.assertEqual(self.encrypt([0]), rfc7539_vector['ciphertext'])
+
+    def test_vector_chunks(self):
+        self.assertEqual(self.encrypt([0, 7, 64, 65, 100]),
+                         rfc7539_vector['ciphertext'])
+
+    def test_vector_python(self):
+        with mock.patch.object(chacha20, '_np', None):
+            self.assertEqual(self.encrypt([0, 3]), rfc7539_vector['ciphertext'])
+
+
+class TestVariantDictionary(unittest.TestCase):
+    @staticmethod
+    def item(vtype, name, value):
+        name = name.encode('utf-8')
+        return (struct.pack('<Bi', vtype, len(name)) + name
+                + struct.pack('<i', len(value)) + value)
+
+    def test_parse(self):
+        data = b''.join([
+            struct.pack('<H', variantdict.VERSION),
+            self.item(variantdict.BYTE_ARRAY, '$UUID', kdf.AES_KDF),
+            self.item(variantdict.UINT64, 'R', struct.pack('<Q', 6000)),
+            self.item(variantdict.UINT32, 'P', struct.pack('<I', 2)),
+            self.item(variantdict.BOOL, 'B', b'\x01'),
+            self.item(variantdict.INT64, 'N', struct.pack('<q', -1)),
+            self.item(variantdict.STRING, 'T', 'ü'.encode('utf-8')),
+            b'\x00',
+        ])
+        d = variantdict.parse(data)
+        self.assertEqual(list(d), ['$UUID', 'R', 'P', 'B', 'N', 'T'])
+        self.assertEqual(d['$UUID'], kdf.AES_KDF)
+        self.assertEqual(d['R'], 6000)
+        self.assertEqual(d['P'], 2)
+        self.assertIs(d['B'], True)
+        self.assertEqual(d['N'], -1)
+        self.assertEqual(d['T'], 'ü')
+
+    def test_truncated(self):
+        data = struct.pack('<H', variantdict.VERSION) + self.item(
+            variantdict.UINT64, 'R', struct.pack('<Q', 6000))[:-2]
+        with self.assertRaises(IOError):
+            variantdict.parse(data)
+
+    def test_version(self):
+        with self.assertRaises(IOError):
+            variantdict.parse(struct.pack('<H', 0x0200) + b'\x00')
+
+
+class TestHmacBlocks(unittest.TestCase):
+    @staticmethod
+    def block_stream(key, blocks):
+        out = io.BytesIO()
+        for index, data in enumerate(blocks + [b'']):
+            raw_length = struct.pack('<i', len(data))
+            mac = hbio.hmac_digest(key, index, struct.pack('<Q', index)
+                                   + raw_length + data)
+            out.write(mac + raw_length + data)
+        out.seek(0)
+        return out
+
+    def test_read(self):
+        key = os.urandom(64)
+        blocks = [os.urandom(100), os.urandom(7)]
+        stream = self.block_stream(key, blocks)
+        self.assertEqual(list(hbio.read_hmac_blocks(stream, key)), blocks)
+
+    def test_mismatch(self):
+        key = os.urandom(64)
+        stream = self.block_stream(key, [os.urandom(100)])
+        with self.assertRaises(IOError):
+            list(hbio.read_hmac_blocks(stream, os.urandom(64)))
+
+    def test_truncated(self):
+        key = os.urandom(64)
+        data = self.block_stream(key, [os.urandom(100)]).read()
+        with self.assertRaises(IOError):
+            list(hbio.read_hmac_blocks(io.BytesIO(data[:-10]), key))
+
+
+class TestKDBX4Reader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = path.join(data_dir, 'kdbx4_argon2d.kdbx')
+
+    def test_header(self):
+        kdb = libkeepass.read_header(self.db)
+        self.assertIsInstance(kdb, kdb4.KDB4Reader)
+        self.assertTrue(kdb.is_kdbx4)
+        params = kdb.kdf_parameters
+        self.assertEqual(params['$UUID'], kdf.ARGON2D)
+        self.assertEqual(params['P'], 2)
+        self.assertEqual(kdb.transform_rounds, kdf.cost(params))
+
+    def test_inner_header(self):
+        with libkeepass.open(self.db, password='pass',
+                             keep_buffer=True) as kdb:
+            self.assertEqual(kdb.inner_header.InnerRandomStreamID,
+                             kdb4.STREAM_CHACHA20)
+            self.assertIsInstance(kdb.salsa, chacha20.ChaCha20)
+            kdb.seek(0)
+            self.assertEqual(kdb.read(13), b'<KeePassFile>')
+
+    def test_lazy(self):
+        with libkeepass.open(self.db, password='pass', unprotect='lazy') as kdb:
+            values = list(kdb.obj_root.iterfind('.//Value[@Protected="True"]'))
+            # history and the empty password included
+            self.assertEqual(len(values), 6)
+            plain = [kdb.get_protected_value(v) for v in reversed(values)]
+            self.assertEqual(plain[::-1], ['yolo', 'yolo2', 'hidden value',
+                                           'coolbeans', 'meow', ''])
+            for elem in values:
+                self.assertEqual(elem.get('Protected'), 'True')
+                self.assertIsNone(elem.get('ProtectedValue'))
+
+    def test_protect_roundtrip(self):
+        with libkeepass.open(self.db, password='pass') as kdb:
+            path = './/Value[@Protected="False"]'
+            plain = [elem.text for elem in kdb.obj_root.iterfind(path)]
+            kdb.protect()
+            protected = [elem.text for elem in
+                         kdb.obj_root.iterfind('.//Value[@Protected="True"]')
+                         if elem.text is not None]
+            # same stream, one value at a time
+            kdb._reset_salsa()
+            self.assertEqual([kdb._unprotect(text) for text in protected],
+                             [text or '' for text in plain])
+            kdb.unprotect()
+            self.assertEqual([elem.text for elem in kdb.obj_root.iterfind(path)],
+                             plain)
+
+    def test_wrong_password(self):
+        with self.assertRaises(IOError):
+            with libkeepass.open(self.db, password='wrong'):
+                pass
+
+    def test_old_format(self):
+        db = path.join(data_dir, 'db2.kdbx')
+        kdb = libkeepass.read_header(db)
+        self.assertFalse(kdb.is_kdbx4)
+        with libkeepass.open(db, password='testpass1234') as kdb:
+            self.assertIsInstance(kdb.salsa, fastSalsa20.Salsa20)
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
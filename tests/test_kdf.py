@@ -0,0 +1,64 @@
+import unittest
+import hashlib
+import threading
+from unittest import mock
+
+from Crypto.Cipher import AES
+from readkeepass.kdb.libkeepass import crypto
+
+
+def reference_transform_key(key, seed, rounds):
+    "The AES-KDF as one chain over the whole 32 byte key"
+    cipher = AES.new(seed, AES.MODE_ECB)
+    for n in range(rounds):
+        key = cipher.encrypt(key)
+    return hashlib.sha256(key).digest()
+
+
+class TestTransformKey(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.key = hashlib.sha256(b'composite').digest()
+        cls.seed = hashlib.sha256(b'seed').digest()
+        cls.rounds = 2000
+        cls.expected = reference_transform_key(cls.key, cls.seed, cls.rounds)
+
+    def test_serial(self):
+        tkey = crypto.transform_key(self.key, self.seed, self.rounds,
+                                    parallel=False)
+        self.assertEqual(tkey, self.expected)
+
+    def test_parallel(self):
+        tkey = crypto.transform_key(self.key, self.seed, self.rounds,
+                                    parallel=True)
+        self.assertEqual(tkey, self.expected)
+
+    def test_default(self):
+        tkey = crypto.transform_key(self.key, self.seed, self.rounds)
+        self.assertEqual(tkey, self.expected)
+
+    def test_thread(self):
+        "No process is started from other threads than the main one"
+        results = []
+
+        def transform():
+            results.append(crypto.transform_key(self.key, self.seed,
+                                                self.rounds, parallel=True))
+        with mock.patch.object(crypto, 'ProcessPoolExecutor') as pool:
+            thread = threading.Thread(target=transform)
+            thread.start()
+            thread.join()
+        self.assertFalse(pool.called)
+        self.assertEqual(results, [self.expected])
+
+    def test_zero_rounds(self):
+        tkey = crypto.transform_key(self.key, self.seed, 0, parallel=True)
+        self.assertEqual(tkey, hashlib.sha256(self.key).digest())
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import os
 from os import path
+from unittest import mock
 
 import readkeepass as rkp
 kdb = rkp.kdb
@@ -47,6 +48,7 @@ class TestKeePassEntry(unittest.TestCase):
         d_orig = entry_0.as_dict
         as_nt = entry_0.as_ntuple
         d_nt = as_nt._asdict()
+        self.assertEqual(d_nt.pop('uuid'), entry_0.uuid)
         for k in d_nt:
             self.assertEqual(d_nt[k], d_orig[k])
 
@@ -58,6 +60,39 @@ class TestKeePassEntry(unittest.TestCase):
         for k in df:
             self.assertEqual(df[k], dformatted_0[k])
 
+    def test_memoized(self):
+        entry = kdb.KeePassEntry(dict(dentry_0))
+        self.assertIs(entry.as_ntuple, entry.as_ntuple)
+        self.assertIs(entry.as_formatted_dict, entry.as_formatted_dict)
+        entry.as_dict = dict(dentry_0, title='other')
+        self.assertEqual(entry.as_ntuple.title, 'other')
+        self.assertEqual(entry.as_formatted_dict['title'], '• Other')
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            entry_0.some_attribute = 1
+
+    def test_interned(self):
+        a, b = [kdb.KeePassEntry({'groupname': ''.join(['Ro', 'ot']),
+                                  'password': ''.join(['me', 'ow'])})
+                for _ in range(2)]
+        self.assertIs(a.as_dict['groupname'], b.as_dict['groupname'])
+        self.assertIsNot(a.as_dict['password'], b.as_dict['password'])
+
+    def test_pickle(self):
+        import pickle
+        entry = pickle.loads(pickle.dumps(loaded_db.entries[0]))
+        self.assertEqual(entry.as_dict, dentry_0)
+        self.assertEqual(entry.as_formatted_dict, dformatted_0)
+        self.assertEqual(entry.uuid, loaded_db.entries[0].uuid)
+
+    def test_uuid(self):
+        entry = loaded_db.entries[0]
+        self.assertEqual(entry.uuid, 'oU/76UKYWKNGsr4q9HER2w==')
+        self.assertEqual(entry.as_ntuple.uuid, entry.uuid)
+        self.assertIsNone(kdb.KeePassEntry(dentry_0).as_ntuple.uuid)
+        self.assertFalse(hasattr(entry.as_ntuple, '__dict__'))
+
 class TestLoading(unittest.TestCase):
     def test_db_loader(self):
         d0 = dentries[0]
@@ -66,6 +101,13 @@ class TestLoading(unittest.TestCase):
     def test_main_loader(self):
         self.assertEqual(loaded_db.entries[0].as_dict, dentry_0)
 
+    def test_unsupported_reader(self):
+        "Readers that don't extract EntryRecords are refused"
+        with mock.patch.object(kdb.libkeepass, 'get_kdb_reader',
+                               return_value=object):
+            with self.assertRaises(IOError):
+                kdb.load_entries(ex_db, ex_key, ex_password)
+
 db_path = path.join(data_dir, 'db2.kdbx')
 db_pw = 'testpass1234'
 entries_literal = (
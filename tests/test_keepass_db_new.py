@@ -12,6 +12,14 @@ class Database:
                                    password=self.password)
         self.assertEqual(self.dict_entries, entries)
 
+    def test_load_entries_lazy(self):
+        entries = kdb.load_entries(self.db, keyfile=self.keyfile,
+                                   password=self.password, lazy=True)
+        self.assertEqual(self.dict_entries, entries)
+        # protected values can be read in any order
+        for d, entry in zip(reversed(self.dict_entries), reversed(entries)):
+            self.assertEqual(d['password'], str(entry['password']))
+
     def test_load(self):
         kpdb = kdb.load(self.db, keyfile=self.keyfile,
                         password=self.password)
@@ -138,6 +146,110 @@ class Test_KeePass_PWKey(unittest.TestCase, Database):
         ]
 
 
+kdbx4_dict_entries = [
+    {'groupname': 'group one two',
+     'extra': 'hidden value',
+     'notes': 'ünïcödé notes',
+     'password': 'yolo2',
+     'title': 'group one two entry',
+     'url': 'g12.com',
+     'username': 'g12entry@gmail.com'},
+    {'groupname': 'group one',
+     'password': 'coolbeans',
+     'title': 'entry in group one',
+     'url': 'g1.com',
+     'username': 'g1swag@gmail.com'},
+    {'groupname': 'Root',
+     'notes': 'this is for digital ocean',
+     'password': 'meow',
+     'title': 'digitalocean',
+     'url': 'digitalocean.com',
+     'username': 'doswag@gmail.com'},
+    {'groupname': 'Root',
+     'password': '',
+     'title': 'An almost empty entry ;)',
+     'username': ''},
+]
+
+
+class Test_KDBX4_Argon2d(unittest.TestCase, Database):
+    """KDBX 4 database with Argon2d and AES, created with pykeepass"""
+    @classmethod
+    def setUpClass(cls):
+        cls.db = path.join(data_dir, 'kdbx4_argon2d.kdbx')
+        cls.keyfile = ''
+        cls.password = 'pass'
+        cls.dict_entries = kdbx4_dict_entries
+
+
+class Test_KDBX4_Argon2id_ChaCha20(unittest.TestCase, Database):
+    """KDBX 4 database with Argon2id, ChaCha20 and a key-file"""
+    @classmethod
+    def setUpClass(cls):
+        cls.db = path.join(data_dir, 'kdbx4_argon2id_chacha20.kdbx')
+        cls.keyfile = path.join(data_dir, 'exampledatabase.key')
+        cls.password = 'pass'
+        cls.dict_entries = kdbx4_dict_entries
+
+
+class Test_KDBX4_AESKDF(unittest.TestCase, Database):
+    """KDBX 4 database with AES-KDF and a Salsa20 inner random stream"""
+    @classmethod
+    def setUpClass(cls):
+        cls.db = path.join(data_dir, 'kdbx4_aeskdf_salsa20.kdbx')
+        cls.keyfile = ''
+        cls.password = 'pass'
+        cls.dict_entries = kdbx4_dict_entries
+
+
+class TestLoadMany(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.credentials = [
+            (path.join(data_dir, 'db2.kdbx'), '', 'testpass1234'),
+            (path.join(data_dir, 'keepassx_onlykey.kdbx'),
+             path.join(data_dir, 'keepassx_onlykey.key'), ''),
+            (path.join(data_dir, 'NewDatabase.kdbx'),
+             path.join(data_dir, 'NewDatabase.key'), 'pass'),
+        ]
+        cls.expected = [kdb.load(*cred) for cred in cls.credentials]
+
+    def test_kdf_rounds(self):
+        for db, keyfile, password in self.credentials:
+            self.assertGreater(kdb.kdf_rounds(db), 0)
+        self.assertEqual(kdb.kdf_rounds(path.join(data_dir, 'missing.kdbx')), 0)
+
+    def test_pickle(self):
+        import pickle
+        kpdb = pickle.loads(pickle.dumps(self.expected[0]))
+        self.assertEqual(kpdb.paths, self.expected[0].paths)
+        self.assertEqual([x.as_dict for x in kpdb.entries],
+                         [x.as_dict for x in self.expected[0].entries])
+
+    def test_load_many(self):
+        for max_workers in (1, 2):
+            kpdbs = kdb.load_many(*self.credentials, max_workers=max_workers)
+            self.assertEqual(len(kpdbs), len(self.expected))
+            for kpdb, expected in zip(kpdbs, self.expected):
+                self.assertIsInstance(kpdb, kdb.KeePassDB)
+                self.assertEqual(kpdb.paths, expected.paths)
+                self.assertEqual([x.as_dict for x in kpdb.entries],
+                                 [x.as_dict for x in expected.entries])
+
+    def test_iter_load_many(self):
+        for max_workers in (1, 2):
+            results = dict(kdb.iter_load_many(*self.credentials,
+                                              max_workers=max_workers))
+            self.assertEqual(sorted(results), list(range(len(self.expected))))
+            for i, expected in enumerate(self.expected):
+                self.assertEqual(results[i].paths, expected.paths)
+
+    def test_load_many_error(self):
+        credentials = self.credentials + [(self.credentials[0][0], '', 'wrong')]
+        with self.assertRaises(IOError):
+            kdb.load_many(*credentials, max_workers=2)
+
+
 if __name__ == '__main__':
     try:
         print('Running tests for {}'.format(__file__))
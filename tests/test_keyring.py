@@ -99,6 +99,35 @@ class TestCredentials(unittest.TestCase):
         self.assertEqual(c.set(), (self.db, '', ''))
         self.assertEqual(c.get(), (self.db, '', ''))
 
+    def test_get_many(self):
+        other = '/test/keyring2/other_db.kdbx'
+        self.cred.set(password='expw')
+        found = self.Credentials.func.get_many(
+            [self.db, other], collection_name=self.collection)
+        self.assertEqual(found, {self.db: (self.db, '', 'expw')})
+
+
+class TestConnection(unittest.TestCase):
+    def test_shared(self):
+        with keyring.Keyring('readkeepass_test') as ring1:
+            with keyring.Keyring('readkeepass_test') as ring2:
+                self.assertIs(ring1.bus, ring2.bus)
+                self.assertIs(ring1.coll, ring2.coll)
+        # closing a Keyring leaves the shared connection open
+        with keyring.Keyring('readkeepass_test') as ring3:
+            self.assertIsNone(ring3.get_secret('no such item'))
+        keyring.close_connection()
+
+    def test_find_items(self):
+        with keyring.Keyring('readkeepass_test') as ring:
+            ring.set_secret('find-me', a='b')
+            items = ring.find_items('find-me')
+            self.assertEqual([x.label for x in items], ['find-me'])
+            self.assertEqual(ring.get_secrets(['find-me', 'missing']),
+                             {'find-me': {'a': 'b'}})
+            self.assertTrue(ring.delete_item('find-me'))
+            self.assertEqual(ring.find_items('find-me'), [])
+
 
 if __name__ == '__main__':
     try:
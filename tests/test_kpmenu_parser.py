@@ -31,6 +31,60 @@ class TestBuildParser(unittest.TestCase):
         self.assertEqual(len(res.filename[0]), 1)
         self.assertEqual(res.filename[0][0], 'somefile')
 
+    def test_cache(self):
+        self.assertIsNone(self.parse_args([]).cache)
+        self.assertEqual(self.parse_args(['--cache']).cache, 'keyring')
+        self.assertEqual(self.parse_args(['-c', 'kernel']).cache, 'kernel')
+
+    def test_stream(self):
+        self.assertFalse(self.parse_args([]).stream)
+        self.assertTrue(self.parse_args(['--stream']).stream)
+
+    def test_profile(self):
+        self.assertIsNone(self.parse_args([]).profile)
+        self.assertEqual(self.parse_args(['--profile', 'out.json']).profile,
+                         'out.json')
+
+    def test_history(self):
+        res = self.parse_args([])
+        self.assertFalse(res.last)
+        self.assertTrue(res.history)
+        res = self.parse_args(['--last', '--no-history'])
+        self.assertTrue(res.last)
+        self.assertFalse(res.history)
+
+    def test_search(self):
+        self.assertIsNone(self.parse_args(['-f', 'somefile']).command)
+        res = self.parse_args(['search', '-f', 'somefile', '-n', '3',
+                               'gh', 'work'])
+        self.assertEqual(res.command, 'search')
+        self.assertEqual(res.query, ['gh', 'work'])
+        self.assertEqual(res.limit, 3)
+        self.assertEqual(res.filename, [['somefile']])
+
+    def test_search_options_before(self):
+        res = self.parse_args(['-f', 'db.kdbx', '-kr', '-c', '--profile',
+                               'out.json', 'search', 'foo'])
+        self.assertEqual(res.command, 'search')
+        self.assertEqual(res.filename, [['db.kdbx']])
+        self.assertTrue(res.key_ring)
+        self.assertEqual(res.cache, 'keyring')
+        self.assertEqual(res.profile, 'out.json')
+        res = self.parse_args(['-pw', 'input2', 'search', 'foo'])
+        self.assertEqual(res.pw_query, 'input2')
+        res = self.parse_args(['search', 'foo'])
+        self.assertIsNone(res.filename)
+        self.assertFalse(res.key_ring)
+        self.assertIsNone(res.cache)
+        self.assertEqual(res.pw_query, 'input1')
+
+    def test_daemon(self):
+        res = self.parse_args([])
+        self.assertFalse(res.daemon)
+        res = self.parse_args(['--daemon', '--idle-timeout', '60'])
+        self.assertTrue(res.daemon)
+        self.assertEqual(res.idle_timeout, 60)
+
     def test_filename_multi(self):
         res = self.parse_args(['-f', 'file0', '-f+k', 'file1', 'keyfile1'])
         self.assertEqual(len(res.filename[0]), 1)
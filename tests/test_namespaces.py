@@ -143,6 +143,27 @@ class TestRegistered(unittest.TestCase):
         self.assertInRegistry('othername')
         self.assertIs(testfn, self.root.othername)
 
+    def test_lazy(self):
+        leaf = self.root.register_lazy('join', 'os.path:join', doc='Join')
+        self.assertInRegistry('join')
+        self.assertIs(leaf, self.root.join)
+        self.assertEqual(leaf.__doc__, 'Join')
+        self.assertIsNone(leaf._obj)
+        self.assertEqual(leaf('a', 'b'), 'a/b')
+        import os.path
+        self.assertIs(leaf.resolve(), os.path.join)
+        self.assertEqual(self.root.register_lazy('path', 'os:path').sep,
+                         os.path.sep)
+
+    def test_lazy_replaced(self):
+        "The module of a lazy leaf can register the object itself"
+        self.root.register_lazy('fn_ident', 'nowhere:fn_ident')
+        self.register(self.fn_ident)
+        self.assertIs(self.root.fn_ident, self.fn_ident)
+        self.assertEqual(list(self.registry), ['fn_ident'])
+        with self.assertRaises(ValueError):
+            self.root.register_lazy('fn_ident', 'nowhere:fn_ident')
+
 if __name__ == '__main__':
     try:
         print('Running tests for {}'.format(__file__))
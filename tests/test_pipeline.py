@@ -0,0 +1,244 @@
+import unittest
+import io
+import os
+import gzip
+import shutil
+import tempfile
+from os import path
+from unittest import mock
+
+from lxml import etree, objectify
+
+from readkeepass import kdb as _kdb
+from readkeepass.kdb import libkeepass
+from readkeepass.kdb.libkeepass import crypto, hbio, kdb4, pipeline
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+
+def feed_in_pieces(stage, data, size):
+    pipeline.run((data[i:i + size] for i in range(0, len(data), size)), stage)
+
+
+class TestStages(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(5000)
+        hb = hbio.HashedBlockIO()
+        hb.write(self.data)
+        out = io.BytesIO()
+        hb.write_block_stream(out, block_length=1000)
+        self.blocks = out.getvalue()
+
+    def test_hashed_blocks(self):
+        for size in (1, 7, 40, 1000, 100000):
+            sink = pipeline.BufferSink()
+            feed_in_pieces(pipeline.HashedBlocks(sink), self.blocks, size)
+            self.assertEqual(sink.buffer.read(), self.data)
+
+    def test_hashed_blocks_mismatch(self):
+        blocks = bytearray(self.blocks)
+        blocks[100] ^= 1
+        with self.assertRaises(IOError):
+            feed_in_pieces(pipeline.HashedBlocks(pipeline.BufferSink()),
+                           bytes(blocks), 64)
+
+    def test_hashed_blocks_truncated(self):
+        with self.assertRaises(IOError):
+            feed_in_pieces(pipeline.HashedBlocks(pipeline.BufferSink()),
+                           self.blocks[:-40], 64)
+
+    def test_start_bytes(self):
+        sink = pipeline.BufferSink()
+        feed_in_pieces(pipeline.StartBytes(b'start', sink), b'startdata', 2)
+        self.assertEqual(sink.buffer.read(), b'data')
+        with self.assertRaises(IOError):
+            feed_in_pieces(pipeline.StartBytes(b'start', sink), b'stop', 2)
+
+    def test_inflate(self):
+        sink = pipeline.BufferSink()
+        feed_in_pieces(pipeline.Inflate(sink), gzip.compress(self.data), 100)
+        self.assertEqual(sink.buffer.read(), self.data)
+
+    def test_make_hashed_blocks(self):
+        for size in (1, 999, 1000, 4096):
+            sink = pipeline.BufferSink()
+            feed_in_pieces(pipeline.MakeHashedBlocks(sink, block_length=1000),
+                           self.data, size)
+            self.assertEqual(sink.buffer.read(), self.blocks)
+
+    def test_deflate(self):
+        sink = pipeline.BufferSink()
+        feed_in_pieces(pipeline.Deflate(sink), self.data, 100)
+        self.assertEqual(gzip.decompress(sink.buffer.read()), self.data)
+
+    def test_encrypt(self):
+        key, iv = os.urandom(32), os.urandom(16)
+        expected = crypto.aes_cbc_encrypt(crypto.pad(self.data), key, iv)
+        for size in (1, 16, 17, 5000):
+            sink = pipeline.BufferSink()
+            feed_in_pieces(pipeline.Encrypt(crypto.AESCBCEncryptor(key, iv),
+                                            sink), self.data, size)
+            self.assertEqual(sink.buffer.read(), expected)
+
+    def test_probe(self):
+        data = os.urandom(3000)
+        sink = pipeline.BufferSink()
+        head, probes = pipeline.probe(
+            pipeline.Inflate(pipeline.HashedBlocks(sink)))
+        hb = hbio.HashedBlockIO()
+        hb.write(data)
+        out = io.BytesIO()
+        hb.write_block_stream(out)
+        zipped = gzip.compress(out.getvalue())
+        feed_in_pieces(head, zipped, 100)
+        self.assertEqual(sink.buffer.read(), data)
+        times = list(pipeline.stage_times(probes))
+        self.assertEqual([x[0] for x in times],
+                         ['inflate', 'hashed_blocks', 'buffer'])
+        self.assertEqual([x[2:] for x in times],
+                         [(len(zipped), len(out.getvalue())),
+                          (len(out.getvalue()), len(data)), (len(data), None)])
+        for name, seconds, bytes_in, bytes_out in times:
+            self.assertGreaterEqual(seconds, 0)
+
+    def test_header_fields(self):
+        data = (b'\x01\x03\x00\x00\x00abc' b'\x03\x00\x00\x00\x00'
+                b'\x00\x00\x00\x00\x00' b'document')
+        for size in (1, 4, 100):
+            fields = []
+            sink = pipeline.BufferSink()
+            stage = pipeline.HeaderFields(
+                lambda *field: fields.append(field), sink)
+            feed_in_pieces(stage, data, size)
+            self.assertEqual(fields, [(1, b'abc'), (3, b''), (0, b'')])
+            self.assertEqual(sink.buffer.read(), b'document')
+        with self.assertRaises(IOError):
+            feed_in_pieces(pipeline.HeaderFields(lambda *field: None, sink),
+                           data[:12], 4)
+
+
+class TestHashedBlockReader(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(5000)
+        hb = hbio.HashedBlockIO()
+        hb.write(self.data)
+        out = io.BytesIO()
+        hb.write_block_stream(out, block_length=1000)
+        self.blocks = out.getvalue()
+
+    def test_iter_blocks(self):
+        blocks = list(hbio.iter_blocks(self.blocks))
+        self.assertEqual([len(b) for b in blocks], [1000] * 5)
+        self.assertIsInstance(blocks[0], memoryview)
+        self.assertEqual(b''.join(blocks), self.data)
+
+    def test_reader(self):
+        raw = hbio.HashedBlockReader(self.blocks)
+        self.assertEqual(raw.read(10), self.data[:10])
+        self.assertEqual(raw.readall(), self.data[10:])
+        self.assertEqual(raw.read(10), b'')
+        buffered = io.BufferedReader(hbio.HashedBlockReader(self.blocks))
+        self.assertEqual(buffered.read(), self.data)
+
+    def test_hashed_block_io(self):
+        self.assertEqual(hbio.HashedBlockIO(initial_bytes=self.blocks).read(),
+                         self.data)
+        with self.assertRaises(IOError):
+            hbio.HashedBlockIO(initial_bytes=self.blocks[:-40])
+        blocks = bytearray(self.blocks)
+        blocks[-100] ^= 1
+        with self.assertRaises(IOError):
+            hbio.HashedBlockReader(bytes(blocks)).read()
+
+
+class TestReader(unittest.TestCase):
+    """The parsed tree does not depend on the chunk size"""
+    databases = [
+        ('db2.kdbx', dict(password='testpass1234')),
+        ('kdbx4_aeskdf_salsa20.kdbx', dict(password='pass')),
+    ]
+
+    def test_chunk_size(self):
+        for name, credentials in self.databases:
+            db = path.join(data_dir, name)
+            with libkeepass.open(db, keep_buffer=True, **credentials) as kdb:
+                document = kdb.read()
+                expected = kdb.pretty_print()
+            with mock.patch.object(pipeline, 'CHUNK_SIZE', 17):
+                with libkeepass.open(db, **credentials) as kdb:
+                    self.assertIsNone(kdb.in_buffer)
+                    self.assertEqual(kdb.pretty_print(), expected)
+            self.assertTrue(document.lstrip().startswith(b'<'))
+
+    def test_wrong_password(self):
+        with self.assertRaises(IOError):
+            with libkeepass.open(path.join(data_dir, 'db2.kdbx'),
+                                 password='wrong'):
+                pass
+
+
+class TestWriter(unittest.TestCase):
+    db = path.join(data_dir, 'db2.kdbx')
+    password = 'testpass1234'
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def entries(self, filename):
+        return [e.as_dict for e in
+                _kdb.load(filename, password=self.password).entries]
+
+    def test_write_to(self):
+        out = path.join(self.tmp, 'out.kdbx')
+        for use_etree in (True, False):
+            with libkeepass.open(self.db, password=self.password,
+                                 keep_buffer=True) as kdb:
+                with io.open(out, 'wb') as fh:
+                    # blocks and writes smaller than the document
+                    with mock.patch.object(hbio, 'BLOCK_LENGTH', 1000):
+                        kdb.write_to(fh, use_etree=use_etree)
+            self.assertEqual(self.entries(out), self.entries(self.db))
+
+    def test_set_document(self):
+        out = path.join(self.tmp, 'out.kdbx')
+        with libkeepass.open(self.db, password=self.password) as kdb:
+            header, xml = kdb.header, etree.tostring(kdb.obj_root)
+        # a new database with the (unprotected) document of db2
+        new = kdb4.KDB4Reader(password=self.password)
+        new.header = header
+        new.set_document(objectify.fromstring(xml))
+        with io.open(out, 'wb') as fh:
+            new.write_to(fh)
+        self.assertEqual(self.entries(out), self.entries(self.db))
+
+    def test_save(self):
+        out = path.join(self.tmp, 'out.kdbx')
+        shutil.copy(self.db, out)
+        os.chmod(out, 0o640)
+        with libkeepass.open(self.db, password=self.password) as kdb:
+            kdb.obj_root.find('.//Entry/String/Value')._setText('changed')
+            kdb.save(out)
+        self.assertEqual(self.entries(out)[0]['notes'], 'changed')
+        self.assertEqual(os.stat(out).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.tmp), ['out.kdbx'])
+
+    def test_save_failure(self):
+        out = path.join(self.tmp, 'out.kdbx')
+        shutil.copy(self.db, out)
+        with libkeepass.open(self.db, password=self.password) as kdb:
+            with mock.patch.object(kdb, 'write_xml',
+                                   side_effect=KeyError('fail')):
+                with self.assertRaises(KeyError):
+                    kdb.save(out)
+        with io.open(self.db, 'rb') as a, io.open(out, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+        self.assertEqual(os.listdir(self.tmp), ['out.kdbx'])
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+from os import path
+from unittest import mock
+
+from readkeepass import plugins, utils
+
+root_dir = path.dirname(path.dirname(path.abspath(__file__)))
+
+PLUGIN = '''
+"""A keepass-menu plugin"""
+def shout(username, password, *pargs, **kwargs):
+    """Print the username in capitals
+
+    Not the password."""
+    print(username.upper())
+
+def stdout(username, password, *pargs, **kwargs):
+    "Shadows the built-in"
+'''
+
+ENTRY_POINTS = '''
+[keepass_menu.output]
+shout = kpplugin:shout
+stdout = kpplugin:stdout
+'''
+
+SCRIPT = """
+import sys, json
+from readkeepass import rkp
+leaves = rkp.output.node_leaves
+imported = 'kpplugin' in sys.modules
+leaves['shout']('user', 'pass')
+print(json.dumps({'leaves': list(leaves), 'imported': imported,
+                  'doc': leaves['shout'].__doc__,
+                  'stdout': leaves['stdout'].__module__}))
+"""
+
+
+class TestPlugins(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.site = path.join(self.tmp, 'site')
+        dist = path.join(self.site, 'kpplugin-1.0.dist-info')
+        os.makedirs(dist)
+        with open(path.join(self.site, 'kpplugin.py'), 'w') as fh:
+            fh.write(PLUGIN)
+        with open(path.join(dist, 'METADATA'), 'w') as fh:
+            fh.write('Metadata-Version: 2.1\nName: kpplugin\nVersion: 1.0\n')
+        with open(path.join(dist, 'entry_points.txt'), 'w') as fh:
+            fh.write(ENTRY_POINTS)
+        self.index_path = path.join(self.tmp, 'cache', 'keepass-menu',
+                                    'plugins.json')
+
+    def run_code(self, script):
+        "Return the output of script, run with the plugin installed"
+        env = dict(os.environ, XDG_CACHE_HOME=path.join(self.tmp, 'cache'),
+                   PYTHONPATH=os.pathsep.join([root_dir, self.site]))
+        out = subprocess.check_output([sys.executable, '-c', script],
+                                      cwd=self.tmp, env=env)
+        return out.decode()
+
+    def run_script(self):
+        lines = self.run_code(SCRIPT).splitlines()
+        self.assertEqual(lines[0], 'USER')
+        return json.loads(lines[1])
+
+    def test_discover(self):
+        res = self.run_script()
+        self.assertEqual(res['leaves'][-1], 'shout')
+        self.assertEqual(res['doc'],
+                         'Print the username in capitals\n\nNot the password.')
+        # the built-in stdout is kept
+        self.assertEqual(res['stdout'], 'readkeepass.output')
+        with open(self.index_path) as fh:
+            index = json.load(fh)
+        self.assertEqual(index['groups']['keepass_menu.output'],
+                         [['shout', 'kpplugin:shout', res['doc']],
+                          ['stdout', 'kpplugin:stdout', 'Shadows the built-in']])
+
+        # the plugin is only imported when it is used
+        res = self.run_script()
+        self.assertFalse(res['imported'])
+        self.assertIn('shout', res['leaves'])
+
+    def test_import(self):
+        "Importing readkeepass neither imports plugins nor searches for them"
+        out = self.run_code("import sys, readkeepass\n"
+                            "print('kpplugin' in sys.modules)")
+        self.assertEqual(out.strip(), 'False')
+        self.assertFalse(path.exists(self.index_path))
+
+    def test_lookup(self):
+        "The first lookup of an unknown name searches the plugins"
+        index = plugins.PluginIndex(self.index_path)
+        node = utils.Node('output')
+        node.discover('keepass_menu.output', index)
+        entry_points = [('join', 'os.path:join')]
+        with mock.patch.object(plugins, '_entry_points',
+                               return_value=entry_points) as found:
+            self.assertIs(node.join.resolve(), path.join)
+            self.assertIn('join', node)
+            with self.assertRaises(AttributeError):
+                node.missing
+        self.assertEqual(found.call_count, 1)
+
+    def test_failed(self):
+        "Plugins failing to import are logged and searched again next time"
+        entry_points = [('broken', 'kpplugin_missing:broken'),
+                        ('join', 'os.path:join')]
+        with mock.patch.object(plugins, '_entry_points',
+                               return_value=entry_points) as found:
+            with self.assertLogs('readkeepass.plugins', 'WARNING') as logs:
+                backends = plugins.PluginIndex(self.index_path).backends(
+                    'keepass_menu.output')
+            self.assertEqual([x[0] for x in backends], ['join'])
+            self.assertIn('ModuleNotFoundError', logs.output[0])
+            with open(self.index_path) as fh:
+                self.assertEqual(json.load(fh)['groups'], {})
+            plugins.PluginIndex(self.index_path).backends('keepass_menu.output')
+        self.assertEqual(found.call_count, 2)
+
+    def test_key(self):
+        key = plugins.distributions_key([self.site])
+        self.assertEqual(key, plugins.distributions_key([self.site, '/nowhere']))
+        os.mkdir(path.join(self.site, 'other-2.0.dist-info'))
+        self.assertNotEqual(key, plugins.distributions_key([self.site]))
+
+    def test_stale_index(self):
+        "An index of other distributions is not used"
+        os.makedirs(path.dirname(self.index_path))
+        with open(self.index_path, 'w') as fh:
+            json.dump({'key': 'old', 'groups': {
+                'keepass_menu.output': [['gone', 'gone:gone', None]]}}, fh)
+        index = plugins.PluginIndex(self.index_path)
+        self.assertEqual(index.backends('keepass_menu.output'), [])
+        node = utils.Node('output')
+        node.discover('keepass_menu.output', index)
+        self.assertEqual(list(node.node_leaves), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
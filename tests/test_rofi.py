@@ -1,4 +1,10 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
 import unittest
+from unittest import mock
 from collections import OrderedDict
 from readkeepass import rofi, kdb
 from os import path
@@ -64,6 +70,167 @@ class TestBuildRofiInput(unittest.TestCase):
             self.assertEqual(entry.as_ntuple, res)
             pass
 
+    def test_rank(self):
+        entries = self.db.entries
+        rank = {entries[2].uuid: 2.0, entries[-1].uuid: 1.0}
+        result = rofi.build_rofi_input(self.db, rank=rank)
+        expected = [entries[2], entries[-1]] + \
+            [x for i, x in enumerate(entries[:-1]) if i != 2]
+        self.assertEqual([x.uuid for x in result.values()],
+                         [x.uuid for x in expected])
+        self.assertEqual(result.keys()[0], self.result.keys()[2])
+
+class TestMenuRows(unittest.TestCase):
+    "Test the index based selection of rows"
+    def test_duplicates(self):
+        rows = rofi.MenuRows(['a\nb', 'a\nb'], [1, 2])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows.get(b'1\n'), 2)
+        self.assertEqual(rofi._selected(rows, b'0'), ('a\nb', 1))
+        for output in (b'', b'-1', b'2', None):
+            self.assertEqual(rofi._selected(rows, output), ('', None))
+
+    def test_prepare(self):
+        d = OrderedDict([(' a+b\nc ', 1), ('d\ne', 2)])
+        cmd, entries, rows = rofi.prepare(d)
+        self.assertEqual(cmd[cmd.index('-format') + 1], 'i')
+        self.assertEqual(rows.keys(), ['a+b\nc', 'd\ne'])
+        self.assertEqual(entries.decode().split('+'),
+                         ['a\u02d6b\nc\n', 'd\ne'])
+
+
+class TestRenderRows(unittest.TestCase):
+    "Test the layout of the entries in the menu"
+    def render(self, *dicts):
+        return list(rofi.render_rows([kdb.KeePassEntry(d) for d in dicts]))
+
+    def test_columns(self):
+        rows = self.render(
+            {'title': 'a', 'url': 'a.com', 'username': 'me', 'groupname': 'G'},
+            {'title': 'a long title', 'notes': 'x'},
+        )
+        self.assertEqual(rows, [
+            '• A             (a.com)\n✉ me            [G]\n\n',
+            '• A long title\n\n»x«\n',
+        ])
+
+    def test_wide_characters(self):
+        rows = self.render({'title': '中文', 'url': 'u'},
+                           {'title': 'abcdefgh', 'url': 'v'})
+        self.assertEqual(rows[0].splitlines()[0], '• 中文      (u)')
+        self.assertEqual(rows[1].splitlines()[0], '• Abcdefgh  (v)')
+
+    def test_multiline(self):
+        # rows without any text disappear once a field has several lines
+        rows = self.render({'title': 't', 'notes': 'one\ntwo'},
+                           {'title': 'u', 'url': 'x'})
+        self.assertEqual(rows, ['• T\n»one\ntwo«\n', '• U      (x)\n'])
+
+    def test_memoized(self):
+        entry = kdb.KeePassEntry({'title': 't', 'url': 'u'})
+        list(rofi.render_rows([entry]))
+        rows = entry.memoize(('rofi', rofi.ENTRY_LAYOUT), None)
+        list(rofi.render_rows([entry]))
+        self.assertIs(entry.memoize(('rofi', rofi.ENTRY_LAYOUT), None), rows)
+
+
+FAKE_ROFI = '''#!{python}
+import os, sys
+args = sys.argv[1:]
+with open(os.environ['FAKE_ROFI_ARGS'], 'w') as fh:
+    fh.write(' '.join(args))
+select = os.environ.get('FAKE_ROFI_SELECT')
+if select is None:
+    sys.exit(1)
+sep = args[args.index('-sep') + 1] if '-sep' in args else '\\n'
+for i, entry in enumerate(sys.stdin.read().split(sep)):
+    if select in entry:
+        print(i if args[args.index('-format') + 1] == 'i' else entry)
+        break
+'''
+
+
+class TestStreamingMenu(unittest.TestCase):
+    "Test the streaming menu with a fake rofi executable"
+    @classmethod
+    def setUpClass(cls):
+        cls.kpdb = kdb.load(path.join(data_dir, 'db2.kdbx'),
+                            password='testpass1234')
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        fake = path.join(tmp, 'rofi')
+        with open(fake, 'w') as fh:
+            fh.write(FAKE_ROFI.format(python=sys.executable))
+        os.chmod(fake, 0o755)
+        self.args_file = path.join(tmp, 'args')
+        environ = mock.patch.dict(os.environ, FAKE_ROFI_ARGS=self.args_file,
+                                  PATH=tmp + os.pathsep + os.environ['PATH'])
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def test_select(self):
+        os.environ['FAKE_ROFI_SELECT'] = 'Netflix'
+        key, entry = rofi.launch_rofi_stream(iter([self.kpdb, self.kpdb]))
+        self.assertIn('Netflix', key)
+        self.assertEqual(entry.password, 'andchill')
+        with open(self.args_file) as fh:
+            args = fh.read().split()
+        self.assertIn('-async-pre-read', args)
+        self.assertEqual(args[args.index('-eh') + 1], '3')
+
+    def test_rows(self):
+        os.environ['FAKE_ROFI_SELECT'] = 'Netflix'
+        menu = rofi.StreamingMenu()
+        menu.start()
+        self.assertTrue(menu.add(self.kpdb))
+        key, entry = menu.finish()
+        self.assertEqual(menu.menu_rows.values(),
+                         [x.as_ntuple for x in self.kpdb.entries])
+        for row in menu.menu_rows.keys():
+            self.assertLessEqual(row.count('\n'), 2)
+
+    def test_exited(self):
+        menu = rofi.StreamingMenu()
+        menu.start()
+        menu.process.wait()
+        self.assertFalse(menu.add(self.kpdb))
+        self.assertEqual(menu.finish(), ('', None))
+
+    def test_exit_while_loading(self):
+        "rofi closing returns at once, not after the slowest database"
+        release = threading.Event()
+        self.addCleanup(release.set)
+        closed = []
+
+        def keepass_dbs():
+            try:
+                yield self.kpdb
+                release.wait(30)
+                yield self.kpdb
+            finally:
+                closed.append(True)
+
+        thread = threading.Thread(
+            target=lambda: closed.append(rofi.launch_rofi_stream(keepass_dbs())))
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(closed, [('', None)])
+        release.set()
+
+    def test_load_error(self):
+        os.environ['FAKE_ROFI_SELECT'] = 'Netflix'
+
+        def keepass_dbs():
+            yield self.kpdb
+            raise IOError('wrong password')
+
+        with self.assertRaises(IOError):
+            rofi.launch_rofi_stream(keepass_dbs())
+
+
 if __name__ == '__main__':
     try:
         print('Running tests for {}'.format(__file__))
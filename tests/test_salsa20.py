@@ -0,0 +1,89 @@
+import unittest
+import os
+from unittest import mock
+
+from readkeepass.kdb.libkeepass import crypto, fastSalsa20, pureSalsa20
+
+# eSTREAM Salsa20/20 256-bit key, Set 1, vector# 0 (stream[0..63])
+set1_vector0 = {
+    'key': b'\x80' + bytes(31),
+    'iv': bytes(8),
+    'stream': bytes.fromhex(
+        'E3BE8FDD8BECA2E3EA8EF9475B29A6E7003951E1097A5C38D23B7A5FAD9F6844'
+        'B22C97559E2723C7CBBD3FE4FC8D9A0744652A83E72A9C461876AF4D7EF1A117'
+    ),
+}
+
+
+class SalsaVectors:
+    def test_known_vector(self):
+        s20 = fastSalsa20.Salsa20(set1_vector0['key'], set1_vector0['iv'])
+        stream = s20.encryptBytes(bytes(64))
+        self.assertEqual(stream, set1_vector0['stream'])
+
+    def test_same_as_pure(self):
+        for rounds in (8, 12, 20):
+            for key_len in (16, 32):
+                key, iv = os.urandom(key_len), os.urandom(8)
+                for length in (0, 1, 63, 64, 65, 1000):
+                    data = os.urandom(length)
+                    pure = pureSalsa20.Salsa20(key, iv, rounds)
+                    fast = fastSalsa20.Salsa20(key, iv, rounds)
+                    self.assertEqual(fast.encryptBytes(data),
+                                     pure.encryptBytes(data))
+                    self.assertEqual(fast.getCounter(), pure.getCounter())
+
+    def test_counter(self):
+        key, iv = os.urandom(32), os.urandom(8)
+        data = os.urandom(200)
+        for counter in (1, 2 ** 32 - 2, 2 ** 64 - 2):
+            pure = pureSalsa20.Salsa20(key, iv)
+            fast = fastSalsa20.Salsa20(key, iv)
+            pure.setCounter(counter)
+            fast.setCounter(counter)
+            self.assertEqual(fast.getCounter(), counter)
+            self.assertEqual(fast.encryptBytes(data), pure.encryptBytes(data))
+            self.assertEqual(fast.getCounter(), pure.getCounter())
+
+    def test_chunks(self):
+        key, iv = os.urandom(32), os.urandom(8)
+        data = os.urandom(64 * 5 + 7)
+        whole = fastSalsa20.Salsa20(key, iv).encryptBytes(data)
+        fast = fastSalsa20.Salsa20(key, iv)
+        chunked = fast.encryptBytes(data[:128]) + fast.encryptBytes(data[128:])
+        self.assertEqual(whole, chunked)
+        with self.assertRaises(AssertionError):
+            fast.encryptBytes(data)
+
+    def test_roundtrip(self):
+        key, iv = os.urandom(32), os.urandom(8)
+        data = os.urandom(1000)
+        enc = fastSalsa20.Salsa20(key, iv).encryptBytes(data)
+        self.assertEqual(fastSalsa20.Salsa20(key, iv).decryptBytes(enc), data)
+
+    def test_xor(self):
+        aa, bb = os.urandom(100), os.urandom(90)
+        expected = bytearray([a ^ b for a, b in zip(aa, bb)])
+        self.assertEqual(crypto.xor(aa, bb), expected)
+        self.assertIsInstance(crypto.xor(aa, bb), bytearray)
+        self.assertEqual(crypto.xor(b'', bb), bytearray())
+
+
+class TestFastSalsa20(unittest.TestCase, SalsaVectors):
+    """Salsa20 using NumPy lanes if NumPy is installed"""
+
+
+class TestFastSalsa20Python(unittest.TestCase, SalsaVectors):
+    """Salsa20 using the pure Python fallback"""
+    def setUp(self):
+        patcher = mock.patch.object(fastSalsa20, '_np', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+from os import path
+
+from readkeepass import kdb, search
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+ENTRIES = [
+    {'title': 'GitHub', 'username': 'me', 'groupname': 'Work'},
+    {'title': 'GitLab', 'username': 'me', 'groupname': 'Home'},
+    {'title': 'Mail', 'url': 'https://github.com/settings', 'groupname': 'Home'},
+    {'title': 'Bank', 'notes': 'github account recovery', 'groupname': 'Work'},
+    {'title': 'Workbench', 'username': 'admin', 'groupname': 'Home'},
+]
+
+
+class SearchMixin:
+    def setUp(self):
+        self.entries = [kdb.KeePassEntry(d) for d in ENTRIES]
+        self.index = search.SearchIndex(self.entries)
+
+    def titles(self, query, limit=10):
+        return [r.entry.as_dict['title'] for r in
+                self.index.search(query, limit)]
+
+    def test_ranking(self):
+        # title before url before notes
+        self.assertEqual(self.titles('github'), ['GitHub', 'Mail', 'Bank'])
+
+    def test_prefix(self):
+        # a title starting with the term before equal groups
+        self.assertEqual(self.titles('work'), ['Workbench', 'GitHub', 'Bank'])
+        # equal words before words starting with the term
+        prefix, = self.index.search('githu', limit=1)
+        self.assertEqual(prefix.entry.as_dict['title'], 'GitHub')
+        self.assertLess(prefix.score, 1.0)
+
+    def test_typo(self):
+        self.assertEqual(self.titles('githb')[0], 'GitHub')
+
+    def test_all_terms(self):
+        self.assertEqual(self.titles('github work'), ['GitHub', 'Bank'])
+        self.assertEqual(self.titles('gitlab work'), [])
+
+    def test_abbreviation(self):
+        self.assertEqual(self.titles('gh work'), ['GitHub', 'Bank'])
+
+    def test_scores(self):
+        results = self.index.search('github', limit=2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0].score, 1.0)
+        self.assertGreater(results[0].score, results[1].score)
+        self.assertEqual(self.index.search('  '), [])
+        self.assertEqual(self.index.search('github', limit=0), [])
+
+
+class TestSearchIndex(SearchMixin, unittest.TestCase):
+    pass
+
+
+class TestSearchIndexPython(SearchMixin, unittest.TestCase):
+    "The same tests without NumPy"
+    def setUp(self):
+        patcher = mock.patch.object(search, '_np', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+
+class TestSearchDB(unittest.TestCase):
+    def test_search(self):
+        kpdb = kdb.load(path.join(data_dir, 'db2.kdbx'), password='testpass1234')
+        result, = search.search(kpdb, 'netflix', limit=1)
+        self.assertEqual(result.entry.as_dict['password'], 'andchill')
+
+    def test_protected(self):
+        kpdb = kdb.load(path.join(data_dir, 'db2.kdbx'),
+                        password='testpass1234', lazy=True)
+        # passwords are neither indexed nor decrypted
+        self.assertEqual(search.search(kpdb, 'andchill'), [])
+
+
+if __name__ == '__main__':
+    try:
+        print('Running tests for {}'.format(__file__))
+    except NameError:
+        pass
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+from os import path
+
+root_dir = path.dirname(path.dirname(path.abspath(__file__)))
+
+# modules that only the graphical backends and the keyring need
+HEAVY = ('gi', 'tkinter', 'pyautogui', 'secretstorage', 'dbus', 'jeepney')
+# seconds for importing keepass-menu and parsing the arguments, it is
+# about 0.3 s on a slow machine
+BUDGET = 2.0
+
+SCRIPT = """
+import io, sys, json, contextlib
+from time import perf_counter
+start = perf_counter()
+from readkeepass import rkp
+from keepass_menu import parser
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        parser.get_args(output=rkp.output.node_leaves,
+                        pw_query=rkp.userinput.node_leaves,
+                        test_args=sys.argv[1:])
+    except SystemExit:
+        pass
+    rkp.GrabCredentials(pw_query='stdin', use_keyring=False)
+    rkp.output.stdout('user', 'pass')
+seconds = perf_counter() - start
+print(json.dumps({'seconds': seconds, 'modules': sorted(sys.modules)}))
+"""
+
+
+def startup(*args, env=None):
+    "Return the seconds and the modules of starting keepass-menu with args"
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT] + list(args),
+                                  cwd=root_dir, env=env)
+    res = json.loads(out.decode())
+    return res['seconds'], set(res['modules'])
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        # importing readkeepass writes the plugin index here, not to the
+        # user's cache
+        self.cache = path.join(tmp, 'cache')
+        self.env = dict(os.environ, XDG_CACHE_HOME=self.cache)
+
+    def startup(self, *args):
+        seconds, modules = startup(*args, env=self.env)
+        self.assertTrue(path.exists(
+            path.join(self.cache, 'keepass-menu', 'plugins.json')))
+        return seconds, modules
+
+    def assertLight(self, modules):
+        loaded = [m for m in modules if m.split('.')[0] in HEAVY]
+        self.assertEqual(loaded, [])
+
+    def test_help(self):
+        seconds, modules = self.startup('--help')
+        self.assertLight(modules)
+        self.assertLess(seconds, BUDGET)
+
+    def test_stdout(self):
+        seconds, modules = self.startup('-o', 'stdout', '-pw', 'stdin',
+                                        '-f', 'db.kdbx')
+        self.assertLight(modules)
+        self.assertNotIn('readkeepass.output.gui', modules)
+        self.assertNotIn('readkeepass.userinput.gui', modules)
+        self.assertLess(seconds, BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()